@@ -1,10 +1,13 @@
-import googlemaps
 import json
+from bisect import bisect_right
+import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
-import mpu
 
+import maps_client
 import speedlimit
+from trip import from_data, open_trips
 
 
 def smooth(speed, box_pts):
@@ -21,24 +24,32 @@ def smooth(speed, box_pts):
     return speed_smooth
 
 
-def calculate_speed_google(lat, long, time):
-    """Calculate a list of speed between two points by using Google API
+def calculate_speed_google(lat, long, time, engine=None):
+    """Calculate a list of speed between two points by using Google API, or the local road distance engine
 
     :param lat: a list of latitude
     :type lat: list
     :param long: a list of longitude
     :type long: list
     :param time: a list of timestamp
+    :param engine: a roadnet.RoadDistanceEngine, the road distance is calculated locally if it is given
+                   (the haversine distance where a point is not on the road network)
     :return: a list of speed that the length is equal to input
     """
-    gmap = googlemaps.Client(key='your Google API key')
+    if engine is not None:
+        distance = road_distances(engine, lat[:-1], long[:-1], lat[1:], long[1:])
+        t = np.diff(np.asarray(time))
+        speed = distance / np.where(t == 0, 1, t)
+        return np.concatenate((speed[:1], speed)).tolist()
+
+    gmap = maps_client.get_client()
+    pairs = [([lat[i], long[i]], [lat[i + 1], long[i + 1]]) for i in range(len(lat) - 1)]
+    results = gmap.directions_many(pairs)                                      # sent concurrently
     speed = []
     speed.append(0)
     for i in range(len(lat) - 1):
         t = time[i + 1] - time[i]                                              # time interval
-        start_point = [lat[i], long[i]]
-        end_point = [lat[i + 1], long[i + 1]]
-        direction_result = gmap.directions(start_point, end_point, mode="driving")
+        direction_result = results[i]
         string = direction_result[0]['legs'][0]['distance']['text']
         sp = float(string.split()[0]) * 0.3048 / t                             # Covert unit from ft to m
         speed.append(sp)
@@ -64,8 +75,47 @@ def RMSE(speed_cal, speed):
     return error
 
 
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """Calculate the haversine distance between two points or two arrays of points in a single operation,
+       the same formula as mpu.haversine_distance
+
+    :param lat1: start point latitude
+    :param lon1: start point longitude
+    :param lat2: end point latitude
+    :param lon2: end point longitude
+    :return: distance (m), float or array
+    """
+    lat1, lon1, lat2, lon2 = (np.asarray(v, dtype=np.float64) for v in (lat1, lon1, lat2, lon2))
+    dlat = np.radians(lat2 - lat1)
+    dlon = np.radians(lon2 - lon1)
+    a = np.sin(dlat / 2) * np.sin(dlat / 2) + \
+        np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.sin(dlon / 2) * np.sin(dlon / 2)
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return 6371000 * c
+
+
+def segment_speed(lat, long, time, index=None):
+    """Calculate the speed of the segments i -> i + 1 in a single operation,
+       if time interval less than 1 second set it to one
+
+    :param lat: a list of latitude
+    :param long: a list of longitude
+    :param time: a list of timestamp
+    :param index: the start point of the segments, None means every segment
+    :return: an array of speed (m/s)
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    long = np.asarray(long, dtype=np.float64)
+    time = np.asarray(time)
+    if index is None:
+        index = np.arange(len(lat) - 1)
+    t = time[index + 1] - time[index]
+    t = np.where(t == 0, 1, t)
+    return haversine_distance(lat[index], long[index], lat[index + 1], long[index + 1]) / t
+
+
 def calculate_speed_cal(lat, long, time):
-    """Calculate a list of speed between two points by using mpu (the linear distance between two points)
+    """Calculate a list of speed between two points by using the haversine (the linear distance between two points)
 
     :param lat: a list of latitude
     :type lat: list
@@ -74,32 +124,26 @@ def calculate_speed_cal(lat, long, time):
     :param time: a list of timestamp
     :return: a list of speed that the length is equal to input
     """
-    speed = []
-    speed.append(0)
-    for i in range(len(lat) - 1):
-        t = time[i + 1] - time[i]
-        lat1 = lat[i]
-        lon1 = long[i]
-        lat2 = lat[i + 1]
-        lon2 = long[i + 1]
-        dist = mpu.haversine_distance((lat1, lon1), (lat2, lon2)) * 1000
-        speed.append(dist / t)
-    speed[0] = speed[1]
-
-    return speed
+    speed = segment_speed(lat, long, time)
+    speed = np.concatenate((speed[:1], speed))                                 # the first point didn't have
+    return speed.tolist()                                                      # forward point, use the second
 
 
-def google_speed(lat1, lon1, lat2, lon2, time):
-    """Calculate the single speed between two points by using Google API
+def google_speed(lat1, lon1, lat2, lon2, time, engine=None):
+    """Calculate the single speed between two points by using Google API, or the local road distance engine
 
     :param lat1: start point latitude
     :param lon1: start point longitude
     :param lat2: end point latitude
     :param lon2: end point longitude
     :param time: time interval (second)
+    :param engine: a roadnet.RoadDistanceEngine, the road distance is calculated locally if it is given
     :return: speed , float
     """
-    gmap = googlemaps.Client(key='your Google API key')
+    if engine is not None:
+        return float(road_distances(engine, [lat1], [lon1], [lat2], [lon2])[0]) / time
+
+    gmap = maps_client.get_client()
     start_point = [lat1, lon1]
     end_point = [lat2, lon2]
     direction_result = gmap.directions(start_point, end_point, mode="driving")
@@ -109,7 +153,7 @@ def google_speed(lat1, lon1, lat2, lon2, time):
 
 
 def cal_speed(lat1, lon1, lat2, lon2, time):
-    """Calculate the single speed between two points by using mpu
+    """Calculate the single speed between two points by using the haversine
 
         :param lat1: start point latitude
         :param lon1: start point longitude
@@ -118,7 +162,7 @@ def cal_speed(lat1, lon1, lat2, lon2, time):
         :param time: time interval (second)
         :return: speed , float
     """
-    dist = mpu.haversine_distance((lat1, lon1), (lat2, lon2)) * 1000
+    dist = haversine_distance(lat1, lon1, lat2, lon2)
     res = dist / time
     return res
 
@@ -126,39 +170,26 @@ def cal_speed(lat1, lon1, lat2, lon2, time):
 def fill_speed(speed, time, lat, long):
     """Filling out the missing speed point, this function will check every point in given list
        if the speed = None or 0, I will recalculate the speed
+       all of the missing points are recalculated in a single operation
 
     :param speed: a list of speed
     :param time: a list of timestamp
     :param lat: a list of latitude
     :param long: a list of longitude
-    :return: a list of speed after filling out
-    """
-    speed_revise_number = 0
-    no_smooth = 0
-    for i in range(len(speed) - 1):
-        if speed[i] == None:
-            speed_revise_number += 1        # count the number of speed point calculate
-            t = time[i + 1] - time[i]
-            if t == 0: t = 1                # if time interval less than 1 second set it to one
-            res = cal_speed(lat[i], long[i], lat[i + 1], long[i + 1], t)
-            if res < 0.1: res = 0           # if calculated speed less tham 0.1m/s set it to zero
-            speed[i] = res
-            no_smooth = 1
-        else:
-            if speed[i] <= 0:
-                speed_revise_number += 1
-                t = time[i + 1] - time[i]
-                if t == 0: t = 1
-                res = cal_speed(lat[i], long[i], lat[i + 1], long[i + 1], t)
-                if res < 0.1: res = 0
-                speed[i] = res
-
-    if speed[-1] == None:
-        speed[-1] = speed[-2]
-    if speed[-1] <= 0:
+    :return: an array of speed after filling out
+    """
+    speed = np.array(speed, dtype=np.float64)       # None -> NaN
+    missing = np.isnan(speed[:-1])
+    revise = np.flatnonzero(missing | (speed[:-1] <= 0))
+    if len(revise) > 0:
+        res = segment_speed(lat, long, time, revise)
+        res[res < 0.1] = 0                          # if calculated speed less tham 0.1m/s set it to zero
+        speed[revise] = res
+
+    if np.isnan(speed[-1]) or speed[-1] <= 0:
         speed[-1] = speed[-2]
 
-    if no_smooth == 0:
+    if not missing.any():                           # only smooth when no speed point is missing
         speed = smooth(speed, 3)
 
     return speed
@@ -167,26 +198,23 @@ def fill_speed(speed, time, lat, long):
 def fill_heading(heading):
     """Filling out the missing heading point, this function will check out every point in the given list
        if the heading = None, I will fill out the missing heading
+       the leading & trailing gaps take the nearest heading, the interior gaps are interpolated on the circle
+       (350 & 10 are filled with 0, not 180), np.unwrap(..., period=360) needs numpy 1.21 or later
+       every point of a gap gets its own interpolated heading, the earlier version carried the previous heading
+       forward & averaged only the last point of a gap with the next heading
 
     :param heading: a list of heading angle
-    :return: a list of heading after filling out
-    """
-    headnone = False
-    if heading[0] == None:
-        headnone = True
-    for i in range(len(heading) - 1):
-        if headnone == True:
-            if heading[i] != None:
-                heading[0:i] = [heading[i]] * i
-                headnone = False
-        else:
-            if heading[i] == None:
-                if heading[i + 1] == None:
-                    heading[i] = heading[i - 1]
-                else:
-                    heading[i] = (heading[i - 1] + heading[i + 1]) / 2
-    if heading[-1] == None:
-        heading[-1] = heading[-2]
+    :return: an array of heading after filling out
+    """
+    heading = np.array(heading, dtype=np.float64)   # None -> NaN
+    valid = ~np.isnan(heading)
+    index = np.flatnonzero(valid)
+    if len(index) == 0 or len(index) == len(heading):
+        return heading
+
+    missing = np.flatnonzero(~valid)
+    unwrapped = np.unwrap(heading[index], period=360)
+    heading[missing] = np.interp(missing, index, unwrapped) % 360
     return heading
 
 
@@ -205,7 +233,7 @@ def organize_data(data):
         value[2] = fill_speed(value[2], value[4], value[0], value[1])
         value[3] = fill_heading(value[3])
 
-        if value[3][0] == None:
+        if np.isnan(value[3][0]):
             delkey.append(key)
         else:
             if np.mean(value[3]) == 0:
@@ -216,6 +244,28 @@ def organize_data(data):
     return data
 
 
+def start_end_pairs(starts, ends):
+    """Resolve the start & end state machine of the detectors on the candidate points only,
+       a start opens when no start is open, the first end after it closes it
+
+    :param starts: an array of candidate start points (sorted)
+    :param ends: an array of candidate end points (sorted)
+    :return: a list of (start, end), a start without end is dropped
+    """
+    starts = starts.tolist()
+    ends = ends.tolist()
+    pairs = []
+    k, m = 0, 0
+    while k < len(starts):
+        start = starts[k]
+        m = bisect_right(ends, start, m)
+        if m == len(ends):
+            break
+        pairs.append((start, ends[m]))
+        k = bisect_right(starts, ends[m], k)
+    return pairs
+
+
 def find_turning(heading):
     """Use heading angle to find the turning maneuver
 
@@ -223,32 +273,21 @@ def find_turning(heading):
     :return breakpoint:a list of start point & end point of the turning [start,end,start,end,start,end]
     :return number : the count of the turning
     """
+    heading = np.asarray(heading, dtype=np.float64)
+    return _find_turning(heading, np.abs(np.diff(heading[:-1])))
+
+
+def _find_turning(heading, diff):
     breakpoint = []
-    start = 0
     number = 0
-    for i in range(len(heading) - 2):
-        diff = abs(heading[i + 1] - heading[i])
-        if diff > 19 and diff < 70 and start == 0:                              # if the angle change large than 19 less
-                                                                                # than 70 assume the turning began
-            if i - 2 < 0:
-                breakpoint.append(0)
-            else:
-                breakpoint.append(i - 2)
-            start = 1
-        if diff < 5 and start == 1:                                             # if the angle change less than 5 assume turning end
-
-            angle_diff = abs(heading[i + 1] - heading[breakpoint[-1]])          # if the angle change between start & end assume not turning
-
-            if (angle_diff < 30 or angle_diff > 150):
-                del breakpoint[-1]
-                start = 0
-                continue
-            else:
-                breakpoint.append(i + 2)
-                start = 0
-                number += 1
-    if len(breakpoint) % 2 != 0:
-        del breakpoint[-1]
+    starts = np.flatnonzero((diff > 19) & (diff < 70))     # if the angle change large than 19 less than 70 assume the turning began
+    ends = np.flatnonzero(diff < 5)                         # if the angle change less than 5 assume turning end
+    for start, end in start_end_pairs(starts, ends):
+        start = max(start - 2, 0)
+        angle_diff = abs(heading[end + 1] - heading[start])  # if the angle change between start & end assume not turning
+        if not (angle_diff < 30 or angle_diff > 150):
+            breakpoint += [start, end + 2]
+            number += 1
     return breakpoint, number
 
 
@@ -361,28 +400,18 @@ def find_ACC(speed, time):
     :return breakpoint:a list of start point & end point of the acceleration [start,end,start,end,start,end]
     :return number : the count of the acceleration
     """
+    return _find_ACC(np.diff(np.asarray(speed, dtype=np.float64)), time)
+
+
+def _find_ACC(diff, time):
     breakpoint = []
-    start = 0
     number = 0
-    for i in range(len(speed) - 1):
-        diff = speed[i + 1] - speed[i]
-        if diff > 3 and start == 0 and diff < 9:         # acceleration exceeds 3m per second
-            breakpoint.append(i)
-            start = 1
-        if diff < 2 and start == 1:
-
-            time_diff = time[i] - time[breakpoint[-1]]   # acceleration time interval
-
-            if time_diff > 2:
-                breakpoint.append(i)
-                start = 0
-                number += 1
-            else:
-                del breakpoint[-1]
-                start = 0
-                continue
-    if len(breakpoint) % 2 != 0 or len(breakpoint) == 1:
-        del breakpoint[-1]
+    starts = np.flatnonzero((diff > 3) & (diff < 9))       # acceleration exceeds 3m per second
+    ends = np.flatnonzero(diff < 2)
+    for start, end in start_end_pairs(starts, ends):
+        if time[end] - time[start] > 2:                     # acceleration time interval
+            breakpoint += [start, end]
+            number += 1
     return breakpoint, number
 
 
@@ -414,18 +443,14 @@ def find_hardbrake(speed, time):
     :return breakpoint:a list of the hardbrake
     :return number : the count of the hardbrake
     """
-    breakpoint = []
-    number = 0
-    td = 0
-    for i in range(len(speed) - 1):
-        t = time[i + 1] - time[i]
-        if t == 0: t = 1
-        diff = (speed[i] - speed[i + 1]) / t
-
-        if diff > 5 and diff < 8:
-            breakpoint.append(i)
-            number += 1
-    return breakpoint, number
+    return _find_hardbrake(np.diff(np.asarray(speed, dtype=np.float64)), np.diff(np.asarray(time)))
+
+
+def _find_hardbrake(speed_diff, time_diff):
+    t = np.where(time_diff == 0, 1, time_diff)
+    diff = -speed_diff / t
+    breakpoint = np.flatnonzero((diff > 5) & (diff < 8)).tolist()
+    return breakpoint, len(breakpoint)
 
 
 def find_dic_HB(data):
@@ -466,18 +491,40 @@ def total_time(data):
     return t_time
 
 
-def total_distance(data):
+def road_distances(engine, lat1, lon1, lat2, lon2):
+    """Calculate the road distance between the start & end points with the local road distance engine,
+       the haversine distance is used where a point is not on the road network or the end is not reachable
+
+    :param engine: a roadnet.RoadDistanceEngine
+    :param lat1: a list of start latitude
+    :param lon1: a list of start longitude
+    :param lat2: a list of end latitude
+    :param lon2: a list of end longitude
+    :return: an array of distance (m)
+    """
+    lat1, lon1 = np.asarray(lat1, dtype=np.float64), np.asarray(lon1, dtype=np.float64)
+    lat2, lon2 = np.asarray(lat2, dtype=np.float64), np.asarray(lon2, dtype=np.float64)
+    distance = engine.distances(lat1, lon1, lat2, lon2)
+    return np.where(np.isnan(distance), haversine_distance(lat1, lon1, lat2, lon2), distance)
+
+
+def total_distance(data, engine=None):
     """Calculate the total distance in data
 
     :param data: the dict of data
+    :param engine: a roadnet.RoadDistanceEngine, the road distance (m) of every trip is calculated locally
+                   if it is given
     :return: the total distance
     """
-    gmap = googlemaps.Client(key='your Google API key')
+    if engine is not None:
+        trips = [value for value in data.values() if len(value[0]) > 0]
+        return float(np.sum(road_distances(engine, [value[0][0] for value in trips], [value[1][0] for value in trips],
+                                           [value[0][-1] for value in trips], [value[1][-1] for value in trips])))
+
+    gmap = maps_client.get_client()
+    pairs = [([value[0][0], value[1][0]], [value[0][-1], value[1][-1]]) for value in data.values()]
     t_distance = 0
-    for key, value in data.items():
-        start_point = [value[0][0], value[1][0]]
-        end_point = [value[0][-1], value[1][-1]]
-        direction_result = gmap.directions(start_point, end_point, mode="driving")
+    for direction_result in gmap.directions_many(pairs):                     # sent concurrently
         if direction_result != []:
             string = direction_result[0]['legs'][0]['distance']['text']
             sp = float(string.split()[0])
@@ -485,57 +532,60 @@ def total_distance(data):
     return t_distance
 
 
-def over_speed_limit(lat, long, speed, time):
+def over_speed_limit(lat, long, speed, time, speed_limit=None, report=None, assign=None):
     """Calculate the speeding duration & Speeding ration
 
     :param lat: a list of latitude
     :param long: a list of longitude
     :param speed: a list of speed
     :param time: a list of time
+    :param speed_limit: the (speedlimit_list, call_api) of speedlimit.path_speed_limit if it is already queried
+    :param report: a dict filled with the sampling report of the speed limit query points
+    :param assign: how a point takes the speed limit of the query points, "ahead" or "nearest", the assign of
+                   the query points by default (ahead for a plain list), see speedlimit.point_speed_limits
     :return over_time: the count of location point speeding
     :return overspeed: the sum of speeding ration, float
     :return duration: Speeding duration (second)
     """
-    gmap = googlemaps.Client(key='your Google API key')
-    over_time = 0
-    overspeed = 0
-    temp = 0
-    duration = 0
-    ovsp_start = False
-    sL = float('Inf')
-    j = 0
-
-    speedlimit_list, call_api = speedlimit.path_speed_limit(lat, long, speed)
-    if len(speedlimit_list) > 0:
-        for i in range(len(speed)-1):
-            if i > call_api[j]:
-                if j<len(call_api)-1:
-                    j += 1
-                else:
-                    j = len(call_api)-1
-
-            if j > len(speedlimit_list)-1:
-                j = len(speedlimit_list)-1
-
-            sL = speedlimit_list[j]
-
-            if sL < speed[i] and speed[i + 1] > sL and ovsp_start == False:
-                start_time = time[i]
-                over_time += 1
-                overspeed +=  (speed[i] - sL) /sL
-                ovsp_start = True
-            elif sL > speed[i] and ovsp_start == True:
-                end_time = time[i]
-                duration += end_time - start_time
-                ovsp_start = False
-
+    if speed_limit is None:
+        speed_limit = speedlimit.path_speed_limit(lat, long, speed, report=report)
+    speedlimit_list, call_api = speed_limit
+    if len(speedlimit_list) == 0 or len(speed) < 2:
+        return 0, 0, 0
+    sL = speedlimit.point_speed_limits(speedlimit_list, call_api, lat, long, assign)
+    return _over_speed_limit(np.asarray(speed, dtype=np.float64), np.asarray(time), sL)
+
+
+def _over_speed_limit(speed, time, sL):
+    # sL is the speed limit of every point but the last
+    start = (sL < speed[:-1]) & (speed[1:] > sL)
+    end = sL > speed[:-1]
+
+    # a speeding starts at the first start point after an end & ends at the first end point after a start
+    event = np.flatnonzero(start | end)
+    is_start = start[event]
+    if not is_start.any():
+        return 0, 0, 0
+    first = np.argmax(is_start)
+    event, is_start = event[first:], is_start[first:]
+    keep = np.concatenate(([True], is_start[1:] != is_start[:-1]))
+    starts = event[keep & is_start]
+    ends = event[keep & ~is_start]
+
+    over_time = len(starts)
+    overspeed = sum(((speed[starts] - sL[starts]) / sL[starts]).tolist())
+    duration = sum((time[ends] - time[starts[:len(ends)]]).tolist())
     return over_time, overspeed, duration
 
 
-def find_dic_over(data):
+def find_dic_over(data, report=None, speed_limits=None):
     """Find the speeding duration & ratio & the count of speeding location points
 
     :param data:the dict of data
+    :param report: a dict filled with the sampling report of the speed limit query points of every task,
+                   see speedlimit.sampling_report
+    :param speed_limits: a dict of (speedlimit_list, call_api) of every task if it is already known,
+                         e.g. mapmatch.matched_speed_limits
     :return dict_ov: a dict of [overspeed, over_time, duration]
                 key: task is
                 value : an array including [overspeed, over_time, duration]
@@ -547,8 +597,9 @@ def find_dic_over(data):
     total_duration = 0
     total_overspeed = 0
     total_times = 0
-    for key, value in data.items():
-        over_time, overspeed, duration = over_speed_limit(value[0], value[1], value[2], value[4])
+    speed_limits = query_speed_limits(data, report, speed_limits)
+    for (key, value), speed_limit in zip(data.items(), speed_limits):
+        over_time, overspeed, duration = over_speed_limit(value[0], value[1], value[2], value[4], speed_limit)
         total_duration += duration
         total_overspeed += overspeed
         total_times += over_time
@@ -556,6 +607,86 @@ def find_dic_over(data):
     return dict_ov, total_duration, total_overspeed, total_times
 
 
+def find_maneuver(speed, heading, time):
+    """Find the turning & hard brake & acceleration maneuver of the trip, the speed / heading / time differences
+       are computed once and shared by the detectors, the thresholds are the same as find_turning,
+       find_hardbrake and find_ACC
+
+    :param speed: a list of speed
+    :param heading: a list of heading angle
+    :param time: a list of timestamp
+    :return: [turning breakpoint, turning number], [hardbrake breakpoint, hardbrake number],
+             [acceleration breakpoint, acceleration number]
+    """
+    heading = np.asarray(heading, dtype=np.float64)
+    time = np.asarray(time)
+    speed_diff = np.diff(np.asarray(speed, dtype=np.float64))
+    heading_diff = np.abs(np.diff(heading))
+
+    turning = _find_turning(heading, heading_diff[:-1])
+    hb = _find_hardbrake(speed_diff, np.diff(time))
+    acc = _find_ACC(speed_diff, time)
+    return list(turning), list(hb), list(acc)
+
+
+def query_speed_limits(data, report=None, speed_limits=None):
+    """Query the speed limit of every task at once, see speedlimit.path_speed_limit_many
+
+    :param data: the dict of data
+    :param report: a dict filled with the sampling report of the speed limit query points of every task
+    :param speed_limits: a dict of (speedlimit_list, call_api) of every task if it is already known
+    :return: a list of (speedlimit_list, call_api) in the order of the data
+    """
+    if speed_limits is not None:
+        return [speed_limits[key] for key in data]
+    reports = None if report is None else [{} for key in data]
+    result = speedlimit.path_speed_limit_many([(value[0], value[1], value[2]) for value in data.values()],
+                                              reports=reports)
+    if report is not None:
+        report.update(zip(data, reports))
+    return result
+
+
+def find_dic_maneuver(data, report=None, speed_limits=None):
+    """Find the turning & hard brake & acceleration & speeding of every task in a single pass over the data,
+       the result is the same as find_dic_turning, find_dic_HB, find_dic_ACC and find_dic_over
+
+    :param data: the dict of data
+    :param report: a dict filled with the sampling report of the speed limit query points of every task
+    :param speed_limits: a dict of (speedlimit_list, call_api) of every task if it is already known
+    :return: dict_turning, turning_number, dict_hb, hb_number, dict_acc, acc_number,
+             dict_ov, ov_duration, total_ov, total_times
+    """
+    dict_turning, dict_hb, dict_acc, dict_ov = {}, {}, {}, {}
+    turning_number, hb_number, acc_number = 0, 0, 0
+    ov_duration, total_ov, total_times = 0, 0, 0
+    speed_limits = query_speed_limits(data, report, speed_limits)
+    for (key, value), speed_limit in zip(data.items(), speed_limits):
+        turning, hb, acc = find_maneuver(value[2], value[3], value[4])
+
+        turning_number += turning[1]
+        if len(turning[0]) != 0:
+            dict_turning[key] = turning
+
+        if len(hb[0]) > 0 and hb[0][0] == 0:
+            del hb[0][0]
+            hb[1] -= 1
+        hb_number += hb[1]
+        dict_hb[key] = hb
+
+        acc_number += acc[1]
+        dict_acc[key] = acc
+
+        over_time, overspeed, duration = over_speed_limit(value[0], value[1], value[2], value[4], speed_limit)
+        ov_duration += duration
+        total_ov += overspeed
+        total_times += over_time
+        dict_ov[key] = [overspeed, over_time, duration]
+
+    return dict_turning, turning_number, dict_hb, hb_number, dict_acc, acc_number, \
+        dict_ov, ov_duration, total_ov, total_times
+
+
 def open_file(filename):
     """Read the json file to the dict data
 
@@ -568,22 +699,188 @@ def open_file(filename):
     return data
 
 
+def iter_file(filename, chunk_size=1 << 20):
+    """Read the json file incrementally and yield one task at a time, the file is never loaded as a whole
+
+    :param filename: the filename you want to read
+    :param chunk_size: the number of characters read at a time
+    :return: a generator of (task id, [latitude, longitude, speed, heading, time])
+    """
+    decoder = json.JSONDecoder()
+    with open(filename + '.json') as json_file:
+        buffer = ''
+        position = 0
+        eof = False
+
+        def refill():
+            nonlocal buffer, position, eof
+            more = json_file.read(max(chunk_size, len(buffer) - position))   # grow with the value being parsed
+            if more == '':
+                eof = True
+            buffer = buffer[position:] + more
+            position = 0
+
+        def skip_whitespace():
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position].isspace():
+                    position += 1
+                if position < len(buffer) or eof:
+                    return
+                refill()
+
+        def expect(character):
+            nonlocal position
+            skip_whitespace()
+            if position >= len(buffer) or buffer[position] != character:
+                raise ValueError("Expecting '" + character + "' in " + filename + '.json')
+            position += 1
+
+        def decode():
+            nonlocal position
+            skip_whitespace()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, position)
+                    # a number at the end of the buffer may be cut, e.g. "1." of "1.5" is read as 1
+                    if eof or (end < len(buffer) and buffer[end] not in '0123456789.eE+-'):
+                        position = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                refill()
+
+        expect('{')
+        skip_whitespace()
+        if position < len(buffer) and buffer[position] == '}':
+            return
+        while True:
+            key = decode()
+            expect(':')
+            value = decode()
+            yield key, value
+
+            skip_whitespace()
+            if position < len(buffer) and buffer[position] == '}':
+                return
+            expect(',')
+
+
 def get_info(data):
     """Calculate the Speeding & turning & Hard brake & Acceleration
 
     :param data: the dict of data
     :return:
     """
-    dict_turning, turning_number = find_dic_turning(data)
-    print("Turing detect finished---------------------------------------------")
-    dict_hb, hb_number = find_dic_HB(data)
-    print("Hard brake detect finished-----------------------------------------")
-    dict_acc, acc_number = find_dic_ACC(data)
-    print("Acceleration detect finished---------------------------------------")
-    dict_ov, ov_duration, total_ov, total_times = find_dic_over(data)
-    print("Speeding detect finished-------------------------------------------")
+    dict_turning, turning_number, dict_hb, hb_number, dict_acc, acc_number, \
+        dict_ov, ov_duration, total_ov, total_times = find_dic_maneuver(data)
+    print("Turing & Hard brake & Acceleration & Speeding detect finished------")
     return dict_turning, turning_number, dict_hb, hb_number, dict_acc, acc_number, ov_duration, total_ov, total_times
 
+_matcher = None
+
+
+def _set_matcher(matcher):
+    """Set the map matcher of this worker process, called by _init_worker, the matcher is sent once to every worker"""
+    global _matcher
+    _matcher = matcher
+
+
+def _worker_settings():
+    """The speed limit settings of this process (set_provider, enable_cache & set_sampling) sent to the workers"""
+    cache = speedlimit.cache
+    cache_options = None if cache is None else (cache.path, cache.precision, cache.ttl, cache.flush_every)
+    return speedlimit.provider, cache_options, dict(speedlimit.sampling)
+
+
+def _init_worker(matcher, limiter, settings):
+    """Initializer of the organize_and_get_info workers, the workers share the Google API rate limiter of the parent
+       and take its speed limit provider & cache & sampling, a spawned (or forkserver) worker does not inherit them
+    """
+    _set_matcher(matcher)
+    maps_client.set_shared_limiter(limiter)
+    provider, cache_options, sampling = settings
+    speedlimit.set_provider(provider)
+    if cache_options is not None:
+        speedlimit.enable_cache(*cache_options)
+    speedlimit.set_sampling(**sampling)
+
+
+def _organize_and_detect(shard, report=False):
+    """Worker of organize_and_get_info, organize & (map match &) detect a shard of trips
+       only the cleaned speed & heading, the detection results, the sampling report & the matched roads are sent back
+    """
+    keys = list(shard)
+    shard = organize_data(shard)
+    cleaned = {key: (value[2], value[3]) for key, value in shard.items()}
+    dropped = [key for key in keys if key not in shard]
+    shard_report = {} if report else None
+    matched, speed_limits = None, None
+    if _matcher is not None:
+        import mapmatch
+        matched = mapmatch.match_data(shard, _matcher)
+        speed_limits = mapmatch.matched_speed_limits(_matcher.network, matched)
+    detected = find_dic_maneuver(shard, shard_report, speed_limits)
+    if speedlimit.cache is not None:
+        speedlimit.cache.flush()            # the counters of a worker are written once per shard
+    return dropped, cleaned, detected, shard_report, matched
+
+
+def organize_and_get_info(data, processes=None, shard_size=64, report=None, matcher=None, matched=None,
+                          mp_context=None):
+    """Organize the data & calculate the Speeding & turning & Hard brake & Acceleration on a process pool,
+       the trips are split into shards and every shard is cleaned & detected on a worker,
+       the results are merged in the order of the data, the workers share one Google API rate limit
+       (maps_client.shared_limiter) instead of taking the qps each and use the speed limit provider & cache &
+       sampling of this process, whatever the start method of the pool
+
+    :param data: the dict of data
+    :param processes: the number of worker processes, None means the number of CPUs
+    :param shard_size: the number of trips sent to a worker at a time
+    :param report: a dict filled with the sampling report of the speed limit query points of every task
+    :param matcher: a mapmatch.MapMatcher, the trips are map matched after organize_data and the speed limit
+                    is taken from the matched roads
+    :param matched: a dict filled with the matched roads of every task, see mapmatch.match_data
+    :param mp_context: the multiprocessing context of the pool, the default start method by default
+    :return data: the dict of data after processing, the same as organize_data
+    :return: dict_turning, turning_number, dict_hb, hb_number, dict_acc, acc_number, ov_duration, total_ov,
+             total_times, the same as get_info
+    """
+    items = list(data.items())
+    shards = [dict(items[i:i + shard_size]) for i in range(0, len(items), shard_size)]
+
+    dict_turning, dict_hb, dict_acc = {}, {}, {}
+    turning_number, hb_number, acc_number = 0, 0, 0
+    ov_duration, total_ov, total_times = 0, 0, 0
+    with ProcessPoolExecutor(processes, mp_context=mp_context, initializer=_init_worker,
+                             initargs=(matcher, maps_client.shared_limiter(), _worker_settings())) as executor:
+        for dropped, cleaned, info, shard_report, shard_matched in executor.map(
+                _organize_and_detect, shards, [report is not None] * len(shards)):
+            if report is not None and shard_report is not None:
+                report.update(shard_report)
+            if matched is not None and shard_matched is not None:
+                matched.update(shard_matched)
+            for key in dropped:
+                del data[key]
+            for key, (speed, heading) in cleaned.items():
+                data[key][2] = speed
+                data[key][3] = heading
+
+            dict_turning.update(info[0])
+            turning_number += info[1]
+            dict_hb.update(info[2])
+            hb_number += info[3]
+            dict_acc.update(info[4])
+            acc_number += info[5]
+            ov_duration += info[7]
+            total_ov += info[8]
+            total_times += info[9]
+
+    return data, (dict_turning, turning_number, dict_hb, hb_number, dict_acc, acc_number,
+                  ov_duration, total_ov, total_times)
+
+
 def store_database(turning_speed, hb_number, acc_number, ov_duration, total_ov, time, agent_id, fast_turn, total_times):
     df = pd.DataFrame([{
         '2fast turn number' : fast_turn,
@@ -656,12 +953,34 @@ def describe(dict_turning, data):
 
 def main():
     filename = input('Input filename: ')
-    data = open_file(str(filename))
+    if os.path.exists(str(filename) + '.trip.index'):
+        data = open_trips(str(filename))
+    else:
+        data = from_data(open_file(str(filename)))
     print("Load data finished-------------------------------------------------")
-    data_ogn = organize_data(data)
+    engine, matcher, matched = None, None, {}
+    if os.path.exists('Maneuver detect/roads.geojson'):
+        from roadnet import RoadNetwork, RoadDistanceEngine
+        from mapmatch import MapMatcher
+        network = RoadNetwork.from_geojson('Maneuver detect/roads.geojson')
+        speedlimit.set_provider(speedlimit.OfflineSpeedLimitProvider(network))
+        engine = RoadDistanceEngine(network)
+        matcher = MapMatcher(network)
+        print("Load road network finished-----------------------------------------")
+    speed_limit_cache = speedlimit.enable_cache('Maneuver detect/speed_limit_cache.sqlite')
+    sampling_report = {}
+    data_ogn, info = organize_and_get_info(data, report=sampling_report, matcher=matcher, matched=matched)
+    if matcher is not None:
+        points = sum(len(roads) for roads in matched.values())
+        print("Map matched points:", sum(road >= 0 for roads in matched.values() for road in roads), "/", points)
+    else:
+        print("Speed limit cache:", speed_limit_cache.stats())
+        print("Speed limit query points:", sum(r["points"] for r in sampling_report.values()),
+              "saved:", sum(r["saved"] for r in sampling_report.values()))
+    speed_limit_cache.close()
     print("Ticket number:", len(data_ogn))
-    print("Organize data finished---------------------------------------------")
-    dict_turning, turning_number, dict_hb, hb_number, dict_acc, acc_number, ov_duration, total_ov, total_times = get_info(data_ogn)
+    print("Organize data & detect finished------------------------------------")
+    dict_turning, turning_number, dict_hb, hb_number, dict_acc, acc_number, ov_duration, total_ov, total_times = info
     time = total_time(data_ogn)
     #distance = total_distance(data_ogn)
     print("HB:", hb_number)
@@ -672,6 +991,8 @@ def main():
     print('total_times', total_times)
     print('ratio', total_ov/total_times)
     #print("Distance", distance)
+    if engine is not None:
+        print("Road distance (m):", total_distance(data_ogn, engine))
 
     store_sp = input('Do you want to store the data to population database?(y/n)')
     if (str(store_sp) == 'y'):
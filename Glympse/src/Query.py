@@ -1,25 +1,76 @@
 import pymongo
 from pymongo import  MongoClient
-import googlemaps
 from datetime import datetime
 import json
+import os
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from bson import json_util
 
+import location_cache
+from location_cache import LocationCache
+from tripfile import TRIP_COLUMNS, append_trip, read_index, write_trip
+
+
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+
+
+def get_shared_client(uri, max_pool_size=100, connect_timeout_ms=20000, server_selection_timeout_ms=30000,
+                      socket_timeout_ms=None, read_preference="secondary"):
+    """ Take the process-wide pymongo client of the given uri & options, the client is generated at the first call
+         pymongo clients are thread safe but not fork safe, so every process keeps its own client
+
+    :param uri: The mongodb uri
+    :param max_pool_size: The maximum number of connections in the pool
+    :param connect_timeout_ms: The connect timeout (millisecond)
+    :param server_selection_timeout_ms: The server selection timeout (millisecond)
+    :param socket_timeout_ms: The socket timeout (millisecond), None means no timeout
+    :param read_preference: The read preference name
+    :rtype: a single pymongo client
+    """
+    key = (os.getpid(), uri, max_pool_size, connect_timeout_ms, server_selection_timeout_ms,
+           socket_timeout_ms, read_preference)
+    with _shared_clients_lock:
+        client = _shared_clients.get(key)
+        if client is None:
+            client = pymongo.MongoClient(uri,
+                                         maxPoolSize=max_pool_size,
+                                         connectTimeoutMS=connect_timeout_ms,
+                                         serverSelectionTimeoutMS=server_selection_timeout_ms,
+                                         socketTimeoutMS=socket_timeout_ms,
+                                         readPreference=read_preference,
+                                         connect=False)
+            _shared_clients[key] = client
+    return client
+
+
+def close_shared_clients():
+    """ Close every shared client generated by this process
+    """
+    with _shared_clients_lock:
+        for key in list(_shared_clients):
+            if key[0] == os.getpid():
+                _shared_clients.pop(key).close()
 
 
 class MongoClient:
 
-    def __init__(self, required_databases):
+    def __init__(self, required_databases, **client_options):
         """ Initialize the MongoClient
 
         :param required_databases: The database that the user wants to use
         :type required_databases: a list of databases, where a databases is a string
+        :param client_options: The pool size & timeouts & read preference passed to get_shared_client
         :rtype: A dict of client, which the database name is the key
 
         """
+        self.client_options = client_options
         self.mongo_clients = self._get_mongo_client_dict(required_databases)
 
     def _get_mongo_client(self, database):
-        """ Generate the single Client
+        """ Generate the single Client from the shared client pool
              readPreference :secondary
 
         :param database: The database that the we want to generate client
@@ -35,7 +86,7 @@ class MongoClient:
         uri = "mongodb://{}:{}@{}".format(username,
                                           password,
                                           hosts)
-        return pymongo.MongoClient(uri, readPreference="secondary").get_database(database)
+        return get_shared_client(uri, **self.client_options).get_database(database)
 
     def _get_mongo_client_dict(self, list_of_databases):
         """ Generate a dict of Client
@@ -64,15 +115,18 @@ class MongoClient:
 
 
 class Query:
-    def __init__(self, client):
+    def __init__(self, client, cache=None):
         """ Initialize the Query
 
         :param client: The client that the user wants to query
         :type client: a sigle client, where a client is a client type
+        :param cache: The on-disk location point cache, only the missing tasks are queried from the database
+        :type cache: a LocationCache or None
         :rtype: None
 
         """
         self.client = client
+        self.cache = cache
 
     def query_orgid(self, hierarchy):
         """ Find all relevant org_ids based on a specific hierarchy
@@ -82,19 +136,38 @@ class Query:
         :rtype: a list of org_id, which have the same hierarchy number
         """
 
-        list_of_orgs_ids = []
         query = {
             "hierarchy": hierarchy, "removed": {"$exists": False}
         }
-        cursor = self.client["tracking.agents"].find(query)
+        list_of_orgs_ids = self.client["tracking.agents"].distinct("org_id", query)
 
-        for org in cursor:
-            if org["org_id"] in list_of_orgs_ids:
-                continue
-            else:
-                list_of_orgs_ids.append(org["org_id"])
         return list_of_orgs_ids
 
+    def query_hierarchy(self, hierarchy):
+        """ Find all relevant org_ids and all of their agent ids based on a specific hierarchy
+             the org_id & agent_id are resolved by the server in a single aggregation
+
+        :param hierarchy: The hierarchy number that we want to get relevant org_ids
+        :type hierarchy: a single hierarchy number, where a hierarchy number is a integer
+        :rtype org_ids: a list of org_id, which have the same hierarchy number
+        :rtype agent_ids: a list of agent_id, which belong to those org_ids
+        """
+        pipeline = [
+            {"$match": {"hierarchy": hierarchy, "removed": {"$exists": False}}},
+            {"$group": {"_id": "$org_id"}},
+            # only the _id of the agents that are not removed is joined to every org_id
+            {"$lookup": {"from": "tracking.agents", "let": {"org_id": "$_id"}, "as": "agents", "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$org_id", "$$org_id"]}, "removed": {"$exists": False}}},
+                {"$project": {"_id": 1}}]}},
+            {"$unwind": "$agents"},                 # right after $lookup, so the server coalesces the two stages
+            {"$group": {"_id": None, "org_ids": {"$addToSet": "$_id"}, "agent_ids": {"$push": "$agents._id"}}}
+        ]
+        result = list(self.client["tracking.agents"].aggregate(pipeline))
+        if result == []:
+            return [], []
+
+        return result[0]["org_ids"], result[0]["agent_ids"]
+
     def query_agents(self, org_id):
         """ Find the all agent id with the same org_id
 
@@ -102,46 +175,79 @@ class Query:
         :type org_id: a single org_id number, where a  org_id number is a integer
         :rtype: a list of agent_id, which with the same org_id
         """
-        list_of_agents_ids = []
         query = {
             "org_id": org_id, "removed": {"$exists": False}
         }
-        cursor = self.client["tracking.agents"].find(query)
+        list_of_agents_ids = self.client["tracking.agents"].distinct("_id", query)
+
+        return list_of_agents_ids
+
+    def query_agents_in(self, org_ids):
+        """ Find the all agent id of a list of org_id in a single query
+
+        :param org_ids: The org_id that we want to get agent_id
+        :type org_ids: a list of org_id, where a org_id is a integer
+        :rtype: a list of agent_id, which belong to those org_ids
+        """
+        query = {
+            "org_id": {"$in": org_ids}, "removed": {"$exists": False}
+        }
+        list_of_agents_ids = self.client["tracking.agents"].distinct("_id", query)
 
-        for agent in cursor:
-            list_of_agents_ids.append(agent["_id"])
         return list_of_agents_ids
 
-    def query_tasks(self, agent_id):
+    def query_tasks(self, agent_id, batch_size=1000):
         """ Find all the tasks id done by a particular agent
              if agent did not do any task it will return None, and print out empty
+             the task ids are streamed by a single query, no document holds the tasks of a whole agent
 
         :param agent_id: The agent_id that we want to look for
         :type agent_id: a list of agent_id, where a agent_id is a integer
+        :param batch_size: The number of tasks the cursor fetches per round trip
         :rtype: a dict of task_id
                   Key: agent_id (int)
                   Value: a list of tasks
         """
+        query = {"agent_id": {"$in": agent_id}, "completed": {"$exists": True}}
+        cursor = self.client["tracking.tasks"].find(query, {"_id": 1, "agent_id": 1}, batch_size=batch_size)
 
         task_dict = {}
-        list_of_tasks_ids = []
-
-        query = {
-            "agent_id": {"$in": agent_id}, "completed": {"$exists": True}
-        }
-        cursor = self.client["tracking.tasks"].find(query)
         for task in cursor:
-            id = task["agent_id"]
-            if id in task_dict:
-                task_dict[id] += [task["_id"]]
-            else:
-                task_dict[id] = [task["_id"]]
+            task_dict.setdefault(task["agent_id"], []).append(task["_id"])
         if task_dict != {}:
             return task_dict
         else:
             print("empty")
             return None
 
+    def query_new_tasks(self, agent_id, since=None, batch_size=1000):
+        """ Find the tasks id done by the agents which completed at or after the given high-water mark
+             the task ids are streamed by a single query, see query_tasks
+
+        :param agent_id: The agent_id that we want to look for
+        :type agent_id: a list of agent_id, where a agent_id is a integer
+        :param since: The completed time of the last exported task, None means all of the tasks
+        :param batch_size: The number of tasks the cursor fetches per round trip
+        :rtype task_dict: a dict of task_id
+                  Key: agent_id (int)
+                  Value: a list of tasks
+        :rtype high_water: the latest completed time of the tasks, since if there is no task
+        """
+        completed = {"$exists": True}
+        if since is not None:
+            completed["$gte"] = since       # tasks completed at the same time as the mark are deduplicated by the caller
+        query = {"agent_id": {"$in": agent_id}, "completed": completed}
+        cursor = self.client["tracking.tasks"].find(query, {"_id": 1, "agent_id": 1, "completed": 1},
+                                                    batch_size=batch_size)
+
+        task_dict = {}
+        high_water = since
+        for task in cursor:
+            task_dict.setdefault(task["agent_id"], []).append(task["_id"])
+            if high_water is None or task["completed"] > high_water:
+                high_water = task["completed"]
+        return task_dict, high_water
+
     def find_locationpoints(self, task_id):
         """ Find all the location_point string according to each task_id
 
@@ -152,21 +258,73 @@ class Query:
                   Value: a list of location point
         """
         location_dict = {}
-        location_point = []
+        for id, location_point in self.iter_locationpoints(task_id):
+            location_dict[id] = location_point
+
+        return location_dict
+
+    def iter_locationpoints(self, task_id, batch_size=100):
+        """ Yield the location_point list of each task_id one task at a time
+             only ticket.location is returned by the server, so a single task is held in memory
+             with a cache the points are [timestamp, latitude, longitude, speed, heading] (see
+             location_cache.encode_points) whether they come from the cache or from the server
+
+        :param task_id: The task that we want to look for
+        :type task_id: a list of task_id, where a task_id is a integer
+        :param batch_size: The number of documents the cursor fetches per round trip
+        :type batch_size: int
+        :rtype: a generator of (task_id, a list of location point)
+        """
+        if self.cache is not None:
+            found, task_id = self.cache.get_many(task_id)
+            for id, location_point in found.items():
+                yield id, location_point
+            if task_id == []:
+                return
+
         query = {
             "_id": {"$in": task_id}, "location_shared": {"$exists": True}
         }
-        cursor = self.client["stats.tasks_full"].find(query)
-
-        for task in cursor:
-            id = task["_id"]
-            location_point = []
-            for i in range(len(task["ticket"]["location"])):
-                location_point.append(task["ticket"]["location"][i])
+        projection = {"ticket.location": 1}
+        cursor = self.client["stats.tasks_full"].find(query, projection, batch_size=batch_size)
+
+        pending = {}                        # stored in the cache once per cursor batch
+        try:
+            for task in cursor:
+                location_point = list(task["ticket"]["location"])
+                if self.cache is not None:
+                    # the points are cut to the cached five fields, so a miss gives the same rows as a hit
+                    data = location_cache.encode_points(location_point)
+                    location_point = location_cache.decode_points(data)
+                    pending[task["_id"]] = data
+                    if len(pending) >= batch_size:
+                        self.cache.put_many(pending)
+                        pending = {}
+                yield task["_id"], location_point
+        finally:
+            if pending:
+                self.cache.put_many(pending)
+
+    def decode_points(self, location_dict, tid):
+        """ Decode the location point of a task to typed columns in a single pass
+             only the first five fields of a point are used (a shorter point is padded with None),
+             a missing speed or heading is NaN, a point without timestamp, latitude or longitude is dropped
+             since it cannot be placed on the trip
 
-            location_dict[id] = location_point
+        :param location_dict: the dict of the location point according to the task id
+        :param tid: task id which the task we are looking for
+        :rtype lat: float64 array of latitude
+        :rtype long: float64 array of longitude
+        :rtype speed: float64 array of speed
+        :rtype heading: float64 array of heading angle
+        :rtype time_stamp: int64 array of timestamp (second)
+        """
+        rows = np.array([list(row[:5]) + [None] * (5 - len(row)) for row in location_dict[tid]],
+                        dtype=np.float64).reshape(-1, 5)
+        rows = rows[~np.isnan(rows[:, :3]).any(axis=1)]
+        time_stamp = rows[:, 0].astype(np.int64) // 1000       # convert 13 digits to 10 digits
 
-        return location_dict
+        return rows[:, 1], rows[:, 2], rows[:, 3], rows[:, 4], time_stamp
 
     def speed_angle(self, location_dict, tid):
         """ Find a list of speed point and heading angle
@@ -178,17 +336,9 @@ class Query:
         :rtype speed: a list of speed
         :rtype heading: a list of heading angle
         """
-        speed = []
-        heading = []
-        lat = []
-        long = []
-        for i in range(len(location_dict[tid])):
-            speed.append(location_dict[tid][i][3])
-            heading.append(location_dict[tid][i][4])
-            lat.append(location_dict[tid][i][1])
-            long.append(location_dict[tid][i][2])
-
-        return speed, heading, lat, long
+        lat, long, speed, heading, time_stamp = self.decode_points(location_dict, tid)
+
+        return column_to_list(speed), column_to_list(heading), lat.tolist(), long.tolist()
 
     def start_end(self, location_dict, tid):
         """ Find the start point and end point latitude & longitude
@@ -214,11 +364,9 @@ class Query:
         :param tid: task id which the task we are looking for
         :rtype: time_stamp: a list of timestamp
         """
-        time_stamp = []
-        for i in range(len(location_dict[tid])):
-            time_stamp.append(location_dict[tid][i][0] // 1000)
+        lat, long, speed, heading, time_stamp = self.decode_points(location_dict, tid)
 
-        return time_stamp
+        return time_stamp.tolist()
 
     def convert_datetime(self, timestamp):
         """Convert the timestamp to human readable datetime
@@ -232,6 +380,15 @@ class Query:
             datatime.append(dt_object)
         return datatime
 
+    def convert_datetime64(self, timestamp):
+        """Convert the timestamp to numpy datetime64 in a single operation
+            unlike convert_datetime the result is UTC, not the local time
+
+        :param timestamp: a list or array of timestamp (second)
+        :rtype: datetime64[s] array
+        """
+        return np.asarray(timestamp, dtype=np.int64).astype('datetime64[s]')
+
     def to_json(self, location_dict, filename):
         """Output the location_dict to the json file
 
@@ -243,24 +400,74 @@ class Query:
         """
         dict_one_agent = {}
         for key, value in location_dict.items():
-            speed, angle, lat, long = self.speed_angle(location_dict, key)
-            timestamp = self.timestamp(location_dict, key)
-            dict_one_agent[key] = [lat, long, speed, angle, timestamp]
+            lat, long, speed, angle, timestamp = self.decode_points(location_dict, key)
+            dict_one_agent[key] = [lat.tolist(), long.tolist(), column_to_list(speed), column_to_list(angle),
+                                   timestamp.tolist()]
 
         with open(filename + '.json', 'w') as fp:
             json.dump(dict_one_agent, fp)
         return dict_one_agent
 
-def generate_query(database_name):
-    """Generate query object by given database name
+    def to_json_stream(self, locations, filename):
+        """Output the location point to the json file one task at a time, each task is decoded & written
+            as soon as it arrives, the file is the same as to_json
+
+        :param locations: The location point according to the task id
+        :type locations: a dict of location point, or an iterable of (task_id, a list of location point)
+                         such as iter_locationpoints
+        :param filename: The filename user want to ouput, where the filename is a String
+        :return: the number of task written
+        """
+        if isinstance(locations, dict):
+            locations = locations.items()
+
+        def decoded():
+            for key, location_point in locations:
+                lat, long, speed, angle, timestamp = self.decode_points({key: location_point}, key)
+                yield key, [lat.tolist(), long.tolist(), column_to_list(speed), column_to_list(angle),
+                            timestamp.tolist()]
+
+        return dict_to_json_stream(decoded(), filename)
+
+    def to_columnar(self, location_dict, filename):
+        """Output the location_dict to the columnar binary trip file
+
+        :param location_dict: The dict of the location point according to the task id
+        :param filename: The filename user want to ouput, where the filename is a String
+        :return: dict_one_agent: a dict of location point info
+                                    Key: task_id (int)
+                                    Value: an array including [latitude, longitude, speed, angle, time]
+        """
+        dict_one_agent = {}
+        for key, value in location_dict.items():
+            dict_one_agent[key] = list(self.decode_points(location_dict, key))
+
+        dict_to_columnar(dict_one_agent, filename)
+        return dict_one_agent
+
+def column_to_list(column):
+    """ Convert a float column to a list, NaN is turned back to None so the json output keeps null
+
+    :param column: a float64 array
+    :return: a list
+    """
+    missing = np.isnan(column)
+    if missing.any():
+        return np.where(missing, None, column.astype(object)).tolist()
+    return column.tolist()
+
+def generate_query(database_name, cache=None, **client_options):
+    """Generate query object by given database name, every query object shares the same pooled client
 
     :param database_name: The database name user want to generate query object
     :type database_name: String
+    :param cache: The on-disk location point cache of the query object, a LocationCache or None
+    :param client_options: The pool size & timeouts & read preference passed to get_shared_client
     :return: a single query object
     """
-    Mongo_client = MongoClient([database_name])
+    Mongo_client = MongoClient([database_name], **client_options)
     client = Mongo_client.mongo_clients[database_name]
-    query = Query(client)
+    query = Query(client, cache)
     return query
 
 def find_all_agent(org_list, ENROUTE_TRACKING):
@@ -272,12 +479,27 @@ def find_all_agent(org_list, ENROUTE_TRACKING):
     :return: a list of agent id
     """
     query = generate_query(ENROUTE_TRACKING)
-    total_agent = []
-    for i in range(len(org_list)):
-        total_agent += query.query_agents(org_list[i])
+    total_agent = query.query_agents_in(list(org_list))
 
     return total_agent
 
+def find_hierarchy_tasks(hierarchy, ENROUTE_TRACKING):
+    """Find all of org_id & agents & tasks by given hierarchy number in two round trips
+
+    :param hierarchy: The hierarchy number that we want to look for
+    :param ENROUTE_TRACKING: database name
+    :return org_list: a list of org_id
+    :return total_agent: a list of agent id
+    :return task_dict: a dict of the task
+            key: agent id
+            value: a list of tasks
+    """
+    query = generate_query(ENROUTE_TRACKING)
+    org_list, total_agent = query.query_hierarchy(hierarchy)
+    task_dict = query.query_tasks(total_agent)
+
+    return org_list, total_agent, task_dict
+
 def find_all_tasks(total_agent, ENROUTE_TRACKING):
     """Find all of tasks by given agents
 
@@ -293,19 +515,47 @@ def find_all_tasks(total_agent, ENROUTE_TRACKING):
 
     return task_dict
 
-def find_all_location(task_dict, ENROUTE_STATS):
+def fetch_locationpoints(query, total_task, chunk_size=500, max_workers=8):
+    """Find all of location point by splitting the task list into chunks
+       and querying the chunks concurrently, the threads share the connection pool of the query client
+
+    :param query: The query object of the stats database
+    :param total_task: The task that we want to look for
+    :type total_task: a list of task_id
+    :param chunk_size: The maximum number of task_id in a single query
+    :param max_workers: The number of chunks query at the same time
+    :return: a dict of location point
+            key: task id
+            value: a list of location point
+    """
+    total_location = {}
+    chunks = [total_task[i:i + chunk_size] for i in range(0, len(total_task), chunk_size)]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(query.find_locationpoints, chunk) for chunk in chunks]
+        for future in as_completed(futures):       # merge the chunk as soon as it arrives
+            total_location.update(future.result())
+
+    return total_location
+
+def find_all_location(task_dict, ENROUTE_STATS, chunk_size=500, max_workers=8, cache=None):
     """Find all of location point by task dict
 
     :param task_dict: A dict of task, key is the agent id & value is the list of tasks
     :param ENROUTE_STATS: database name
-    :return:
+    :param chunk_size: The maximum number of task_id in a single query
+    :param max_workers: The number of chunks query at the same time
+    :param cache: The on-disk location point cache, a LocationCache or None
+    :return: a dict of location point
+            key: task id
+            value: a list of location point
     """
     total_task = []
     for key, value in task_dict.items():   # take out all of task is from task dict
         total_task += value
 
-    query = generate_query(ENROUTE_STATS)
-    total_location = query.find_locationpoints(total_task)
+    query = generate_query(ENROUTE_STATS, cache)
+    total_location = fetch_locationpoints(query, total_task, chunk_size, max_workers)
 
     return total_location
 
@@ -318,42 +568,161 @@ def dict_to_json(dict, filename):
     with open(filename + '.json', 'w') as fp:
         json.dump(dict, fp)
 
+def dict_to_json_stream(items, filename):
+    """ Output the (key, value) pairs to the json file one at a time, only a single value is held in memory
+        the file is the same as json.dump of the whole dict
+
+    :param items: an iterable of (key, value)
+    :param filename: The filename for ouput file, where the filename is String
+    :return: the number of key written
+    """
+    number = 0
+    with open(filename + '.json', 'w') as fp:
+        fp.write('{')
+        for key, value in items:
+            if number > 0:
+                fp.write(', ')
+            fp.write(json.dumps(str(key)) + ': ' + json.dumps(value))
+            number += 1
+        fp.write('}')
+    return number
+
+def _columnar_chunk(dict):
+    tasks = [str(key) for key in dict]
+    columns = [[np.asarray(value[index], dtype=dtype) for value in dict.values()]
+               for index, (name, dtype) in enumerate(TRIP_COLUMNS)]
+    return tasks, columns
+
+def dict_to_columnar(dict, filename):
+    """ Output a dict of [latitude, longitude, speed, angle, time] to the columnar binary trip file
+        see tripfile.write_trip for the file layout
+
+    :param dict: The dict you want to ouput
+    :param filename: The filename for ouput file, where the filename is String
+    """
+    write_trip(filename, *_columnar_chunk(dict))
+
+def append_columnar(dict, filename):
+    """ Append a dict of [latitude, longitude, speed, angle, time] to the end of an existing trip file
+        only the new points are written (a new block) and the index is replaced, see tripfile.append_trip
+
+    :param dict: The dict you want to append
+    :param filename: The filename of the trip file, where the filename is String
+    """
+    append_trip(filename, *_columnar_chunk(dict))
+
+def columnar_tasks(filename):
+    """ Take the task ids stored in the trip file, only the index is read
+
+    :param filename: The filename of the trip file, where the filename is String
+    :return: a set of task id (string), empty if the file does not exist
+    """
+    if not os.path.exists(filename + '.trip.index'):
+        return set()
+    return set(read_index(filename)["tasks"])
+
+def load_checkpoint(filename):
+    """ Read the incremental export checkpoint of the given export file
+
+    :param filename: The filename of the export, where the filename is String
+    :return: a dict of checkpoint
+            completed: the completed time of the last exported task (high-water mark), None if never exported
+            target: the high-water mark of the running export
+            pending: a list of task id that have not been exported in the running export
+    """
+    if not os.path.exists(filename + '.checkpoint'):
+        return {"completed": None, "target": None, "pending": []}
+    with open(filename + '.checkpoint') as fp:
+        return json_util.loads(fp.read())
+
+def save_checkpoint(checkpoint, filename):
+    """ Output the incremental export checkpoint, the file is replaced at once
+
+    :param checkpoint: a dict of checkpoint, see load_checkpoint
+    :param filename: The filename of the export, where the filename is String
+    """
+    with open(filename + '.checkpoint.tmp', 'w') as fp:
+        fp.write(json_util.dumps(checkpoint))
+    os.replace(filename + '.checkpoint.tmp', filename + '.checkpoint')
+
+def incremental_export(total_agent, filename, ENROUTE_TRACKING, ENROUTE_STATS, chunk_size=500):
+    """Append the location point of the tasks completed since the last export to the trip file
+       the high-water mark & the pending tasks are kept in filename.checkpoint, an interrupted run resumes
+       from the pending tasks instead of querying the tasks again
+
+    :param total_agent: The agent_id of the scope that we want to export
+    :type total_agent: a list of agent id
+    :param filename: The filename of the trip file, where the filename is String
+    :param ENROUTE_TRACKING: database name of the tasks
+    :param ENROUTE_STATS: database name of the location point
+    :param chunk_size: The number of tasks appended to the trip file at a time
+    :return: the number of task appended
+    """
+    checkpoint = load_checkpoint(filename)
+    if checkpoint["pending"] == []:
+        query = generate_query(ENROUTE_TRACKING)
+        task_dict, high_water = query.query_new_tasks(total_agent, checkpoint["completed"])
+        checkpoint["target"] = high_water
+        checkpoint["pending"] = [task for tasks in task_dict.values() for task in tasks]
+        save_checkpoint(checkpoint, filename)
+
+    exported = columnar_tasks(filename)
+    pending = [task for task in checkpoint["pending"] if str(task) not in exported]
+
+    query = generate_query(ENROUTE_STATS)
+    number = 0
+    for i in range(0, len(pending), chunk_size):
+        location_dict = query.find_locationpoints(pending[i:i + chunk_size])
+        dict_chunk = {}
+        for key in location_dict:
+            dict_chunk[key] = list(query.decode_points(location_dict, key))
+        append_columnar(dict_chunk, filename)
+        number += len(dict_chunk)
+
+        checkpoint["pending"] = pending[i + chunk_size:]
+        save_checkpoint(checkpoint, filename)
+
+    checkpoint["completed"] = checkpoint["target"]
+    checkpoint["pending"] = []
+    save_checkpoint(checkpoint, filename)
+    return number
+
 def main():
     """
-    Run this main function you can output the location point json file
+    Run this main function you can output the location point trip file
     by Company, shop or agent.
     c : Company (org_id)
     s : Shop (org_id)
     a : Agent (agent_id)
+    i : Incremental export, append the tasks completed since the last export of a company, shop or agent
     """
 
     ENROUTE_TRACKING = "tracking_core"
     ENROUTE_STATS = "tracking_stats"
+    cache = LocationCache('Query/location_cache.sqlite')
 
-    tp = input('Query all or single agent: (c(company)/s(Shop)/a(Agent))')
+    tp = input('Query all or single agent: (c(company)/s(Shop)/a(Agent)/i(Incremental))')
     if (str(tp) == "c"):
         query = generate_query(ENROUTE_TRACKING)
         og = input('Input hierarchy org_id number: ')
-        org_list = query.query_orgid(int(og))
+        org_list, total_agent, task_dict = find_hierarchy_tasks(int(og), ENROUTE_TRACKING)
         print("The number of org_id in the given hierarchy number:", len(org_list))
         print("OrgID query finished-------------------------------------------------")
-
-        total_agent = find_all_agent(org_list, ENROUTE_TRACKING)
         print("The number of agent in the given hierarchy number:", len(total_agent))
         print("Agent query finished-------------------------------------------------")
 
-        task_dict = find_all_tasks(total_agent, ENROUTE_TRACKING)
         filename_agent = input('Input filename for the Agent_task_dict:')
         filename_agent = 'Query/Agent task/' + filename_agent
         dict_to_json(task_dict, str(filename_agent))
         print("Task query finished--------------------------------------------------")
 
         print("Query location point, it might take a while...(8min)")
-        total_location = find_all_location(task_dict, ENROUTE_STATS)
+        total_location = find_all_location(task_dict, ENROUTE_STATS, cache=cache)
+        print("Location cache:", cache.stats())
         print("The number of task:", len(total_location))
         filename_task = input('Input filename for the Task_location_dict:')
         filename_task = 'Query/Company location/' + filename_task
-        location_dict = query.to_json(total_location, str(filename_task))
+        location_dict = query.to_columnar(total_location, str(filename_task))
 
         print("All done")
 
@@ -368,11 +737,12 @@ def main():
         task_dict = find_all_tasks(shop_agent, ENROUTE_TRACKING)
         print("Task query finished--------------------------------------------------")
         print("Query location point, it might take a while...(8min)")
-        total_location = find_all_location(task_dict, ENROUTE_STATS)
+        total_location = find_all_location(task_dict, ENROUTE_STATS, cache=cache)
+        print("Location cache:", cache.stats())
         print("The number of task:", len(total_location))
         filename_task = input('Input filename for the Task_location_dict:')
         filename_task = 'Query/Shop location/' + filename_task
-        location_dict = query.to_json(total_location, str(filename_task))
+        location_dict = query.to_columnar(total_location, str(filename_task))
 
         print("All done")
 
@@ -382,11 +752,32 @@ def main():
         agent_task = find_all_tasks([int(ag)], ENROUTE_TRACKING)
         print("Task query finished--------------------------------------------------")
         print("Query location point, it might take a while...")
-        agent_location = find_all_location(agent_task, ENROUTE_STATS)
+        agent_location = find_all_location(agent_task, ENROUTE_STATS, cache=cache)
+        print("Location cache:", cache.stats())
         print("The number of task:", len(agent_location))
         filename_task = input('Input filename for the Agent_location_dict:')
         filename_task = 'Query/Single Agent location/' + filename_task
-        agent_dict = query.to_json(agent_location, str(filename_task))
+        agent_dict = query.to_columnar(agent_location, str(filename_task))
+
+        print("All done")
+
+    elif (str(tp) == "i"):
+        query = generate_query(ENROUTE_TRACKING)
+        sc = input('Incremental export of: (c(company)/s(Shop)/a(Agent))')
+        nb = input('Input hierarchy / shop org_id / agent_id number: ')
+        if (str(sc) == "c"):
+            org_list, total_agent = query.query_hierarchy(int(nb))
+            folder = 'Query/Company location/'
+        elif (str(sc) == "s"):
+            total_agent = query.query_agents(int(nb))
+            folder = 'Query/Shop location/'
+        else:
+            total_agent = [int(nb)]
+            folder = 'Query/Single Agent location/'
+        print("The number of agent:", len(total_agent))
+        filename_task = input('Input filename for the Task_location_dict:')
+        number = incremental_export(total_agent, folder + str(filename_task), ENROUTE_TRACKING, ENROUTE_STATS)
+        print("The number of new task:", number)
 
         print("All done")
 
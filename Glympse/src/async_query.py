@@ -0,0 +1,185 @@
+import asyncio
+
+from Query import generate_query
+
+
+class AsyncQuery:
+
+    def __init__(self, query, concurrency=16):
+        """ Initialize the AsyncQuery, the asyncio counterpart of Query
+             every call runs the Query method on a worker thread sharing the pooled client of the query,
+             at most `concurrency` calls are in flight at once
+
+        :param query: The query object that the user wants to query
+        :type query: a single Query object
+        :param concurrency: The maximum number of queries in flight
+        :rtype: None
+        """
+        self.query = query
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def _run(self, method, *args):
+        async with self._semaphore:
+            return await asyncio.to_thread(method, *args)
+
+    async def query_orgid(self, hierarchy):
+        """ The asyncio version of Query.query_orgid """
+        return await self._run(self.query.query_orgid, hierarchy)
+
+    async def query_hierarchy(self, hierarchy):
+        """ The asyncio version of Query.query_hierarchy """
+        return await self._run(self.query.query_hierarchy, hierarchy)
+
+    async def query_agents(self, org_id):
+        """ The asyncio version of Query.query_agents """
+        return await self._run(self.query.query_agents, org_id)
+
+    async def query_tasks(self, agent_id):
+        """ The asyncio version of Query.query_tasks, returns an empty dict instead of None
+
+        :param agent_id: The agent_id that we want to look for
+        :type agent_id: a list of agent_id, where a agent_id is a integer
+        :rtype: a dict of task_id
+                  Key: agent_id (int)
+                  Value: a list of tasks
+        """
+        task_dict, high_water = await self._run(self.query.query_new_tasks, agent_id)
+        return task_dict
+
+    async def find_locationpoints(self, task_id):
+        """ The asyncio version of Query.find_locationpoints """
+        return await self._run(self.query.find_locationpoints, task_id)
+
+
+async def find_all_agent_async(org_list, ENROUTE_TRACKING, concurrency=16):
+    """Find all of agents by given org_id list, every org_id is queried concurrently
+
+    :param org_list: The org_id that we want to look for
+    :type org_list: a list of org_id
+    :param ENROUTE_TRACKING: database name
+    :param concurrency: The maximum number of queries in flight
+    :return: a list of agent id
+    """
+    query = AsyncQuery(generate_query(ENROUTE_TRACKING), concurrency)
+    results = await asyncio.gather(*[query.query_agents(org_id) for org_id in org_list])
+
+    total_agent = []
+    for agents in results:
+        total_agent += agents
+    return total_agent
+
+
+async def find_all_tasks_async(total_agent, ENROUTE_TRACKING, concurrency=16, agents_per_query=50):
+    """Find all of tasks by given agents, the agents are split into groups queried concurrently
+
+    :param total_agent: The agent_id that we want to look for
+    :type total_agent: a list of agent id
+    :param ENROUTE_TRACKING: database name
+    :param concurrency: The maximum number of queries in flight
+    :param agents_per_query: The number of agents in a single query
+    :return: a dict of the task
+            key: agent id
+            value: a list of tasks
+    """
+    query = AsyncQuery(generate_query(ENROUTE_TRACKING), concurrency)
+    groups = [total_agent[i:i + agents_per_query] for i in range(0, len(total_agent), agents_per_query)]
+    results = await asyncio.gather(*[query.query_tasks(group) for group in groups])
+
+    task_dict = {}
+    for tasks in results:
+        task_dict.update(tasks)
+    return task_dict
+
+
+async def find_all_location_async(task_dict, ENROUTE_STATS, concurrency=16, chunk_size=500):
+    """Find all of location point by task dict, the task list is split into chunks queried concurrently
+
+    :param task_dict: A dict of task, key is the agent id & value is the list of tasks
+    :param ENROUTE_STATS: database name
+    :param concurrency: The maximum number of queries in flight
+    :param chunk_size: The maximum number of task_id in a single query
+    :return: a dict of location point
+            key: task id
+            value: a list of location point
+    """
+    total_task = []
+    for key, value in task_dict.items():
+        total_task += value
+
+    query = AsyncQuery(generate_query(ENROUTE_STATS), concurrency)
+    chunks = [total_task[i:i + chunk_size] for i in range(0, len(total_task), chunk_size)]
+
+    total_location = {}
+    for future in asyncio.as_completed([query.find_locationpoints(chunk) for chunk in chunks]):
+        total_location.update(await future)
+    return total_location
+
+
+async def iter_all_location_async(total_agent, ENROUTE_TRACKING, ENROUTE_STATS, concurrency=16, agents_per_query=50,
+                                  max_pending=None):
+    """Yield the location point of the agents group by group, the task query & location query of different groups
+       overlap, so the first group is yielded while the later ones are still in flight
+       at most max_pending groups are in flight or waiting for the consumer, a new group is started only when
+       one is yielded, so a slow consumer does not pile up the results in memory
+
+    :param total_agent: The agent_id that we want to look for
+    :type total_agent: a list of agent id
+    :param ENROUTE_TRACKING: database name of the tasks
+    :param ENROUTE_STATS: database name of the location point
+    :param concurrency: The maximum number of queries in flight for each database
+    :param agents_per_query: The number of agents in a single task query
+    :param max_pending: The maximum number of groups fetched ahead of the consumer, concurrency by default
+    :rtype: an async generator of (task_dict, location_dict) of each group
+    """
+    tracking = AsyncQuery(generate_query(ENROUTE_TRACKING), concurrency)
+    stats = AsyncQuery(generate_query(ENROUTE_STATS), concurrency)
+    if max_pending is None:
+        max_pending = concurrency
+
+    async def one_group(agents):
+        task_dict = await tracking.query_tasks(agents)
+        total_task = []
+        for key, value in task_dict.items():
+            total_task += value
+        if total_task == []:
+            return task_dict, {}
+        return task_dict, await stats.find_locationpoints(total_task)
+
+    groups = iter([total_agent[i:i + agents_per_query] for i in range(0, len(total_agent), agents_per_query)])
+    pending = set()
+    try:
+        while True:
+            for group in groups:
+                pending.add(asyncio.ensure_future(one_group(group)))
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+async def export_location_async(total_agent, ENROUTE_TRACKING, ENROUTE_STATS, consumer, concurrency=16,
+                                agents_per_query=50, max_pending=None):
+    """Feed the location point of the agents to an async consumer as soon as each group arrives
+
+    :param total_agent: The agent_id that we want to look for
+    :type total_agent: a list of agent id
+    :param ENROUTE_TRACKING: database name of the tasks
+    :param ENROUTE_STATS: database name of the location point
+    :param consumer: an async function called with (task_dict, location_dict) of each group
+    :param concurrency: The maximum number of queries in flight for each database
+    :param agents_per_query: The number of agents in a single task query
+    :param max_pending: The maximum number of groups fetched ahead of the consumer, concurrency by default
+    :return: the number of task
+    """
+    number = 0
+    async for task_dict, location_dict in iter_all_location_async(total_agent, ENROUTE_TRACKING, ENROUTE_STATS,
+                                                                   concurrency, agents_per_query, max_pending):
+        await consumer(task_dict, location_dict)
+        number += len(location_dict)
+    return number
@@ -0,0 +1,143 @@
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+
+SQL_VARIABLES = 500         # the task ids of a single IN (...) query, under the sqlite limit of 999
+
+class LocationCache:
+
+    def __init__(self, path, max_bytes=2 * 1024 ** 3):
+        """ Initialize the on-disk location point cache
+             completed tasks never change, so the cached points never go stale
+
+        :param path: The sqlite file that stores the location point
+        :param max_bytes: The maximum size of the stored location point, the least recently used tasks are evicted
+                          down to 90% of it once the size goes over it
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS points ("
+                         "task_id TEXT PRIMARY KEY, data BLOB, size INTEGER, used REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS points_used ON points (used)")
+        self._db.commit()
+        self.total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM points").fetchone()[0]
+
+    def get_many(self, task_id):
+        """ Take the cached location point of the tasks
+
+        :param task_id: The task that we want to look for
+        :type task_id: a list of task_id
+        :rtype found: a dict of location point
+                  Key: task_id
+                  Value: a list of location point [timestamp, latitude, longitude, speed, heading]
+        :rtype missing: a list of task_id which is not in the cache
+        """
+        found = {}
+        missing = []
+        now = time.time()
+        with self._lock:
+            data = {}
+            keys = [str(id) for id in task_id]
+            for i in range(0, len(keys), SQL_VARIABLES):
+                chunk = keys[i:i + SQL_VARIABLES]
+                data.update(self._db.execute("SELECT task_id, data FROM points WHERE task_id IN ({})".format(
+                    ",".join("?" * len(chunk))), chunk).fetchall())
+            for id, key in zip(task_id, keys):
+                if key in data:
+                    found[id] = decode_points(data[key])
+                else:
+                    missing.append(id)
+            self._db.executemany("UPDATE points SET used = ? WHERE task_id = ?", [(now, key) for key in data])
+            self._db.commit()
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, location_dict):
+        """ Store the location point of the tasks in a single transaction
+             and evict the least recently used tasks if the size goes over the cap
+
+        :param location_dict: a dict of location point
+                  Key: task_id
+                  Value: a list of location point [timestamp, latitude, longitude, speed, heading]
+                         or the bytes of encode_points
+        """
+        if len(location_dict) == 0:
+            return
+        now = time.time()
+        rows = []
+        for id, location_point in location_dict.items():
+            data = location_point if isinstance(location_point, bytes) else encode_points(location_point)
+            rows.append((str(id), data, len(data), now))
+        with self._lock:
+            replaced = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM points WHERE task_id IN ({})".format(
+                ",".join("?" * len(rows))), [row[0] for row in rows]).fetchone()[0]
+            self._db.executemany("INSERT OR REPLACE INTO points VALUES (?, ?, ?, ?)", rows)
+            self.total += sum(row[2] for row in rows) - replaced
+            if self.total > self.max_bytes:
+                self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        target = self.max_bytes * 0.9
+        cursor = self._db.execute("SELECT task_id, size FROM points ORDER BY used")
+        evict = []
+        for id, size in cursor:
+            if self.total <= target:
+                break
+            evict.append((id,))
+            self.total -= size
+        self._db.executemany("DELETE FROM points WHERE task_id = ?", evict)
+
+    def stats(self):
+        """ Take the hit & miss counters of the cache
+
+        :return: a dict of hits, misses, hit_rate, tasks, bytes
+        """
+        with self._lock:
+            tasks = self._db.execute("SELECT COUNT(*) FROM points").fetchone()[0]
+        total = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total > 0 else 0.0,
+                "tasks": tasks,
+                "bytes": self.total}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def encode_points(location_point):
+    """ Pack a list of location point to float64 bytes, a missing value is stored as NaN
+         only the five fields used by Query are kept, a shorter point is padded with missing values
+
+    :param location_point: a list of location point [timestamp, latitude, longitude, speed, heading]
+    :return: bytes
+    """
+    rows = [list(point[:5]) + [None] * (5 - len(point[:5])) for point in location_point]
+    return np.asarray(rows, dtype="<f8").reshape(-1, 5).tobytes()
+
+
+def decode_points(data):
+    """ Unpack the float64 bytes to a list of location point, NaN is turned back to None
+         (a missing timestamp too, Query.decode_points drops the point)
+
+    :param data: bytes of encode_points
+    :return: a list of location point [timestamp, latitude, longitude, speed, heading]
+    """
+    rows = np.frombuffer(data, dtype="<f8").reshape(-1, 5).tolist()
+    location_point = []
+    for row in rows:
+        location_point.append([None if row[0] != row[0] else int(row[0])] + [None if v != v else v for v in row[1:]])
+    return location_point
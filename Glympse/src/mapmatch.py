@@ -0,0 +1,188 @@
+import numpy as np
+
+import speedlimit
+from roadnet import RoadDistanceEngine
+
+
+class MapMatcher:
+
+    def __init__(self, network, sigma=10.0, beta=30.0, radius=50.0, beam=8, max_route=2000.0):
+        """ Initialize the HMM map matcher on the road network
+             the hidden states of a point are its `beam` nearest segments within `radius`,
+             the emission is a gaussian of the distance between the point & the segment (sigma),
+             the transition is an exponential of the difference between the road distance & the straight
+             distance of two consecutive points (beta), the most likely segments are found by Viterbi
+
+        :param network: The RoadNetwork
+        :param sigma: The standard deviation (m) of the GPS noise
+        :param beta: The scale (m) of the difference between the road distance & the straight distance
+        :param radius: The maximum distance (m) between a point & its candidate segments
+        :param beam: The maximum number of candidate segments of a point
+        :param max_route: The maximum road distance (m) between two consecutive points
+        """
+        self.network = network
+        self.sigma = sigma
+        self.beta = beta
+        self.radius = radius
+        self.beam = beam
+        self.max_route = max_route
+        self.engine = RoadDistanceEngine(network, max_distance=radius, limit=max_route)
+
+    def match_segments(self, lat, long):
+        """ Match the points of a trip to the segments of the road network
+
+        :param lat: a list of latitude
+        :param long: a list of longitude
+        :return: an array of segment index, -1 if the point is not matched
+        """
+        network = self.network
+        lat = np.asarray(lat, dtype=float)
+        long = np.asarray(long, dtype=float)
+        n = len(lat)
+        if n == 0 or len(network.length) == 0:
+            return np.full(n, -1)
+
+        segment, distance = network.candidate_segments(lat, long, self.radius, self.beam)
+        xy = network.project(lat, long)
+        position = network.segment_position(np.broadcast_to(xy[:, None, :], segment.shape + (2,)),
+                                            np.maximum(segment, 0))
+        emission = -0.5 * (distance / self.sigma) ** 2                             # -inf without candidate
+
+        # the transition of every candidate pair of every two consecutive points
+        straight = np.hypot(*np.diff(xy, axis=0).T)
+        shape = (n - 1, self.beam, self.beam)
+        limit = np.minimum(self.max_route, 2 * straight + 2 * self.radius)
+        route = self.engine.route_distances(np.broadcast_to(segment[:-1, :, None], shape).reshape(-1),
+                                            np.broadcast_to(position[:-1, :, None], shape).reshape(-1),
+                                            np.broadcast_to(segment[1:, None, :], shape).reshape(-1),
+                                            np.broadcast_to(position[1:, None, :], shape).reshape(-1),
+                                            np.broadcast_to(limit[:, None, None], shape).reshape(-1))
+        transition = -np.abs(route.reshape(shape) - straight[:, None, None]) / self.beta
+        transition[np.isnan(transition)] = -np.inf
+
+        # Viterbi, the chain restarts at a point which no candidate of the previous point leads to
+        score = np.empty((n, self.beam))
+        back = np.zeros((n, self.beam), dtype=int)
+        broken = np.zeros(n, dtype=bool)
+        score[0] = emission[0]
+        for t in range(1, n):
+            candidate = score[t - 1][:, None] + transition[t - 1]
+            back[t] = np.argmax(candidate, axis=0)
+            score[t] = candidate[back[t], np.arange(self.beam)] + emission[t]
+            if not np.isfinite(score[t]).any():
+                score[t] = emission[t]
+                broken[t] = True
+
+        matched = np.full(n, -1)
+        j = int(np.argmax(score[-1])) if np.isfinite(score[-1]).any() else -1
+        for t in range(n - 1, -1, -1):
+            if j >= 0:
+                matched[t] = segment[t, j]
+            if t == 0:
+                break
+            if j < 0 or broken[t]:
+                j = int(np.argmax(score[t - 1])) if np.isfinite(score[t - 1]).any() else -1
+            else:
+                j = back[t, j]
+        return matched
+
+    def match(self, lat, long):
+        """ Match the points of a trip to the roads of the road network
+
+        :param lat: a list of latitude
+        :param long: a list of longitude
+        :return: an array of road index, -1 if the point is not matched
+        """
+        segment = self.match_segments(lat, long)
+        if len(self.network.segment_road) == 0:
+            return segment
+        return np.where(segment >= 0, self.network.segment_road[np.maximum(segment, 0)], -1)
+
+
+def match_data(data, matcher):
+    """ Match every trip of the data to the road network, it runs after organize_data
+
+    :param data: the dict of data
+    :param matcher: the MapMatcher
+    :return: a dict of matched road
+            key: task id
+            value: a list of road index of every point, -1 if the point is not matched
+    """
+    matched = {}
+    for key, value in data.items():
+        matched[key] = matcher.match(value[0], value[1]).tolist()
+    return matched
+
+
+def matched_road_ids(network, roads):
+    """ Take the road id of the matched roads
+
+    :param network: The RoadNetwork
+    :param roads: a list of road index of match
+    :return: a list of road id, None if the point is not matched
+    """
+    return [network.ids[road] if road >= 0 else None for road in roads]
+
+
+def matched_speed_limit(network, roads):
+    """ Take the speed limit of every point from the matched roads, in the form of speedlimit.path_speed_limit
+         so it can be given to Maneuver_detect.over_speed_limit directly
+
+    :param network: The RoadNetwork
+    :param roads: a list of road index of match
+    :return speed_limit_list: a list of speed limit (m/s) of every point, empty if nothing is known
+                              (a point without speed limit takes the previous known one)
+    :return call_api: a list of the points index, every point
+    """
+    roads = np.asarray(roads, dtype=int)
+    if len(network.speed_limit) == 0:
+        return [], list(range(len(roads)))
+    limit = np.where(roads >= 0, network.speed_limit[np.maximum(roads, 0)], np.nan)
+    speed_limit_list = [None if value != value else value for value in limit.tolist()]
+    return speedlimit.fill_speed_limit(speed_limit_list), list(range(len(roads)))
+
+
+def matched_speed_limits(network, matched):
+    """ Take the speed limit of every trip from the matched roads, see matched_speed_limit
+
+    :param network: The RoadNetwork
+    :param matched: the dict of matched road of match_data
+    :return: a dict of (speed_limit_list, call_api), it can be given to Maneuver_detect.find_dic_over
+    """
+    return {key: matched_speed_limit(network, roads) for key, roads in matched.items()}
+
+
+def aggregate_roads(data, matched, network):
+    """ Aggregate the points of the trips per matched road
+
+    :param data: the dict of data
+    :param matched: the dict of matched road of match_data
+    :param network: The RoadNetwork
+    :return: a dict of road statistics
+            key: road index
+            value: a dict of id, points, tasks, mean_speed, max_speed & speed_limit (m/s)
+    """
+    roads, speed, tasks = [], [], []
+    for key, value in data.items():
+        roads.append(np.asarray(matched[key], dtype=int))
+        speed.append(np.asarray(value[2], dtype=float))
+        tasks.append(np.full(len(value[2]), len(tasks)))
+    if len(roads) == 0:
+        return {}
+    roads, speed, tasks = np.concatenate(roads), np.concatenate(speed), np.concatenate(tasks)
+    keep = (roads >= 0) & ~np.isnan(speed)
+    roads, speed, tasks = roads[keep], speed[keep], tasks[keep]
+
+    result = {}
+    order = np.argsort(roads, kind="stable")
+    road_list, start = np.unique(roads[order], return_index=True)
+    for road, points, task in zip(road_list.tolist(), np.split(speed[order], start[1:]),
+                                  np.split(tasks[order], start[1:])):
+        limit = network.speed_limit[road]
+        result[road] = {"id": network.ids[road],
+                        "points": len(points),
+                        "tasks": len(np.unique(task)),
+                        "mean_speed": float(points.mean()),
+                        "max_speed": float(points.max()),
+                        "speed_limit": None if limit != limit else float(limit)}
+    return result
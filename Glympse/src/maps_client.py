@@ -0,0 +1,256 @@
+import multiprocessing
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+ROADS_URL = "https://roads.googleapis.com"
+MAPS_URL = "https://maps.googleapis.com"
+RETRY_STATUS = {429, 500, 502, 503, 504}
+RETRY_DIRECTIONS = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}
+API_KEY_ENV = "GOOGLE_MAPS_API_KEY"     # the environment variable holding the Google API key
+
+default_options = {}    # the MapsClient options used by get_client, see set_default_options
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+_shared_limiters = {}   # qps: the TokenBucket shared by the clients & the worker processes, see shared_limiter
+
+
+class MapsApiError(Exception):
+
+    def __init__(self, status, message=None):
+        """ An error answered by the Roads or Directions API
+
+        :param status: The http status code or the API status
+        :param message: The error message
+        """
+        Exception.__init__(self, "{}: {}".format(status, message) if message else str(status))
+        self.status = status
+        self.message = message
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst=None):
+        """ Initialize the token bucket rate limiter, the state sits in shared memory, so the bucket is shared
+             by every thread of the client & by the worker processes it is handed to (see shared_limiter)
+             the lock & the state are made by the spawn context, which can be handed to the workers of any
+             start method (fork, forkserver & spawn)
+
+        :param rate: The number of request per second
+        :param burst: The maximum number of request sent at once, the rate by default
+        """
+        context = multiprocessing.get_context("spawn")
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(rate, 1))
+        self._state = context.RawArray("d", [self.capacity, time.monotonic()])     # tokens, updated
+        self._lock = context.Lock()
+
+    def acquire(self):
+        """ Take a token, block until one is available """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                tokens = min(self.capacity, self._state[0] + (now - self._state[1]) * self.rate)
+                self._state[1] = now
+                if tokens >= 1:
+                    self._state[0] = tokens - 1
+                    return
+                self._state[0] = tokens
+                wait = (1 - tokens) / self.rate
+            time.sleep(wait)
+
+
+class MapsClient:
+
+    def __init__(self, key, qps=50, max_retries=5, backoff=0.5, timeout=10, pool_size=32, max_workers=8,
+                 roads_url=ROADS_URL, maps_url=MAPS_URL, limiter=None):
+        """ Initialize the Roads & Directions API client
+             the requests share a connection pool & a token bucket, a failed request is retried with
+             exponential backoff, the urls can point to a local stub server for testing
+
+        :param key: The Google API key
+        :param qps: The maximum number of request per second
+        :param max_retries: The maximum number of retry of a request
+        :param backoff: The first retry delay (second), doubled at every retry
+        :param timeout: The timeout (second) of a request
+        :param pool_size: The maximum number of connections in the pool
+        :param max_workers: The number of requests sent concurrently by the *_many methods
+        :param roads_url: The base url of the Roads API
+        :param maps_url: The base url of the Directions API
+        :param limiter: The TokenBucket shared with other clients, a new one of qps by default
+        """
+        self.key = key
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.roads_url = roads_url.rstrip("/")
+        self.maps_url = maps_url.rstrip("/")
+        self.limiter = limiter if limiter is not None else TokenBucket(qps)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _get(self, url, params, retry_status=()):
+        params = dict(params, key=self.key)
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                delay = self.backoff * 2 ** (attempt - 1)
+                time.sleep(delay * (0.5 + random.random() / 2))             # jitter
+            self.limiter.acquire()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                last_error = MapsApiError("connection", str(error))
+                continue
+
+            if response.status_code in RETRY_STATUS:
+                last_error = MapsApiError(response.status_code, response.text[:200])
+                continue
+            try:
+                body = response.json()
+            except ValueError:
+                raise MapsApiError(response.status_code, "invalid json")
+            if response.status_code != 200:
+                error = body.get("error", {}) if isinstance(body, dict) else {}
+                raise MapsApiError(error.get("status", response.status_code), error.get("message"))
+            if body.get("status") in retry_status:
+                last_error = MapsApiError(body["status"], body.get("error_message"))
+                continue
+            return body
+        raise last_error
+
+    def snapped_speed_limits(self, path):
+        """ Query the Roads API speed limit of a path, the same result as googlemaps.Client.snapped_speed_limits
+
+        :param path: a list of (latitude, longitude), at most 100 points
+        :return: the Roads API result, a dict of speedLimits & snappedPoints
+        """
+        path = "|".join("{},{}".format(lat, long) for lat, long in path)
+        return self._get(self.roads_url + "/v1/speedLimits", {"path": path})
+
+    def snapped_speed_limits_many(self, paths):
+        """ Query the Roads API speed limit of the paths concurrently
+
+        :param paths: a list of path, a path is a list of (latitude, longitude) of at most 100 points
+        :return: a list of Roads API result in the order of the paths
+        """
+        if len(paths) <= 1:
+            return [self.snapped_speed_limits(path) for path in paths]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self.snapped_speed_limits, paths))
+
+    def directions(self, origin, destination, mode="driving"):
+        """ Query the Directions API, the same result as googlemaps.Client.directions
+
+        :param origin: the start point (latitude, longitude)
+        :param destination: the end point (latitude, longitude)
+        :param mode: the travel mode
+        :return: a list of routes, empty if no route is found
+        """
+        params = {"origin": "{},{}".format(*origin),
+                  "destination": "{},{}".format(*destination),
+                  "mode": mode}
+        body = self._get(self.maps_url + "/maps/api/directions/json", params, RETRY_DIRECTIONS)
+        if body.get("status") not in ("OK", "ZERO_RESULTS"):
+            raise MapsApiError(body.get("status"), body.get("error_message"))
+        return body.get("routes", [])
+
+    def directions_many(self, pairs, mode="driving"):
+        """ Query the Directions API of the (origin, destination) pairs concurrently
+
+        :param pairs: a list of (origin, destination)
+        :param mode: the travel mode
+        :return: a list of routes in the order of the pairs
+        """
+        if len(pairs) <= 1:
+            return [self.directions(origin, destination, mode) for origin, destination in pairs]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(lambda pair: self.directions(pair[0], pair[1], mode), pairs))
+
+    def close(self):
+        self.session.close()
+
+
+def api_key():
+    """ Read the Google API key from the GOOGLE_MAPS_API_KEY environment variable
+
+    :return: the Google API key
+    """
+    key = os.environ.get(API_KEY_ENV, "").strip()
+    if key == "":
+        raise RuntimeError("No Google API key, set the " + API_KEY_ENV + " environment variable")
+    return key
+
+
+def get_client(key=None, **options):
+    """ Take the process-wide MapsClient of the given key & options, the client is generated at the first call
+         every process keeps its own client, so the connection pool is not shared with forked workers,
+         but the clients of every process take their tokens from shared_limiter(qps), so the worker processes
+         together send at most qps request per second
+
+    :param key: The Google API key, read from the GOOGLE_MAPS_API_KEY environment variable by default
+    :param options: the options of MapsClient (qps, max_retries, backoff, timeout, pool_size, max_workers,
+                    roads_url, maps_url), on top of the default options
+    :rtype: a single MapsClient
+    """
+    if key is None:
+        key = api_key()
+    options = dict(default_options, **options)
+    limiter = shared_limiter(options.get("qps"))
+    client_key = (os.getpid(), key, tuple(sorted(options.items())))
+    with _shared_clients_lock:
+        client = _shared_clients.get(client_key)
+        if client is None:
+            client = MapsClient(key, limiter=limiter, **options)
+            _shared_clients[client_key] = client
+    return client
+
+
+def shared_limiter(qps=None):
+    """ Take the TokenBucket of qps shared by the clients of get_client, generated at the first call
+         the worker processes forked after the call inherit the bucket, hand it to set_shared_limiter in the
+         initializer of a spawned pool, so the pool shares the qps instead of taking qps per worker
+
+    :param qps: The number of request per second, the qps of the default options (50) by default
+    :rtype: a single TokenBucket
+    """
+    qps = float(default_options.get("qps", 50) if qps is None else qps)
+    with _shared_clients_lock:
+        limiter = _shared_limiters.get(qps)
+        if limiter is None:
+            limiter = TokenBucket(qps)
+            _shared_limiters[qps] = limiter
+    return limiter
+
+
+def set_shared_limiter(limiter):
+    """ Use the TokenBucket of the parent process in a worker process, call it from the pool initializer
+
+    :param limiter: The TokenBucket of shared_limiter
+    """
+    with _shared_clients_lock:
+        _shared_limiters[limiter.rate] = limiter
+
+
+def set_default_options(**options):
+    """ Set the MapsClient options used by every get_client call, e.g. the urls of a local stub server
+
+    :param options: the options of MapsClient
+    """
+    global default_options
+    default_options = options
+
+
+def close_clients():
+    """ Close every shared client generated by this process
+    """
+    with _shared_clients_lock:
+        for client_key in list(_shared_clients):
+            if client_key[0] == os.getpid():
+                _shared_clients.pop(client_key).close()
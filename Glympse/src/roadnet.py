@@ -0,0 +1,541 @@
+import heapq
+import json
+from collections import OrderedDict
+import numpy as np
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS = 6371000
+KPH_TO_MPS = 0.277777778
+MPH_TO_MPS = 0.44704
+
+
+def parse_maxspeed(value):
+    """ Parse the OSM maxspeed tag to m/s
+
+    :param value: the maxspeed tag, a number (km/h), "50", "30 mph", "50;30" or "none", "signals", "walk" ...
+    :return: the speed limit (m/s), None if the tag has no numeric speed limit
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) * KPH_TO_MPS
+    value = str(value).split(";")[0].strip().lower()
+    scale = KPH_TO_MPS
+    if value.endswith("mph"):
+        scale = MPH_TO_MPS
+        value = value[:-3]
+    elif value.endswith("km/h"):
+        value = value[:-4]
+    elif value.endswith("kmh"):
+        value = value[:-3]
+    try:
+        return float(value.strip()) * scale
+    except ValueError:
+        return None
+
+
+def parse_oneway(value):
+    """ Parse the OSM oneway tag
+
+    :param value: the oneway tag, "yes", "true", "1", "-1", "reverse", "no" ...
+    :return: 1 if the road is one way along its coordinates, -1 if against them, 0 if both ways
+    """
+    value = str(value).strip().lower()
+    if value in ("yes", "true", "1"):
+        return 1
+    if value in ("-1", "reverse"):
+        return -1
+    return 0
+
+
+class RoadNetwork:
+
+    def __init__(self, roads, spacing=10.0):
+        """ Initialize the road network & the spatial index of its segments
+             the points are projected to meters around the mean latitude of the network (equirectangular),
+             which is accurate for a city or region sized extract
+
+        :param roads: a list of road (may be empty, then no point has a segment), a road is a dict
+                  coords: a list of (latitude, longitude) along the road
+                  speed_limit: the speed limit (m/s), None if unknown
+                  id: the road id (optional, the position in the list by default)
+                  oneway: 1 one way along the coords, -1 against them, 0 both ways (optional, 0 by default)
+        :param spacing: The distance (m) between the sample points of the index along a segment
+        """
+        self.spacing = spacing
+        self.ids = []
+        self.speed_limit = np.full(len(roads), np.nan)
+        self.oneway = np.zeros(len(roads), dtype=int)
+
+        a_lat, a_long, b_lat, b_long = [np.zeros(0)], [np.zeros(0)], [np.zeros(0)], [np.zeros(0)]
+        segment_road = [np.zeros(0, dtype=int)]
+        for r, road in enumerate(roads):
+            self.ids.append(road.get("id", r))
+            if road.get("speed_limit") is not None:
+                self.speed_limit[r] = road["speed_limit"]
+            self.oneway[r] = road.get("oneway", 0)
+            coords = np.asarray(road["coords"], dtype=float)
+            a_lat.append(coords[:-1, 0])
+            a_long.append(coords[:-1, 1])
+            b_lat.append(coords[1:, 0])
+            b_long.append(coords[1:, 1])
+            segment_road.append(np.full(len(coords) - 1, r))
+
+        # a segment is a straight piece between two vertices of a road
+        self.a_lat = np.concatenate(a_lat)
+        self.a_long = np.concatenate(a_long)
+        self.b_lat = np.concatenate(b_lat)
+        self.b_long = np.concatenate(b_long)
+        self.segment_road = np.concatenate(segment_road)
+
+        self.ref_lat = float(np.mean(np.concatenate([self.a_lat, self.b_lat]))) if len(self.a_lat) > 0 else 0.0
+        self.a_xy = self.project(self.a_lat, self.a_long)
+        self.b_xy = self.project(self.b_lat, self.b_long)
+
+        # sample every segment each `spacing` meters, the nearest samples lead to the nearest segments
+        length = np.hypot(*(self.b_xy - self.a_xy).T)
+        count = np.maximum(np.ceil(length / spacing).astype(int), 1) + 1
+        sample_segment = np.repeat(np.arange(len(length)), count)
+        start = np.cumsum(count) - count
+        t = (np.arange(len(sample_segment)) - np.repeat(start, count)) / np.repeat(count - 1, count)
+        samples = self.a_xy[sample_segment] + t[:, None] * (self.b_xy - self.a_xy)[sample_segment]
+        self.sample_segment = sample_segment
+        self.tree = cKDTree(samples)
+        self.length = length
+
+        # the road graph, a node is a vertex shared by the roads (the same coordinates to 1e-7 degree)
+        vertex = np.round(np.concatenate([np.stack([self.a_lat, self.a_long], axis=1),
+                                          np.stack([self.b_lat, self.b_long], axis=1)]) * 1e7).astype(np.int64)
+        vertex, node = np.unique(vertex, axis=0, return_inverse=True)
+        node = node.reshape(-1)
+        self.node_count = len(vertex)
+        self.a_node = node[:len(length)]
+        self.b_node = node[len(length):]
+
+        # a segment is an edge a -> b and / or b -> a depending on the oneway of its road
+        oneway = self.oneway[self.segment_road]
+        forward = np.flatnonzero(oneway >= 0)
+        backward = np.flatnonzero(oneway <= 0)
+        source = np.concatenate([self.a_node[forward], self.b_node[backward]])
+        target = np.concatenate([self.b_node[forward], self.a_node[backward]])
+        weight = np.concatenate([length[forward], length[backward]])
+        order = np.argsort(source, kind="stable")
+        self.edge_pointer = np.concatenate(([0], np.cumsum(np.bincount(source, minlength=self.node_count))))
+        self.edge_target = target[order]
+        self.edge_weight = weight[order]
+
+    @classmethod
+    def from_geojson(cls, filename, spacing=10.0):
+        """ Load the road network from a GeoJSON file, e.g. an OSM extract
+             every LineString / MultiLineString feature is a road, the speed limit is taken from
+             the `maxspeed` property (OSM tag) or the `speed_limit` property (m/s), the direction from
+             the `oneway` property (OSM tag)
+
+        :param filename: The GeoJSON file
+        :param spacing: The distance (m) between the sample points of the index along a segment
+        :return: a RoadNetwork
+        """
+        with open(filename) as f:
+            features = json.load(f)["features"]
+
+        roads = []
+        for feature in features:
+            geometry = feature.get("geometry") or {}
+            properties = feature.get("properties") or {}
+            if geometry.get("type") == "LineString":
+                lines = [geometry["coordinates"]]
+            elif geometry.get("type") == "MultiLineString":
+                lines = geometry["coordinates"]
+            else:
+                continue
+
+            if properties.get("speed_limit") is not None:
+                speed_limit = float(properties["speed_limit"])
+            else:
+                speed_limit = parse_maxspeed(properties.get("maxspeed"))
+            oneway = parse_oneway(properties.get("oneway"))
+            id = feature.get("id", properties.get("osm_id", properties.get("id", len(roads))))
+            for line in lines:
+                if len(line) < 2:
+                    continue
+                roads.append({"id": id,
+                              "coords": [(point[1], point[0]) for point in line],     # GeoJSON is (long, lat)
+                              "speed_limit": speed_limit,
+                              "oneway": oneway})
+        return cls(roads, spacing)
+
+    def project(self, lat, long):
+        """ Project the points to meters (x, y) around the reference latitude
+
+        :param lat: an array of latitude
+        :param long: an array of longitude
+        :return: an array of (x, y)
+        """
+        lat = np.radians(np.asarray(lat, dtype=float))
+        long = np.radians(np.asarray(long, dtype=float))
+        x = EARTH_RADIUS * long * np.cos(np.radians(self.ref_lat))
+        y = EARTH_RADIUS * lat
+        return np.stack([x, y], axis=-1)
+
+    def segment_position(self, xy, segment):
+        """ The position of the closest point of the segments to the points, 0 at a & 1 at b
+
+        :param xy: an array of projected points
+        :param segment: an array of segment index, the same shape as the points (without the last axis)
+        :return: an array of position between 0 and 1
+        """
+        a = self.a_xy[segment]
+        ab = self.b_xy[segment] - a
+        length2 = np.sum(ab * ab, axis=-1)
+        t = np.sum((xy - a) * ab, axis=-1) / np.where(length2 > 0, length2, 1)
+        return np.clip(t, 0, 1)
+
+    def segment_distance(self, xy, segment):
+        """ The distance (m) of the points to the segments
+
+        :param xy: an array of projected points
+        :param segment: an array of segment index, the same shape as the points (without the last axis)
+        :return: an array of distance (m)
+        """
+        a = self.a_xy[segment]
+        ab = self.b_xy[segment] - a
+        t = self.segment_position(xy, segment)
+        return np.hypot(*np.moveaxis(xy - a - t[..., None] * ab, -1, 0))
+
+    def _sample_candidates(self, xy, k, bound):
+        """ The segments of the k nearest sample points of every point & their exact distance (inf if no sample),
+             and the distance of the k-th sample (a segment which is not a candidate is at least that far
+             minus spacing / 2, since a sample is at most spacing / 2 away from the closest point of its segment)
+        """
+        k = min(k, self.tree.n)
+        sample_distance, sample = self.tree.query(xy, k=k, distance_upper_bound=bound)
+        sample_distance = sample_distance.reshape(len(xy), k)
+        found = np.isfinite(sample_distance)
+        candidate = self.sample_segment[np.where(found, sample.reshape(len(xy), k), 0)]
+        distance = np.where(found, self.segment_distance(xy[:, None, :], candidate), np.inf)
+        return candidate, distance, sample_distance[:, -1]
+
+    def _ball_candidates(self, xy, radius):
+        """ Every segment with a sample point within radius of the point, sorted by exact distance """
+        candidate = np.unique(self.sample_segment[self.tree.query_ball_point(xy, radius)])
+        distance = self.segment_distance(np.broadcast_to(xy, (len(candidate), 2)), candidate)
+        order = np.argsort(distance, kind="stable")
+        return candidate[order], distance[order]
+
+    def nearest_segments(self, lat, long, max_distance=30.0, k=8):
+        """ Find the nearest segment of every point in bulk, the segments of the k nearest sample points are
+             ranked by their exact distance, a point whose nearest segment may not be among them (a crowded
+             intersection) is checked against every sample within reach, so the nearest segment is exact
+
+        :param lat: an array of latitude
+        :param long: an array of longitude
+        :param max_distance: The maximum distance (m) between a point & its segment
+        :param k: The number of nearest sample points checked for every point
+        :return segment: an array of segment index, -1 if no segment is within max_distance
+        :return distance: an array of distance (m), inf if no segment is within max_distance
+        """
+        xy = self.project(lat, long).reshape(-1, 2)
+        if len(xy) == 0 or len(self.length) == 0:
+            return np.full(len(xy), -1), np.full(len(xy), np.inf)
+        candidate, distance, last = self._sample_candidates(xy, k, max_distance + self.spacing)
+        best = np.argmin(distance, axis=1)
+        segment = candidate[np.arange(len(xy)), best]
+        distance = distance[np.arange(len(xy)), best]
+
+        reach = np.minimum(distance, max_distance) + self.spacing / 2
+        for i in np.flatnonzero(last <= reach).tolist():
+            ball, ball_distance = self._ball_candidates(xy[i], reach[i])
+            if len(ball) > 0 and ball_distance[0] < distance[i]:
+                segment[i], distance[i] = ball[0], ball_distance[0]
+
+        far = distance > max_distance
+        segment[far] = -1
+        distance[far] = np.inf
+        return segment, distance
+
+    def candidate_segments(self, lat, long, radius=50.0, beam=8):
+        """ Find the `beam` nearest different segments of every point in bulk, exact in the same way as
+             nearest_segments
+
+        :param lat: an array of latitude
+        :param long: an array of longitude
+        :param radius: The maximum distance (m) between a point & its candidate segments
+        :param beam: The maximum number of candidate segments of a point
+        :return segment: an array (points x beam) of segment index sorted by distance, -1 if no more candidate
+        :return distance: an array (points x beam) of distance (m), inf if no more candidate
+        """
+        xy = self.project(lat, long).reshape(-1, 2)
+        if len(xy) == 0 or len(self.length) == 0:
+            return np.full((len(xy), beam), -1), np.full((len(xy), beam), np.inf)
+        candidate, distance, last = self._sample_candidates(xy, max(4 * beam, 8), radius + self.spacing)
+
+        # the samples of the same segment lead to the same candidate, only one is kept
+        order = np.lexsort((distance, candidate), axis=1)
+        candidate = np.take_along_axis(candidate, order, axis=1)
+        distance = np.take_along_axis(distance, order, axis=1)
+        distance[:, 1:][candidate[:, 1:] == candidate[:, :-1]] = np.inf
+        distance[distance > radius] = np.inf
+
+        order = np.argsort(distance, axis=1, kind="stable")[:, :beam]
+        candidate = np.take_along_axis(candidate, order, axis=1)
+        distance = np.take_along_axis(distance, order, axis=1)
+        if candidate.shape[1] < beam:
+            pad = beam - candidate.shape[1]
+            candidate = np.pad(candidate, ((0, 0), (0, pad)))
+            distance = np.pad(distance, ((0, 0), (0, pad)), constant_values=np.inf)
+
+        reach = np.minimum(distance[:, -1], radius) + self.spacing / 2
+        for i in np.flatnonzero(last <= reach).tolist():
+            ball, ball_distance = self._ball_candidates(xy[i], reach[i])
+            keep = ball_distance <= radius
+            ball, ball_distance = ball[keep][:beam], ball_distance[keep][:beam]
+            candidate[i], distance[i] = 0, np.inf
+            candidate[i, :len(ball)], distance[i, :len(ball)] = ball, ball_distance
+        candidate[np.isinf(distance)] = -1
+        return candidate, distance
+
+    def nearest_roads(self, lat, long, max_distance=30.0):
+        """ Find the nearest road of every point in bulk
+
+        :param lat: an array of latitude
+        :param long: an array of longitude
+        :param max_distance: The maximum distance (m) between a point & its road
+        :return: an array of road index, -1 if no road is within max_distance
+        """
+        segment, distance = self.nearest_segments(lat, long, max_distance)
+        if len(self.length) == 0:
+            return segment
+        return np.where(segment >= 0, self.segment_road[segment], -1)
+
+    def speed_limits(self, lat, long, max_distance=30.0):
+        """ The speed limit of the nearest road of every point in bulk
+
+        :param lat: an array of latitude
+        :param long: an array of longitude
+        :param max_distance: The maximum distance (m) between a point & its road
+        :return: an array of speed limit (m/s), NaN if no road is within max_distance or its speed limit is unknown
+        """
+        road = self.nearest_roads(lat, long, max_distance)
+        if len(self.speed_limit) == 0:
+            return np.full(len(road), np.nan)
+        return np.where(road >= 0, self.speed_limit[road], np.nan)
+
+
+class RoadDistanceEngine:
+
+    def __init__(self, network, max_distance=30.0, limit=None, cache_size=1000000, detour=3.0):
+        """ Initialize the road distance engine on the graph of the road network
+             a point is snapped to its nearest segment, the distance between two points is the length of the
+             shortest path on the graph (Dijkstra), the node to node distances are cached
+             the search of every pair is bounded, so two fixes far apart on the graph do not explore the whole
+             network, a pair whose road distance is beyond the bound is not reachable
+
+        :param network: The RoadNetwork
+        :param max_distance: The maximum distance (m) between a point & its segment
+        :param limit: The maximum road distance (m) searched, None for a bound of every pair:
+                      detour * the straight distance of the snapped points + 2 * max_distance
+        :param cache_size: The maximum number of node pairs in the cache, the least recently used are evicted
+        :param detour: The maximum ratio of the road distance to the straight distance when limit is None
+        """
+        self.network = network
+        self.max_distance = max_distance
+        self.limit = limit
+        self.detour = detour
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # python lists are much faster than numpy scalars in the Dijkstra loop
+        self._pointer = network.edge_pointer.tolist()
+        self._target = network.edge_target.tolist()
+        self._weight = network.edge_weight.tolist()
+
+    def snap(self, lat, long):
+        """ Snap the points to their nearest segment in bulk
+
+        :param lat: an array of latitude
+        :param long: an array of longitude
+        :return segment: an array of segment index, -1 if no segment is within max_distance
+        :return position: an array of the position on the segment, 0 at a & 1 at b
+        """
+        network = self.network
+        segment, distance = network.nearest_segments(lat, long, self.max_distance)
+        xy = network.project(lat, long).reshape(-1, 2)
+        if len(network.length) == 0:
+            return segment, np.zeros(len(segment))
+        position = network.segment_position(xy, np.maximum(segment, 0))
+        return segment, position
+
+    def _dijkstra(self, source, targets, limit):
+        """ The shortest distance from the source node to the target nodes, inf if not reachable within limit """
+        remaining = set(targets)
+        found = {}
+        best = {source: 0.0}
+        heap = [(0.0, source)]
+        while heap and remaining:
+            d, u = heapq.heappop(heap)
+            if d > best.get(u, float("inf")):
+                continue
+            if u in remaining:
+                found[u] = d
+                remaining.discard(u)
+            for e in range(self._pointer[u], self._pointer[u + 1]):
+                v = self._target[e]
+                nd = d + self._weight[e]
+                if nd <= limit and nd < best.get(v, float("inf")):
+                    best[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        for v in remaining:
+            found[v] = float("inf")
+        return found
+
+    def node_distances(self, pairs, limits=None):
+        """ The shortest distance of the node pairs, a single Dijkstra is run for every source node
+
+        :param pairs: a list of (source node, target node)
+        :param limits: a list of the maximum distance (m) searched for every pair, the limit of the engine by default
+                       (no limit if the engine has none)
+        :return: a list of distance (m), inf if not reachable within limit
+        """
+        default = self.limit if self.limit is not None else float("inf")
+        if limits is None:
+            limits = [default] * len(pairs)
+        result = [None] * len(pairs)
+        missing = {}
+        for k, pair in enumerate(pairs):
+            cached = self.cache.get(pair)
+            if pair[0] == pair[1]:
+                result[k] = 0.0
+            elif cached is not None and (cached >= 0 or -cached >= limits[k]):
+                # a negative value is the limit of a search which did not reach the target
+                self.cache.move_to_end(pair)
+                result[k] = cached if cached >= 0 else float("inf")
+                self.hits += 1
+            else:
+                missing.setdefault(pair[0], {}).setdefault(pair[1], []).append(k)
+                self.misses += 1
+
+        for source, targets in missing.items():
+            limit = max(limits[k] for ks in targets.values() for k in ks)
+            found = self._dijkstra(source, targets, limit)
+            for target, ks in targets.items():
+                for k in ks:
+                    result[k] = found[target]
+                self.cache[(source, target)] = found[target] if found[target] != float("inf") else -limit
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    def distances(self, lat1, long1, lat2, long2):
+        """ The road distance between the start & end points in bulk
+
+        :param lat1: an array of start latitude
+        :param long1: an array of start longitude
+        :param lat2: an array of end latitude
+        :param long2: an array of end longitude
+        :return: an array of road distance (m), NaN if a point is not snapped or the end is not reachable
+        """
+        segment1, position1 = self.snap(lat1, long1)
+        segment2, position2 = self.snap(lat2, long2)
+        return self.route_distances(segment1, position1, segment2, position2)
+
+    def route_distances(self, segment1, position1, segment2, position2, limit=None):
+        """ The road distance between the points on the segments in bulk
+
+        :param segment1: an array of start segment, -1 if not snapped
+        :param position1: an array of the start position on the segment, 0 at a & 1 at b
+        :param segment2: an array of end segment, -1 if not snapped
+        :param position2: an array of the end position on the segment
+        :param limit: the maximum distance (m) searched, a number or an array for every pair,
+                      the limit of the engine by default, see RoadDistanceEngine
+        :return: an array of road distance (m), NaN if a point is not snapped or the end is not reachable
+        """
+        network = self.network
+        segment1, segment2 = np.asarray(segment1), np.asarray(segment2)
+        result = np.full(len(segment1), np.nan)
+        k = np.flatnonzero((segment1 >= 0) & (segment2 >= 0))
+        if len(k) == 0:
+            return result
+        s1, s2 = segment1[k], segment2[k]
+        t1, t2 = np.asarray(position1)[k], np.asarray(position2)[k]
+        oneway1 = network.oneway[network.segment_road[s1]]
+        oneway2 = network.oneway[network.segment_road[s2]]
+        length1, length2 = network.length[s1], network.length[s2]
+
+        # the start & end on the same segment may go along it directly
+        direct = np.full(len(k), np.inf)
+        forward = (s1 == s2) & (t2 >= t1) & (oneway1 >= 0)
+        backward = (s1 == s2) & (t2 <= t1) & (oneway1 <= 0) & ~forward
+        direct[forward] = ((t2 - t1) * length1)[forward]
+        direct[backward] = ((t1 - t2) * length1)[backward]
+
+        # every start leaves its segment at b or a, every end enters its segment at a or b
+        exit_node = np.stack([network.b_node[s1], network.a_node[s1]])
+        exit_distance = np.stack([(1 - t1) * length1, t1 * length1])
+        exit_ok = np.stack([oneway1 >= 0, oneway1 <= 0])
+        entry_node = np.stack([network.a_node[s2], network.b_node[s2]])
+        entry_distance = np.stack([t2 * length2, (1 - t2) * length2])
+        entry_ok = np.stack([oneway2 >= 0, oneway2 <= 0])
+
+        valid = exit_ok[:, None, :] & entry_ok[None, :, :]
+        source = np.broadcast_to(exit_node[:, None, :], valid.shape)[valid]
+        target = np.broadcast_to(entry_node[None, :, :], valid.shape)[valid]
+        if limit is None:
+            limit = self.limit
+        if limit is None:
+            start = network.a_xy[s1] + t1[:, None] * (network.b_xy[s1] - network.a_xy[s1])
+            end = network.a_xy[s2] + t2[:, None] * (network.b_xy[s2] - network.a_xy[s2])
+            limit = self.detour * np.hypot(*(end - start).T) + 2 * self.max_distance
+        else:
+            limit = np.broadcast_to(np.asarray(limit, dtype=float), segment1.shape)[k]
+
+        # the node to node search is bounded by the limit less the way to the exit & from the entry
+        exit_way = np.broadcast_to(exit_distance[:, None, :], valid.shape)[valid]
+        entry_way = np.broadcast_to(entry_distance[None, :, :], valid.shape)[valid]
+        node_limit = np.broadcast_to(limit, valid.shape)[valid] - exit_way - entry_way
+        search = node_limit >= 0
+        node_distance = np.full(len(node_limit), np.inf)
+        if search.any():
+            # every different node pair is searched once
+            key, inverse = np.unique(source[search].astype(np.int64) * network.node_count + target[search],
+                                     return_inverse=True)
+            key_limit = np.zeros(len(key))
+            np.maximum.at(key_limit, inverse.reshape(-1), node_limit[search])
+            pairs = list(zip((key // network.node_count).tolist(), (key % network.node_count).tolist()))
+            node_distance[search] = np.asarray(self.node_distances(pairs, key_limit.tolist()),
+                                               dtype=float)[inverse.reshape(-1)]
+
+        total = np.full(valid.shape, np.inf)
+        total[valid] = exit_way + node_distance + entry_way
+        best = np.minimum(direct, total.min(axis=(0, 1)))
+        best[best > limit] = np.inf
+        result[k] = np.where(np.isinf(best), np.nan, best)
+        return result
+
+    def distance(self, lat1, long1, lat2, long2):
+        """ The road distance between two points
+
+        :return: the road distance (m), NaN if a point is not snapped or the end is not reachable
+        """
+        return float(self.distances([lat1], [long1], [lat2], [long2])[0])
+
+    def path_distances(self, lat, long):
+        """ The road distance between the consecutive points of a trip
+
+        :param lat: a list of latitude
+        :param long: a list of longitude
+        :return: an array of road distance (m), its length is the number of points - 1
+        """
+        segment, position = self.snap(lat, long)          # every point is snapped once
+        return self.route_distances(segment[:-1], position[:-1], segment[1:], position[1:])
+
+    def stats(self):
+        """ Take the hit & miss counters of the node pair cache
+
+        :return: a dict of hits, misses, hit_rate, pairs
+        """
+        total = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total > 0 else 0.0,
+                "pairs": len(self.cache)}
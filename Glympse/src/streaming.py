@@ -0,0 +1,324 @@
+from collections import deque
+import numpy as np
+
+from Maneuver_detect import segment_speed
+
+MIN_POINTS = 30             # organize_data drops the shorter tasks
+BOX = np.ones(3) / 3        # the smooth box of fill_speed
+
+
+def _value(value):
+    """None & NaN are missing, they are turned to NaN"""
+    return np.nan if value is None or value != value else float(value)
+
+
+class _SpeedDetector:
+    """The acceleration & hardbrake state of a speed stream, the same rules as find_ACC & find_hardbrake,
+       the events are counted & kept in acc & hb only if keep is True
+    """
+
+    def __init__(self, keep=True):
+        self.acc = [] if keep else None
+        self.hb = [] if keep else None
+        self.acc_number = 0
+        self.hb_number = 0
+        self.points = 0
+        self.last = None            # the last (speed, time)
+        self.start = None           # the open acceleration (point, time)
+
+    def add(self, speed, time):
+        """Take the next speed point
+
+        :return: a list of the new events
+        """
+        last = self.last
+        self.last = (speed, time)
+        self.points += 1
+        if last is None:
+            return []
+
+        events = []
+        point = self.points - 2
+        diff = speed - last[0]
+        if self.start is None:
+            if 3 < diff < 9:                                    # acceleration exceeds 3m per second
+                self.start = (point, last[1])
+        elif diff < 2:
+            start, start_time = self.start
+            self.start = None
+            if last[1] - start_time > 2:                        # acceleration time interval
+                self.acc_number += 1
+                if self.acc is not None:
+                    self.acc += [start, point]
+                events.append(("ACC", start, point))
+
+        time_diff = time - last[1]
+        brake = -diff / (time_diff if time_diff != 0 else 1)
+        if 5 < brake < 8 and point != 0:                        # find_dic_HB drops the first point
+            self.hb_number += 1
+            if self.hb is not None:
+                self.hb.append(point)
+            events.append(("HB", point))
+        return events
+
+
+class _SmoothSpeed:
+    """smooth(speed, 3) of a speed stream, a point is smoothed once the next one is known"""
+
+    def __init__(self):
+        self.window = deque(maxlen=3)
+
+    def add(self, speed, time):
+        """Take the next speed point
+
+        :return: a list of the new (smoothed speed, time)
+        """
+        self.window.append((speed, time))
+        if len(self.window) == 2:
+            speeds = [self.window[0][0], self.window[1][0], 0.0]
+            return [(float(np.convolve(speeds, BOX, mode='same')[0]), self.window[0][1])]
+        if len(self.window) == 3:
+            speeds = [value[0] for value in self.window]
+            return [(float(np.convolve(speeds, BOX, mode='valid')[0]), self.window[1][1])]
+        return []
+
+    def finish(self):
+        """Smooth the last point
+
+        :return: a list of the new (smoothed speed, time)
+        """
+        if len(self.window) < 2:
+            return []
+        speeds = [0.0, self.window[-2][0], self.window[-1][0]]
+        return [(float(np.convolve(speeds, BOX, mode='same')[2]), self.window[-1][1])]
+
+
+class StreamingDetector:
+    """Detect the turning, acceleration & hardbrake of a task from a live location feed,
+       the points are taken one at a time or in small batches and only the last few points are kept,
+       when the task ends finish gives the same result as organize_data followed by find_dic_turning,
+       find_dic_ACC & find_dic_HB
+
+       the speed of a point is filled when the next point comes, the missing headings are filled when the
+       next valid heading comes, an event is emitted as soon as its end point is filled, the detector does
+       not keep the emitted events, so with keep=False its state is a few points whatever the task length
+
+       fill_speed smooths the speed only when no speed point (but the last) is missing, so ACC & HB are
+       detected on both the smoothed & the raw speed, until a missing speed point is seen the events of the
+       smoothed speed are emitted as ("ACC", ...) & ("HB", ...) and the events of the raw speed as
+       ("raw ACC", ...) & ("raw HB", ...), then a ("switch",) event drops the smoothed ACC & HB events
+       emitted so far and makes the raw ones the ACC & HB events of the task, from then on the raw speed is
+       used and its events are emitted as ("ACC", ...) & ("HB", ...)
+       if the task ends without a switch the raw events are dropped, a consumer keeps them until then
+
+       so a consumer of the events must buffer every raw ACC & HB event (and the ACC & HB events it shows)
+       until the task ends or switches, this is O(task) events, not points, and cannot be avoided by the
+       detector, which speed (smoothed or raw) is right is only known at a missing speed point or at finish;
+       a consumer which needs the final events only should use keep=True & take the lists of finish
+    """
+
+    def __init__(self, key=None, keep=True):
+        """Initialize the detector of a task
+
+        :param key: task id
+        :param keep: keep the turning & ACC & HB lists of the task for finish, otherwise finish gives
+                     the counts only & the memory does not grow with the task
+        """
+        self.key = key
+        self.keep = keep
+        self.points = 0
+        self.finished = False
+
+        self.last = None                        # the last point (lat, long, speed, time), filled at the next one
+        self.filled = None                      # the filled speed of the point before it
+        self.missing = False                    # a speed point (but the last) is missing, no smoothing
+        self.raw = _SpeedDetector(keep)         # its events are tagged raw before the switch
+        self.smoothed = _SpeedDetector(keep)    # None after the switch
+        self.smooth = _SmoothSpeed()
+
+        self.gap = 0                            # the number of missing headings since the last valid one
+        self.heading = None                     # the last valid (heading, unwrapped heading)
+        self.correct = 0.0                      # the unwrap correction, the same as np.unwrap
+        self.headings = deque(maxlen=5)         # the last filled headings
+        self.heading_points = 0
+        self.turn_start = None                  # the open turning (point, heading of the turning start)
+        self.turning = [] if keep else None
+        self.turning_number = 0
+        self.all_zero = True
+
+    def push(self, lat, long, speed, heading, time):
+        """Take the next location point
+
+        :param lat: latitude
+        :param long: longitude
+        :param speed: speed, None if missing
+        :param heading: heading angle, None if missing
+        :param time: timestamp
+        :return: a list of the new events, ("turning", start, end), ("ACC", start, end), ("HB", point),
+                 ("raw ACC", start, end), ("raw HB", point) or ("switch",) which drops the ACC & HB events
+                 emitted before it & turns the raw ones to ACC & HB
+        """
+        if self.finished:
+            raise ValueError("the detector of {} is finished".format(self.key))
+        self.points += 1
+
+        events = []
+        if self.last is not None:
+            events += self._fill_speed(lat, long, time)
+        self.last = (lat, long, _value(speed), time)
+        events += self._fill_heading(_value(heading))
+        return events
+
+    def extend(self, lat, long, speed, heading, time):
+        """Take the next location points
+
+        :param lat: a list of latitude
+        :param long: a list of longitude
+        :param speed: a list of speed
+        :param heading: a list of heading angle
+        :param time: a list of timestamp
+        :return: a list of the new events
+        """
+        events = []
+        for point in zip(lat, long, speed, heading, time):
+            events += self.push(*point)
+        return events
+
+    def _fill_speed(self, lat, long, time):
+        """Fill the speed of the last point, now it is not the last one, the same as fill_speed"""
+        last_lat, last_long, speed, last_time = self.last
+        switch = speed != speed and not self.missing
+        if speed != speed or speed <= 0:
+            speed = float(segment_speed([last_lat, lat], [last_long, long], [last_time, time])[0])
+            if speed < 0.1:                                     # if calculated speed less tham 0.1m/s set it to zero
+                speed = 0.0
+
+        if switch:
+            self.missing = True
+            self.smoothed = None
+            return [("switch",)] + self._add_speed(speed, last_time)
+        return self._add_speed(speed, last_time)
+
+    def _add_speed(self, speed, time):
+        self.filled = speed
+        events = self.raw.add(speed, time)
+        if self.missing:
+            return events
+        events = [("raw " + event[0],) + event[1:] for event in events]
+        for value in self.smooth.add(speed, time):
+            events += self.smoothed.add(*value)
+        return events
+
+    def _fill_heading(self, heading):
+        """Fill the missing headings when a valid one comes, the same as fill_heading"""
+        if heading != heading:
+            self.gap += 1
+            return []
+
+        if self.heading is None:
+            filled = [heading % 360] * self.gap                 # the leading gap takes the first heading
+            unwrapped = heading
+        else:
+            last, last_unwrapped = self.heading
+            diff = heading - last
+            mod = np.mod(diff + 180, 360) - 180
+            if mod == -180 and diff > 0:
+                mod = 180
+            if abs(diff) >= 180:
+                self.correct += mod - diff
+            unwrapped = heading + self.correct
+            filled = np.interp(np.arange(1, self.gap + 1), [0, self.gap + 1], [last_unwrapped, unwrapped])
+            filled = (filled % 360).tolist()
+        self.heading = (heading, unwrapped)
+        self.gap = 0
+
+        events = []
+        for value in filled + [heading]:
+            events += self._add_heading(value)
+        return events
+
+    def _add_heading(self, heading):
+        """Take the next filled heading, the same rules as find_turning (the last heading is not used)"""
+        self.headings.append(heading)
+        self.heading_points += 1
+        self.all_zero = self.all_zero and heading == 0
+        if self.heading_points < 3:
+            return []
+
+        point = self.heading_points - 3
+        diff = abs(self.headings[-2] - self.headings[-3])
+        if self.turn_start is None:
+            if 19 < diff < 70:                                  # the turning began
+                self.turn_start = (max(point - 2, 0), self.headings[0])
+        elif diff < 5:                                          # the turning end
+            start, start_heading = self.turn_start
+            self.turn_start = None
+            angle_diff = abs(self.headings[-2] - start_heading)
+            if not (angle_diff < 30 or angle_diff > 150):
+                self.turning_number += 1
+                if self.turning is not None:
+                    self.turning += [start, point + 2]
+                return [("turning", start, point + 2)]
+        return []
+
+    def finish(self):
+        """End the task, fill the last point & the trailing missing headings
+
+        :return: None if organize_data drops the task (less than 30 points, no heading, every heading is 0),
+                 otherwise a dict of the results of the task, the lists are None if keep is False
+                 turning: [turning list, count of turning], the same as find_dic_turning
+                 ACC: [acceleration list, count of acceleration], the same as find_dic_ACC
+                 HB: [hardbrake list, count of hardbrake], the same as find_dic_HB
+                 events: a list of the new events of the last point & the trailing headings
+        """
+        if self.finished:
+            raise ValueError("the detector of {} is finished".format(self.key))
+        self.finished = True
+        if self.points < MIN_POINTS or self.heading is None:
+            return None
+
+        speed, time = self.last[2], self.last[3]
+        if speed != speed or speed <= 0:
+            speed = self.filled
+        events = self._add_speed(speed, time)
+        if not self.missing:
+            for value in self.smooth.finish():
+                events += self.smoothed.add(*value)
+        for value in [self.heading[1] % 360] * self.gap:        # the trailing gap takes the last heading
+            events += self._add_heading(value)
+        self.gap = 0
+
+        if self.all_zero:
+            return None
+        speed = self.raw if self.missing else self.smoothed
+        return {"turning": [self.turning, self.turning_number],
+                "ACC": [speed.acc, speed.acc_number],
+                "HB": [speed.hb, speed.hb_number],
+                "events": events}
+
+
+def stream_data(data, chunk_size=1):
+    """Feed every task of the data to a StreamingDetector, chunk_size points at a time,
+       the same results as find_dic_turning, find_dic_ACC & find_dic_HB of organize_data(data)
+       the events of push & extend are not used, the final lists are taken from finish (keep=True),
+       so the raw & smoothed ACC & HB of a task are kept by the detector until the task ends
+
+    :param data: a dict of data (the raw data, not organized)
+    :param chunk_size: the number of points taken at a time
+    :return dict_turning: a dict of [turning list, count of turning] of the tasks with turning
+    :return dict_acc: a dict of [acceleration list, count of acceleration]
+    :return dict_hb: a dict of [hardbrake list, count of hardbrake]
+    """
+    dict_turning, dict_acc, dict_hb = {}, {}, {}
+    for key, value in data.items():
+        detector = StreamingDetector(key)
+        for start in range(0, len(value[4]), chunk_size):
+            detector.extend(*[column[start:start + chunk_size] for column in value])
+        result = detector.finish()
+        if result is None:
+            continue
+        if result["turning"][1] > 0:
+            dict_turning[key] = result["turning"]
+        dict_acc[key] = result["ACC"]
+        dict_hb[key] = result["HB"]
+    return dict_turning, dict_acc, dict_hb
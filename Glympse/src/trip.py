@@ -0,0 +1,321 @@
+import numpy as np
+
+from tripfile import TripFile
+
+FIELDS = ("lat", "long", "speed", "heading", "time")
+DTYPES = (np.float64, np.float64, np.float64, np.float64, np.int64)
+
+
+class Trip:
+    """The location points of a task as five contiguous typed columns,
+       lat, long, speed, heading (float64, missing value is NaN) & time (int64), 40 bytes per point
+
+       a Trip can be used in place of the [latitude, longitude, speed, heading, time] list of the dict data,
+       trip[0] ... trip[4] are the columns (a slice is a list of columns), so every function of
+       Maneuver_detect accepts it
+    """
+    __slots__ = FIELDS
+
+    def __init__(self, lat, long, speed, heading, time):
+        """Initialize the trip, the columns are converted to the typed arrays (no copy if they already are)
+
+        :param lat: a list of latitude
+        :param long: a list of longitude
+        :param speed: a list of speed
+        :param heading: a list of heading angle
+        :param time: a list of timestamp
+        """
+        for name, dtype, column in zip(FIELDS, DTYPES, (lat, long, speed, heading, time)):
+            object.__setattr__(self, name, np.asarray(column, dtype=dtype))
+
+    @classmethod
+    def from_list(cls, value):
+        """Take the trip of the json layout
+
+        :param value: [latitude, longitude, speed, heading, time], a missing value is None
+        :return: a Trip
+        """
+        return cls(*[np.array(column, dtype=dtype) for column, dtype in zip(value, DTYPES)])   # None -> NaN
+
+    def to_list(self):
+        """Take the json layout of the trip
+
+        :return: [latitude, longitude, speed, heading, time], NaN is turned back to None
+        """
+        value = []
+        for name in FIELDS[:4]:
+            value.append([None if v != v else v for v in getattr(self, name).tolist()])
+        value.append(self.time.tolist())
+        return value
+
+    @property
+    def points(self):
+        """The number of location points"""
+        return len(self.time)
+
+    @property
+    def nbytes(self):
+        """The memory (bytes) of the columns"""
+        return sum(getattr(self, name).nbytes for name in FIELDS)
+
+    def __setattr__(self, name, column):
+        if name not in FIELDS:
+            raise AttributeError("Trip has no column " + repr(name))
+        object.__setattr__(self, name, np.asarray(column, dtype=DTYPES[FIELDS.index(name)]))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):                    # value[2:] of the list layout
+            return [getattr(self, name) for name in FIELDS[index]]
+        return getattr(self, FIELDS[index])
+
+    def __setitem__(self, index, column):
+        setattr(self, FIELDS[index], column)
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def __iter__(self):
+        return (getattr(self, name) for name in FIELDS)
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in FIELDS)
+
+    def __setstate__(self, state):
+        for name, column in zip(FIELDS, state):
+            object.__setattr__(self, name, column)
+
+    def __repr__(self):
+        return "Trip(points={})".format(self.points)
+
+
+def from_data(data):
+    """Convert the dict data of the json layout to a dict of Trip
+
+    :param data: the dict of data
+    :return: a dict of Trip, the keys are the same as data
+    """
+    return {key: Trip.from_list(value) for key, value in data.items()}
+
+
+def to_data(trips):
+    """Convert a dict of Trip to the dict data of the json layout
+
+    :param trips: a dict of Trip
+    :return: the dict of data, it can be written by json.dump
+    """
+    return {key: trip.to_list() for key, trip in trips.items()}
+
+
+def open_trips(filename):
+    """Read the columnar binary trip file written by Query.to_columnar to a dict of Trip,
+       the columns of every trip are views of the memory-mapped file (read only, no copy)
+
+    :param filename: the filename you want to read
+    :return: a dict of Trip
+    """
+    return {key: Trip(*value) for key, value in TripFile(filename).items()}
+
+
+class TripBatch:
+    """The location points of many tasks as five concatenated columns & an offsets array (ragged arrays),
+       the points of the i-th task are the rows offsets[i]:offsets[i + 1] of every column,
+       the find_batch_* functions run the detection over every task at once
+    """
+
+    def __init__(self, keys, offsets, lat, long, speed, heading, time):
+        """Initialize the batch, the columns are converted to the typed arrays (no copy if they already are)
+
+        :param keys: a list of task id
+        :param offsets: a list of the first row of every task & the end of the last one, len(keys) + 1 values
+        :param lat: an array of latitude of every task
+        :param long: an array of longitude of every task
+        :param speed: an array of speed of every task
+        :param heading: an array of heading angle of every task
+        :param time: an array of timestamp of every task
+        """
+        self.keys = list(keys)
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.columns = [np.asarray(column, dtype=dtype)
+                        for column, dtype in zip((lat, long, speed, heading, time), DTYPES)]
+        self.lat, self.long, self.speed, self.heading, self.time = self.columns
+        self.lengths = np.diff(self.offsets)
+        self.task = np.repeat(np.arange(len(self.keys)), self.lengths)      # the task of every row
+
+    @classmethod
+    def from_data(cls, data):
+        """Concatenate the dict data (of Trip or of the json layout) to a batch
+
+        :param data: the dict of data
+        :return: a TripBatch
+        """
+        trips = [value if isinstance(value, Trip) else Trip.from_list(value) for value in data.values()]
+        offsets = np.concatenate(([0], np.cumsum([trip.points for trip in trips], dtype=np.int64)))
+        columns = []
+        for i, dtype in enumerate(DTYPES):
+            columns.append(np.concatenate([trip[i] for trip in trips]) if trips else np.zeros(0, dtype=dtype))
+        return cls(data.keys(), offsets, *columns)
+
+    @classmethod
+    def open(cls, filename):
+        """Read the columnar binary trip file written by Query.to_columnar to a batch,
+           the columns are the memory-mapped columns of the file (read only, no copy)
+
+        :param filename: the filename you want to read
+        :return: a TripBatch
+        """
+        trip_file = TripFile(filename)
+        return cls(trip_file.index, trip_file.offsets, *trip_file.columns)
+
+    @property
+    def points(self):
+        """The number of location points of every task"""
+        return len(self.task)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, key):
+        i = self.index[key]
+        return Trip(*[column[self.offsets[i]:self.offsets[i + 1]] for column in self.columns])
+
+    def to_trips(self):
+        """Split the batch to a dict of Trip, the columns of the trips are views of the batch
+
+        :return: a dict of Trip
+        """
+        return {key: self[key] for key in self.keys}
+
+    def inside(self, step):
+        """The mask of the rows whose row + step is in the same task
+
+        :param step: the distance between the rows
+        :return: a boolean array, its length is points - step
+        """
+        return self.task[step:] == self.task[:max(self.points - step, 0)]
+
+    def split(self, rows, *values):
+        """Group the values of the rows by task
+
+        :param rows: a sorted array of row
+        :param values: arrays of the same length as rows
+        :return: a list of (key, value arrays of the task) of every task
+        """
+        bounds = np.searchsorted(rows, self.offsets[1:-1])
+        return zip(self.keys, *[np.split(value, bounds) for value in values])
+
+    def __repr__(self):
+        return "TripBatch(tasks={}, points={})".format(len(self), self.points)
+
+
+def _batch_pairs(batch, starts, ends):
+    """The start_end_pairs of every task at once, a start is paired with the next end of the same task,
+       a start is dropped if the previous start is paired with the same end
+    """
+    next_end = np.searchsorted(ends, starts, side='right')
+    valid = next_end < len(ends)
+    starts, next_end = starts[valid], next_end[valid]
+    valid = batch.task[ends[next_end]] == batch.task[starts]
+    starts, next_end = starts[valid], next_end[valid]
+    first = np.concatenate(([True], next_end[1:] != next_end[:-1]))[:len(starts)]
+    return starts[first], ends[next_end[first]]
+
+
+def _pair_dict(batch, starts, ends):
+    """The dict of [[start, end, ...], count] of every task, rows are turned into the point index of the task"""
+    offset = batch.offsets[batch.task[starts]]
+    result = {}
+    for key, start, end in batch.split(starts, starts - offset, ends - offset):
+        result[key] = [np.stack([start, end], axis=1).reshape(-1).tolist(), len(start)]
+    return result
+
+
+def find_batch_HB(batch):
+    """Find the hardbrake of every task of the batch, the same as Maneuver_detect.find_dic_HB
+
+    :param batch: a TripBatch
+    :return dict_hb: a dict of [hardbrake list, count of hardbrake] of every task
+    :return total_number: a count of hardbrake in the data, int
+    """
+    time_diff = np.diff(batch.time)
+    diff = -np.diff(batch.speed) / np.where(time_diff == 0, 1, time_diff)
+    rows = np.flatnonzero((diff > 5) & (diff < 8) & batch.inside(1))
+    rows = rows[rows != batch.offsets[batch.task[rows]]]       # a hardbrake at the first point is not counted
+
+    dict_hb = {}
+    for key, points in batch.split(rows, rows - batch.offsets[batch.task[rows]]):
+        dict_hb[key] = [points.tolist(), len(points)]
+    return dict_hb, len(rows)
+
+
+def find_batch_ACC(batch):
+    """Find the acceleration of every task of the batch, the same as Maneuver_detect.find_dic_ACC
+
+    :param batch: a TripBatch
+    :return dict_acc: a dict of [acceleration list, count of acceleration] of every task
+    :return total_number: a count of acceleration in the data, int
+    """
+    diff = np.diff(batch.speed)
+    inside = batch.inside(1)
+    starts, ends = _batch_pairs(batch, np.flatnonzero((diff > 3) & (diff < 9) & inside),
+                                np.flatnonzero((diff < 2) & inside))
+    keep = batch.time[ends] - batch.time[starts] > 2
+    return _pair_dict(batch, starts[keep], ends[keep]), int(keep.sum())
+
+
+def _batch_turning(batch):
+    """The first & the end (exclusive) rows of every turning of the batch"""
+    diff = np.abs(np.diff(batch.heading))
+    inside = np.append(batch.inside(2), False)[:len(diff)]     # the last heading change of a task is not used
+    starts, ends = _batch_pairs(batch, np.flatnonzero((diff > 19) & (diff < 70) & inside),
+                                np.flatnonzero((diff < 5) & inside))
+    starts = np.maximum(starts - 2, batch.offsets[batch.task[starts]])
+    angle_diff = np.abs(batch.heading[ends + 1] - batch.heading[starts])
+    keep = ~((angle_diff < 30) | (angle_diff > 150))
+    return starts[keep], ends[keep] + 2
+
+
+def find_batch_turning(batch):
+    """Find the turning of every task of the batch, the same as Maneuver_detect.find_dic_turning
+
+    :param batch: a TripBatch
+    :return dict_turning: a dict of [turning list, count of turning] of the tasks with turning
+    :return total_number: a count of turning in the data, int
+    """
+    starts, ends = _batch_turning(batch)
+    dict_turning = {key: value for key, value in _pair_dict(batch, starts, ends).items() if value[1] > 0}
+    return dict_turning, len(starts)
+
+
+def batch_turning_speed(batch):
+    """Calculate the average turning speed & the count of fast turn of the tasks with turning,
+       the same as Maneuver_detect.calculate_average_speed & count_fast_turn (up to float rounding)
+
+    :param batch: a TripBatch
+    :return: a dict of [average turning speed, count of fast turn] of the tasks with turning
+    """
+    starts, ends = _batch_turning(batch)
+    if len(starts) == 0:
+        return {}
+    bounds = np.stack([starts, ends], axis=1).reshape(-1)
+    mean = np.add.reduceat(np.append(batch.speed, 0.0), bounds)[::2] / (ends - starts)
+
+    task = batch.task[starts]
+    number = np.bincount(task, minlength=len(batch))
+    average = np.bincount(task, weights=mean, minlength=len(batch)) / np.maximum(number, 1)
+    fast = np.bincount(task, weights=mean > 6.7, minlength=len(batch))
+
+    result = {}
+    for i in np.flatnonzero(number).tolist():
+        result[batch.keys[i]] = [float(average[i]), int(fast[i])]
+    return result
+
+
+def batch_total_time(batch):
+    """Calculate the total task time of the batch, the same as Maneuver_detect.total_time
+
+    :param batch: a TripBatch
+    :return: the total task duration, unit second
+    """
+    tasks = np.flatnonzero(batch.lengths > 1)
+    return int(np.sum(batch.time[batch.offsets[tasks + 1] - 1] - batch.time[batch.offsets[tasks]]))
@@ -0,0 +1,160 @@
+import json
+import os
+from bisect import bisect_right
+from collections.abc import Mapping
+import numpy as np
+
+TRIP_MAGIC = b"GLYTRIP2"
+TRIP_COLUMNS = [("lat", "<f8"), ("long", "<f8"), ("speed", "<f8"), ("angle", "<f8"), ("time", "<i8")]
+
+
+def read_index(filename):
+    """Read the index of the columnar binary trip file
+
+    :param filename: the filename of the trip file
+    :return: a dict of the index
+            tasks: a list of task id (string)
+            offsets: a list of the first row of every task & the end of the last one
+            columns: a list of (name, dtype)
+            blocks: a list of (first row, number of rows, position in the file) of every block
+            size: the size of the trip file when the index was written
+    """
+    with open(filename + '.trip', 'rb') as fp:
+        if fp.read(len(TRIP_MAGIC)) != TRIP_MAGIC:
+            raise ValueError(filename + '.trip is not a trip file')
+    with open(filename + '.trip.index') as fp:
+        return json.load(fp)
+
+
+def _write_index(filename, index):
+    with open(filename + '.trip.index.tmp', 'w') as fp:
+        json.dump(index, fp)
+    os.replace(filename + '.trip.index.tmp', filename + '.trip.index')
+
+
+def _write_block(fp, columns):
+    for column in columns:
+        for array in column:
+            fp.write(array.tobytes())
+
+
+def write_trip(filename, tasks, columns):
+    """Write the columnar binary trip file
+       File layout: filename.trip holds the magic & the blocks of columns, a block holds the rows of
+       every column one after another (8 bytes values, so every column is aligned), filename.trip.index is the
+       json index (task ids & offsets & blocks), the points of the i-th task are the rows
+       offsets[i]:offsets[i + 1] of every column, missing value is NaN
+
+    :param filename: the filename of the trip file
+    :param tasks: a list of task id (string)
+    :param columns: a list (every column of TRIP_COLUMNS) of list of array (every task)
+    """
+    offsets = np.concatenate(([0], np.cumsum([len(array) for array in columns[0]], dtype=np.int64))).tolist()
+    with open(filename + '.trip', 'wb') as fp:
+        fp.write(TRIP_MAGIC)
+        _write_block(fp, columns)
+        size = fp.tell()
+    _write_index(filename, {"tasks": tasks, "offsets": offsets, "columns": TRIP_COLUMNS,
+                            "blocks": [[0, offsets[-1], len(TRIP_MAGIC)]], "size": size})
+
+
+def append_trip(filename, tasks, columns):
+    """Append the tasks to the trip file as a new block, only the new rows are written & the index is replaced,
+       so an append costs the size of the new data (& of the index), not of the whole file
+       the rows written after the index by an interrupted append are dropped at the next append
+
+    :param filename: the filename of the trip file
+    :param tasks: a list of task id (string)
+    :param columns: a list (every column of TRIP_COLUMNS) of list of array (every task)
+    """
+    if not os.path.exists(filename + '.trip.index'):
+        write_trip(filename, tasks, columns)
+        return
+
+    index = read_index(filename)
+    first = index["offsets"][-1]
+    with open(filename + '.trip', 'r+b') as fp:
+        fp.truncate(index["size"])
+        fp.seek(index["size"])
+        _write_block(fp, columns)
+        fp.flush()
+        os.fsync(fp.fileno())
+        size = fp.tell()
+
+    for array in columns[0]:
+        index["offsets"].append(index["offsets"][-1] + len(array))
+    index["tasks"] += tasks
+    index["blocks"].append([first, index["offsets"][-1] - first, index["size"]])
+    index["size"] = size
+    _write_index(filename, index)
+
+
+class TripFile(Mapping):
+    """Memory-mapped reader of the columnar binary trip file written by Query.to_columnar,
+       a single trip is loaded without parsing the rest of the file
+
+       key: task id (string, the same as the json file)
+       value: [latitude, longitude, speed, heading, time], numpy arrays, missing value is NaN
+    """
+
+    def __init__(self, filename):
+        """Read the index and map the column blocks of the trip file
+
+        :param filename: the filename you want to read
+        """
+        index = read_index(filename)
+        self.offsets = index["offsets"]
+        self.index = {task: i for i, task in enumerate(index["tasks"])}
+        self.dtypes = [dtype for name, dtype in index["columns"]]
+        self.blocks = []                    # the first row & the columns of every block
+        for first, count, position in index["blocks"]:
+            columns = []
+            for dtype in self.dtypes:
+                if count == 0:
+                    columns.append(np.zeros(0, dtype=dtype))
+                else:
+                    columns.append(np.memmap(filename + '.trip', dtype=dtype, mode='r', offset=position,
+                                             shape=(count,)))
+                position += count * np.dtype(dtype).itemsize
+            self.blocks.append((first, columns))
+        self.starts = [block[0] for block in self.blocks]
+        self._columns = None
+
+    @property
+    def columns(self):
+        """The whole columns of every task, the memory-mapped columns if the file has a single block
+           (written by Query.to_columnar), otherwise the blocks are concatenated (copy)
+        """
+        if self._columns is None:
+            if len(self.blocks) == 1:
+                self._columns = self.blocks[0][1]
+            else:
+                self._columns = [np.concatenate([columns[i] for first, columns in self.blocks]
+                                                + [np.zeros(0, dtype=dtype)])
+                                 for i, dtype in enumerate(self.dtypes)]
+        return self._columns
+
+    def __getitem__(self, key):
+        i = self.index[key]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        first, columns = self.blocks[bisect_right(self.starts, start) - 1]
+        return [column[start - first:end - first] for column in columns]
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+def open_columnar(filename):
+    """Read the columnar binary trip file to the dict data, the same as open_file
+
+    :param filename: the filename you want to read
+    :return: the dict of data
+    """
+    data = {}
+    for key, value in TripFile(filename).items():
+        data[key] = [[None if v != v else v for v in column.tolist()] for column in value]  # NaN back to None
+
+    return data
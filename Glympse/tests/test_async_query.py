@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+import Query as Q
+from async_query import iter_all_location_async
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """The shared pymongo client is a mongomock client, every database of it is in memory"""
+    mongomock = pytest.importorskip("mongomock")
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(Q.pymongo, "MongoClient", lambda *args, **kwargs: client)
+    yield client
+    Q.close_shared_clients()
+
+
+def test_iter_all_location_async(mongo, monkeypatch):
+    tracking = Q.generate_query("tracking").client
+    stats = Q.generate_query("stats").client
+    tracking["tracking.tasks"].insert_many([{"_id": agent * 10 + i, "agent_id": agent, "completed": i}
+                                            for agent in range(40) for i in range(agent % 3)])
+    for task in tracking["tracking.tasks"].find():
+        stats["stats.tasks_full"].insert_one({"_id": task["_id"], "location_shared": True,
+                                              "ticket": {"location": [[task["_id"], 34.0, -118.0, 5.0, 90.0]]}})
+
+    started = []
+    query_new_tasks = Q.Query.query_new_tasks
+
+    def counted(self, agent_id, since=None):
+        started.append(agent_id)
+        return query_new_tasks(self, agent_id, since)
+
+    monkeypatch.setattr(Q.Query, "query_new_tasks", counted)
+
+    async def consume():
+        task_dict, location_dict, in_flight = {}, {}, []
+        async for tasks, locations in iter_all_location_async(list(range(40)), "tracking", "stats",
+                                                              concurrency=8, agents_per_query=2, max_pending=3):
+            in_flight.append(len(started) - len(in_flight))     # started & not yet taken by the consumer
+            await asyncio.sleep(0.01)                           # a slow consumer
+            task_dict.update(tasks)
+            location_dict.update(locations)
+        return task_dict, location_dict, in_flight
+
+    task_dict, location_dict, in_flight = asyncio.run(consume())
+    assert task_dict == {agent: [agent * 10 + i for i in range(agent % 3)] for agent in range(40) if agent % 3 > 0}
+    assert location_dict == {task: [[task, 34.0, -118.0, 5.0, 90.0]] for tasks in task_dict.values() for task in tasks}
+    assert len(started) == len(in_flight) == 20
+    assert max(in_flight) <= 3
@@ -0,0 +1,504 @@
+import copy
+import json
+import math
+import multiprocessing
+import random
+
+import numpy as np
+import pytest
+
+import Maneuver_detect as M
+import Query as Q
+import speedlimit
+from roadnet import RoadNetwork
+
+
+# the loop detectors replaced by the vectorized ones, kept as the golden reference
+
+def loop_find_turning(heading):
+    breakpoint = []
+    start = 0
+    number = 0
+    for i in range(len(heading) - 2):
+        diff = abs(heading[i + 1] - heading[i])
+        if diff > 19 and diff < 70 and start == 0:
+            if i - 2 < 0:
+                breakpoint.append(0)
+            else:
+                breakpoint.append(i - 2)
+            start = 1
+        if diff < 5 and start == 1:
+            angle_diff = abs(heading[i + 1] - heading[breakpoint[-1]])
+            if (angle_diff < 30 or angle_diff > 150):
+                del breakpoint[-1]
+                start = 0
+                continue
+            else:
+                breakpoint.append(i + 2)
+                start = 0
+                number += 1
+    if len(breakpoint) % 2 != 0:
+        del breakpoint[-1]
+    return breakpoint, number
+
+
+def loop_find_ACC(speed, time):
+    breakpoint = []
+    start = 0
+    number = 0
+    for i in range(len(speed) - 1):
+        diff = speed[i + 1] - speed[i]
+        if diff > 3 and start == 0 and diff < 9:
+            breakpoint.append(i)
+            start = 1
+        if diff < 2 and start == 1:
+            time_diff = time[i] - time[breakpoint[-1]]
+            if time_diff > 2:
+                breakpoint.append(i)
+                start = 0
+                number += 1
+            else:
+                del breakpoint[-1]
+                start = 0
+                continue
+    if len(breakpoint) % 2 != 0 or len(breakpoint) == 1:
+        del breakpoint[-1]
+    return breakpoint, number
+
+
+def loop_find_hardbrake(speed, time):
+    breakpoint = []
+    number = 0
+    for i in range(len(speed) - 1):
+        t = time[i + 1] - time[i]
+        if t == 0: t = 1
+        diff = (speed[i] - speed[i + 1]) / t
+        if diff > 5 and diff < 8:
+            breakpoint.append(i)
+            number += 1
+    return breakpoint, number
+
+
+def random_trip(rng, n):
+    """A trip whose steps often hit the thresholds of the detectors (& their exact boundary values)"""
+    speed, heading, time = [], [], []
+    s, h, t = rng.uniform(0, 20), rng.uniform(0, 360), rng.randint(0, 10 ** 6)
+    for i in range(n):
+        s += rng.choice([-9, -8, -7, -6, -5, -1, 0, 0.5, 1, 2, 3, 3.5, 5, 8, 9])
+        h += rng.choice([0, 1, 2, 4, 5, 6, 19, 20, 25, 40, 69, 70, 80, -30, -45, 150, 200])
+        t += rng.choice([0, 1, 1, 2, 3])
+        speed.append(s if rng.random() > 0.02 else float("nan"))
+        heading.append(h % 360 if rng.random() > 0.02 else float("nan"))
+        time.append(t)
+    return speed, heading, time
+
+
+def assert_same(speed, heading, time):
+    assert M.find_turning(heading) == loop_find_turning(heading)
+    assert M.find_ACC(speed, time) == loop_find_ACC(speed, time)
+    assert M.find_hardbrake(speed, time) == loop_find_hardbrake(speed, time)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_detectors_match_loop_versions(seed):
+    rng = random.Random(seed)
+    for _ in range(400):
+        assert_same(*random_trip(rng, rng.choice([0, 1, 2, 3, 4, 5, rng.randint(6, 300)])))
+
+
+def test_empty_and_single_point():
+    assert_same([], [], [])
+    assert_same([5.0], [90.0], [0])
+    assert_same([5.0, 12.0], [90.0, 130.0], [0, 1])
+
+
+def test_runs_at_the_array_boundaries():
+    # a turning starting at the first point & ending at the last heading change used
+    heading = [0.0, 40.0, 41.0, 41.0]
+    assert_same([0.0] * 4, heading, [0, 1, 2, 3])
+    assert M.find_turning(heading) == ([0, 3], 1)
+
+    # an acceleration starting at the first point, a second one left open at the end
+    speed = [0.0, 5.0, 9.5, 11.0, 11.5, 16.5, 22.5]
+    time = [0, 2, 4, 6, 8, 10, 12]
+    assert_same(speed, [0.0] * 7, time)
+    assert M.find_ACC(speed, time) == ([0, 2], 1)
+
+    # hardbrakes at the first & the last speed change
+    speed = [20.0, 14.0, 14.0, 14.0, 8.0]
+    assert_same(speed, [0.0] * 5, [0, 1, 2, 3, 4])
+    assert M.find_hardbrake(speed, [0, 1, 2, 3, 4]) == ([0, 3], 2)
+
+
+def test_exact_thresholds_are_not_detected():
+    speed = [0.0, 3.0, 3.0, 12.0, 12.0, 7.0, 7.0, -1.0]
+    time = [0, 1, 2, 3, 4, 5, 6, 7]
+    heading = [0.0, 19.0, 19.0, 89.0, 89.0, 94.0, 94.0, 94.0]
+    assert_same(speed, heading, time)
+    assert M.find_ACC(speed, time) == ([], 0)
+    assert M.find_hardbrake(speed, time) == ([], 0)
+    assert M.find_turning(heading) == ([], 0)
+
+
+
+# the speeding loop replaced by the vectorized over_speed_limit, kept as the golden reference
+
+def loop_over_speed_limit(speed, time, speedlimit_list, call_api):
+    over_time = 0
+    overspeed = 0
+    duration = 0
+    ovsp_start = False
+    j = 0
+    if len(speedlimit_list) > 0:
+        for i in range(len(speed) - 1):
+            if i > call_api[j]:
+                if j < len(call_api) - 1:
+                    j += 1
+                else:
+                    j = len(call_api) - 1
+            if j > len(speedlimit_list) - 1:
+                j = len(speedlimit_list) - 1
+            sL = speedlimit_list[j]
+            if sL < speed[i] and speed[i + 1] > sL and ovsp_start == False:
+                start_time = time[i]
+                over_time += 1
+                overspeed += (speed[i] - sL) / sL
+                ovsp_start = True
+            elif sL > speed[i] and ovsp_start == True:
+                end_time = time[i]
+                duration += end_time - start_time
+                ovsp_start = False
+    return over_time, overspeed, duration
+
+
+def random_speeding_trip(rng, n):
+    speed, time = [], []
+    s, t = rng.uniform(0, 30), rng.randint(0, 10 ** 6)
+    for i in range(n):
+        s = max(0.0, s + rng.choice([-6, -3, -1, 0, 0, 1, 3, 6]))
+        t += rng.choice([0, 0, 1, 2, 5])                               # repeated timestamps
+        speed.append(s)
+        time.append(t)
+    call_api = sorted(rng.sample(range(n), rng.randint(1, n))) if n > 0 else []
+    limits = [rng.choice([None, 8.0, 13.4, 20.0, 26.8]) for i in call_api]
+    speedlimit_list = speedlimit.fill_speed_limit(limits)               # the unknown limits are filled
+    lat = [34.0 + i * 1e-4 for i in range(n)]
+    return lat, [-118.0] * n, speed, time, speedlimit_list, call_api
+
+
+def assert_same_speeding(lat, long, speed, time, speedlimit_list, call_api):
+    expected = loop_over_speed_limit(speed, time, speedlimit_list, call_api)
+    for assign in (None, "ahead"):                      # a precomputed call_api is mapped ahead by default
+        over_time, overspeed, duration = M.over_speed_limit(lat, long, speed, time, (speedlimit_list, call_api),
+                                                            assign=assign)
+        assert (over_time, duration) == (expected[0], expected[2])
+        assert overspeed == pytest.approx(expected[1])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_over_speed_limit_matches_loop_version(seed):
+    rng = random.Random(seed)
+    for _ in range(400):
+        assert_same_speeding(*random_speeding_trip(rng, rng.choice([0, 1, 2, 3, rng.randint(4, 300)])))
+
+
+def test_over_speed_limit_default_ignores_the_global_sampling(monkeypatch):
+    monkeypatch.setattr(speedlimit, "sampling", speedlimit.sampling)
+    speedlimit.set_sampling("douglas_peucker")
+    rng = random.Random(7)
+    for _ in range(100):
+        lat, long, speed, time, speedlimit_list, call_api = random_speeding_trip(rng, rng.randint(2, 100))
+        expected = loop_over_speed_limit(speed, time, speedlimit_list, call_api)
+        over_time, overspeed, duration = M.over_speed_limit(lat, long, speed, time, (speedlimit_list, call_api))
+        assert (over_time, duration) == (expected[0], expected[2])
+        assert overspeed == pytest.approx(expected[1])
+
+    # the speed sampling of path_speed_limit keeps the ahead mapping
+    call_api = speedlimit.query_points(speed, method="speed")
+    speedlimit_list = [10.0] * len(call_api)
+    expected = loop_over_speed_limit(speed, time, speedlimit_list, call_api)
+    assert M.over_speed_limit(lat, long, speed, time, (speedlimit_list, call_api))[::2] == expected[::2]
+
+
+def test_over_speed_limit_edge_cases():
+    assert_same_speeding([], [], [], [], [], [])
+    assert_same_speeding([34.0], [-118.0], [30.0], [0], [10.0], [0])
+    lat, long = [34.0 + i * 1e-4 for i in range(6)], [-118.0] * 6
+    assert_same_speeding(lat, long, [30.0] * 6, [0] * 6, [], [])                        # nothing is known
+
+    # a speeding from the first point, a second one left open at the end
+    speed, time = [30.0, 30.0, 5.0, 5.0, 30.0, 30.0], [0, 1, 1, 3, 4, 4]
+    speedlimit_list = speedlimit.fill_speed_limit([None, 10.0, None])
+    assert_same_speeding(lat, long, speed, time, speedlimit_list, [0, 2, 5])
+    assert M.over_speed_limit(lat, long, speed, time, (speedlimit_list, [0, 2, 5]), assign="ahead") == (2, 4.0, 1)
+
+def road_trips(rng, number):
+    data = {}
+    for k in range(number):
+        n = rng.randint(30, 80)
+        lat = [34.0 + i * 1e-4 for i in range(n)]
+        data[str(k)] = [lat, [-118.0] * n, [rng.uniform(5, 16) for i in range(n)],
+                        [rng.uniform(80, 100) for i in range(n)], list(range(n))]
+    return data
+
+
+def test_spawned_workers_take_the_speed_limit_settings(monkeypatch, tmp_path):
+    monkeypatch.delenv("GOOGLE_MAPS_API_KEY", raising=False)        # the Roads API must not be called
+    monkeypatch.setattr(speedlimit, "provider", None)
+    monkeypatch.setattr(speedlimit, "cache", None)
+    monkeypatch.setattr(speedlimit, "sampling", speedlimit.sampling)
+    network = RoadNetwork([{"coords": [(33.99, -118.0), (34.02, -118.0)], "speed_limit": 10.0}])
+    speedlimit.set_provider(speedlimit.OfflineSpeedLimitProvider(network))
+    speedlimit.enable_cache(str(tmp_path / "speed_limit_cache.sqlite"))
+    speedlimit.set_sampling("distance", distance=100)
+
+    data = road_trips(random.Random(0), 6)
+    report = {}
+    organized, info = M.organize_and_get_info(copy.deepcopy(data), processes=2, shard_size=2, report=report,
+                                              mp_context=multiprocessing.get_context("spawn"))
+
+    expected_report = {}
+    expected = M.find_dic_maneuver(M.organize_data(copy.deepcopy(data)), expected_report)
+    assert info == expected[:6] + expected[7:]
+    assert info[7] > 0                                                  # the offline speed limit is used
+    assert report == expected_report
+    assert all(r["points"] > 1 for r in report.values())                # the distance sampling is used
+
+
+def stream_items(rng, number):
+    for k in range(number):
+        n = rng.randint(0, 6)
+        yield k, [[round(rng.uniform(33, 35), 6) for i in range(n)], [-118.123456] * n,
+                  [rng.choice([None, 0.0, 12.5, 3]) for i in range(n)], [rng.choice([None, 90.0]) for i in range(n)],
+                  [1600000000 + i for i in range(n)]]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 1 << 20])
+def test_streamed_json_reads_back(tmp_path, chunk_size):
+    filename = str(tmp_path / "trips")
+    items = list(stream_items(random.Random(chunk_size), 30))
+    assert Q.dict_to_json_stream(iter(items), filename) == 30
+    with open(filename + '.json') as fp:
+        expected = json.load(fp)
+    assert expected == {str(key): value for key, value in items}
+    assert list(M.iter_file(filename, chunk_size)) == list(expected.items())
+
+    # pretty-printed, scalar values & tokens of every kind cut at the chunk boundaries
+    other = {"a": 1.5e-3, "b": -12345.678, "c": [], "d": {"x": [None, True, False]}, "e": "a \"quoted\" é",
+             "f": 7, "g": 1e5}
+    with open(filename + '.json', 'w') as fp:
+        json.dump(other, fp, indent=4)
+    assert list(M.iter_file(filename, chunk_size)) == list(other.items())
+
+
+@pytest.mark.parametrize("text", ["{}", "  {\n}\n", " { } "])
+def test_iter_file_of_an_empty_dict(tmp_path, text):
+    filename = str(tmp_path / "empty")
+    with open(filename + '.json', 'w') as fp:
+        fp.write(text)
+    assert list(M.iter_file(filename, chunk_size=1)) == []
+    assert Q.dict_to_json_stream(iter([]), filename) == 0
+    assert list(M.iter_file(filename)) == [] and M.open_file(filename) == {}
+
+
+def test_iter_file_of_a_broken_file(tmp_path):
+    filename = str(tmp_path / "broken")
+    for text in ["", "[1, 2]", '{"a": [1, 2}']:
+        with open(filename + '.json', 'w') as fp:
+            fp.write(text)
+        with pytest.raises(ValueError):
+            list(M.iter_file(filename, chunk_size=2))
+
+
+@pytest.mark.parametrize("heading, expected", [
+    ([350.0, None, 10.0], [350.0, 0.0, 10.0]),                              # through 0, not 180
+    ([10.0, None, 350.0], [10.0, 0.0, 350.0]),
+    ([350.0, None, None, None, 30.0], [350.0, 0.0, 10.0, 20.0, 30.0]),
+    ([0.0, None, None, None, 40.0], [0.0, 10.0, 20.0, 30.0, 40.0]),         # every point of the gap is interpolated
+    ([None, None, 30.0, 40.0, None, None], [30.0, 30.0, 30.0, 40.0, 40.0, 40.0]),   # leading & trailing gaps
+    ([None, 370.0, None], [10.0, 370.0, 10.0]),                             # the filled headings are in [0, 360)
+    ([90.0, 100.0], [90.0, 100.0]),
+])
+def test_fill_heading_gaps(heading, expected):
+    assert M.fill_heading(heading).tolist() == pytest.approx(expected)
+
+
+def test_fill_heading_without_valid_heading():
+    assert np.isnan(M.fill_heading([None, None])).all()
+    assert M.fill_heading([]).tolist() == []
+
+
+def assert_fused_matches_separate_passes(data, speed_limits=None):
+    report, fused_report = {}, {}
+    dict_turning, turning_number = M.find_dic_turning(data)
+    dict_hb, hb_number = M.find_dic_HB(data)
+    dict_acc, acc_number = M.find_dic_ACC(data)
+    dict_ov, ov_duration, total_ov, total_times = M.find_dic_over(data, report, speed_limits)
+
+    fused = M.find_dic_maneuver(data, fused_report, speed_limits)
+    assert fused[:6] == (dict_turning, turning_number, dict_hb, hb_number, dict_acc, acc_number)
+    assert fused[6] == dict_ov
+    assert fused[7:] == (ov_duration, total_ov, total_times)
+    assert fused_report == report
+
+
+def maneuver_trips(rng, number):
+    data = {}
+    for k in range(number):
+        n = rng.randint(30, 120)
+        speed, heading = [rng.uniform(5, 15)], [rng.uniform(0, 360)]
+        for i in range(n - 1):
+            speed.append(max(0.0, speed[-1] + rng.choice([-7, -6, -1, 0, 0, 1, 4, 5])))
+            heading.append((heading[-1] + rng.choice([0, 0, 1, 3, 25, 40])) % 360)
+        for i in rng.sample(range(n), n // 10):
+            heading[i] = None
+        lat = [34.0 + i * 1e-4 for i in range(n)]
+        data[str(k)] = [lat, [-118.0] * n, speed, heading, sorted(rng.randint(0, 3 * n) for i in range(n))]
+    return data
+
+
+def test_fused_detection_matches_the_separate_passes(monkeypatch):
+    rng = random.Random(11)
+    data = M.organize_data(maneuver_trips(rng, 30))
+    assert all(find(data)[1] > 0 for find in (M.find_dic_turning, M.find_dic_HB, M.find_dic_ACC))
+    speed_limits = {}
+    for key, value in data.items():
+        call_api = sorted(rng.sample(range(len(value[4])), rng.randint(1, 10)))
+        speed_limits[key] = (speedlimit.fill_speed_limit([rng.choice([None, 8.0, 10.0, 13.4]) for i in call_api]),
+                             call_api)
+    assert_fused_matches_separate_passes(data, speed_limits)                # given speed limits
+
+    monkeypatch.delenv("GOOGLE_MAPS_API_KEY", raising=False)                # the Roads API must not be called
+    monkeypatch.setattr(speedlimit, "provider", None)
+    monkeypatch.setattr(speedlimit, "cache", None)
+    monkeypatch.setattr(speedlimit, "sampling", speedlimit.sampling)
+    network = RoadNetwork([{"coords": [(33.99, -118.0), (34.02, -118.0)], "speed_limit": 10.0}])
+    speedlimit.set_provider(speedlimit.OfflineSpeedLimitProvider(network))
+    for method in ("speed", "distance"):                                    # queried speed limits & reports
+        speedlimit.set_sampling(method)
+        assert_fused_matches_separate_passes(data)
+    assert M.find_dic_over(data)[3] > 0
+
+
+# the mpu versions of the speed calculation replaced by the vectorized ones, kept as the golden reference
+
+def mpu_haversine_distance(origin, destination):
+    """mpu.haversine_distance (km), the formula of mpu is used when mpu is not installed"""
+    try:
+        import mpu
+    except ImportError:
+        lat1, lon1 = origin
+        lat2, lon2 = destination
+        dlat = math.radians(lat2 - lat1)
+        dlon = math.radians(lon2 - lon1)
+        a = math.sin(dlat / 2) * math.sin(dlat / 2) + \
+            math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) * math.sin(dlon / 2)
+        return 6371 * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return mpu.haversine_distance(origin, destination)
+
+
+def mpu_calculate_speed_cal(lat, long, time):
+    speed = [0]
+    for i in range(len(lat) - 1):
+        dist = mpu_haversine_distance((lat[i], long[i]), (lat[i + 1], long[i + 1])) * 1000
+        speed.append(dist / (time[i + 1] - time[i]))
+    speed[0] = speed[1]
+    return speed
+
+
+def mpu_fill_speed(speed, time, lat, long):
+    speed = list(speed)
+    no_smooth = 0
+    for i in range(len(speed) - 1):
+        if speed[i] is None or speed[i] <= 0:
+            t = time[i + 1] - time[i]
+            if t == 0: t = 1
+            res = mpu_haversine_distance((lat[i], long[i]), (lat[i + 1], long[i + 1])) * 1000 / t
+            if res < 0.1: res = 0
+            if speed[i] is None:
+                no_smooth = 1
+            speed[i] = res
+    if speed[-1] is None or speed[-1] <= 0:
+        speed[-1] = speed[-2]
+    if no_smooth == 0:
+        speed = M.smooth(speed, 3)
+    return speed
+
+
+# (lat1, lon1, lat2, lon2, distance (m)) of mpu.haversine_distance * 1000
+HAVERSINE_GOLDEN = [
+    (0.0, 0.0, 0.0, 1.0, 111194.92664455873),
+    (34.0522, -118.2437, 34.0523, -118.2437, 11.119492664825001),
+    (34.0522, -118.2437, 37.7749, -122.4194, 559120.5770615533),
+    (51.5074, -0.1278, 48.8566, 2.3522, 343556.06034104165),
+    (-33.8688, 151.2093, -33.8688, 151.2093, 0.0),
+    (89.9, 0.0, 89.9, 180.0, 22238.985328911145),
+    (0.0, 179.9, 0.0, -179.9, 22238.985328911924)]
+
+
+def test_haversine_distance_golden():
+    lat1, lon1, lat2, lon2, distance = map(list, zip(*HAVERSINE_GOLDEN))
+    assert M.haversine_distance(lat1, lon1, lat2, lon2) == pytest.approx(distance, rel=1e-12, abs=1e-9)
+    for row in HAVERSINE_GOLDEN:
+        assert float(M.haversine_distance(*row[:4])) == pytest.approx(row[4], rel=1e-12, abs=1e-9)
+        assert mpu_haversine_distance(row[:2], row[2:4]) * 1000 == pytest.approx(row[4], rel=1e-12, abs=1e-9)
+
+
+def random_positions(rng, n):
+    lat = [34.0 + rng.uniform(-1, 1)]
+    long = [-118.0 + rng.uniform(-1, 1)]
+    for i in range(n - 1):
+        step = rng.choice([0, 0, 1e-6, 1e-5, 1e-4, 1e-3])              # standing still & crawling as well
+        lat.append(lat[-1] + rng.uniform(-step, step))
+        long.append(long[-1] + rng.uniform(-step, step))
+    return lat, long
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_calculate_speed_cal_matches_the_mpu_version(seed):
+    rng = random.Random(seed)
+    for _ in range(100):
+        n = rng.randint(2, 60)
+        lat, long = random_positions(rng, n)
+        time = list(np.cumsum([rng.randint(1, 5) for i in range(n)]))
+        assert M.calculate_speed_cal(lat, long, time) == pytest.approx(mpu_calculate_speed_cal(lat, long, time),
+                                                                       rel=1e-9, abs=1e-9)
+
+
+def test_calculate_speed_cal_with_duplicate_timestamps():
+    # the mpu version divided by zero, a time interval of 0 second is taken as 1 second
+    lat, long, time = [34.0, 34.0001, 34.0002, 34.0004], [-118.0] * 4, [10, 10, 12, 12]
+    step = mpu_haversine_distance((34.0, -118.0), (34.0001, -118.0)) * 1000
+    expected = [step, step, step / 2, 2 * step]
+    assert M.calculate_speed_cal(lat, long, time) == pytest.approx(expected, rel=1e-6)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_fill_speed_matches_the_mpu_version(seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        n = rng.randint(2, 40)
+        lat, long = random_positions(rng, n)
+        time = list(np.cumsum([rng.choice([0, 0, 1, 2, 3]) for i in range(n)]))       # duplicate timestamps
+        speed = [rng.choice([None, 0, -1.0, 0.05, 3.0, 12.5]) if rng.random() < 0.3 else rng.uniform(0, 30)
+                 for i in range(n)]
+        if speed[-2] is None:
+            speed[-2] = 1.0                 # the mpu version fails on a None last speed after a None
+        expected = mpu_fill_speed(speed, time, lat, long)
+        assert M.fill_speed(speed, time, lat, long) == pytest.approx(expected, rel=1e-9, abs=1e-9)
+
+        nan_speed = [float("nan") if v is None else v for v in speed]
+        assert M.fill_speed(nan_speed, time, lat, long) == pytest.approx(expected, rel=1e-9, abs=1e-9)
+
+
+def test_fill_speed_of_nan_speeds():
+    # a NaN speed is a missing speed (a None of the mpu version), the speed is recalculated & not smoothed
+    lat, long, time = [34.0, 34.0001, 34.0002, 34.0003], [-118.0] * 4, [0, 0, 1, 3]
+    step = mpu_haversine_distance((34.0, -118.0), (34.0001, -118.0)) * 1000
+    speed = M.fill_speed([float("nan"), 5.0, float("nan"), float("nan")], time, lat, long)
+    assert speed.tolist() == pytest.approx([step, 5.0, step / 2, step / 2])
+    # only the last speed is missing, it takes the previous speed & the speed is smoothed as in the mpu version
+    last = M.fill_speed([4.0, 5.0, float("nan")], [0, 1, 2], [34.0, 34.1, 34.2], [-118.0] * 3)
+    assert last.tolist() == pytest.approx(list(mpu_fill_speed([4.0, 5.0, None], [0, 1, 2], [34.0, 34.1, 34.2],
+                                                              [-118.0] * 3)))
+    assert last.tolist() == pytest.approx([3.0, 14 / 3, 10 / 3])
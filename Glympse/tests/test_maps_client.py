@@ -0,0 +1,121 @@
+import http.server
+import json
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+import maps_client
+
+
+def _take(limiter, number):
+    for i in range(number):
+        limiter.acquire()
+
+
+@pytest.mark.parametrize("method", ["fork", "forkserver", "spawn"])
+def test_limiter_is_shared_by_the_worker_processes(method):
+    limiter = maps_client.TokenBucket(40, burst=1)
+    context = multiprocessing.get_context(method)
+    workers = [context.Process(target=_take, args=(limiter, 10)) for i in range(4)]
+    start = time.monotonic()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert [worker.exitcode for worker in workers] == [0] * 4
+    # 40 tokens at 40 per second, a bucket per process would take 0.25 second
+    assert time.monotonic() - start >= 0.95
+
+
+def test_get_client_shares_the_limiter(monkeypatch):
+    monkeypatch.setenv(maps_client.API_KEY_ENV, "test-key")
+    client = maps_client.get_client(qps=7)
+    assert client.key == "test-key"
+    assert client.limiter is maps_client.shared_limiter(7)
+    assert maps_client.get_client("other-key", qps=7).limiter is client.limiter
+    maps_client.close_clients()
+
+
+def test_missing_api_key(monkeypatch):
+    monkeypatch.delenv(maps_client.API_KEY_ENV, raising=False)
+    with pytest.raises(RuntimeError, match=maps_client.API_KEY_ENV):
+        maps_client.get_client()
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """Answers the queued (status, body) responses in order, the last one is repeated"""
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        status, body = self.server.responses[min(len(self.server.requests), len(self.server.responses)) - 1]
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.requests, server.responses = [], []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    delays = []
+    monkeypatch.setattr(maps_client.random, "random", lambda: 1.0)          # no jitter
+    monkeypatch.setattr(maps_client.time, "sleep", delays.append)
+    url = "http://127.0.0.1:{}".format(server.server_address[1])
+    client = maps_client.MapsClient("test-key", qps=1000, max_retries=3, backoff=0.2, roads_url=url, maps_url=url)
+    yield server, client, delays
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_retry_with_backoff(stub):
+    server, client, delays = stub
+    body = {"speedLimits": [{"placeId": "a", "speedLimit": 50}], "snappedPoints": []}
+    server.responses += [(429, {"error": {"status": "RESOURCE_EXHAUSTED"}})] * 2 + [(200, body)]
+
+    assert client.snapped_speed_limits([(34.0, -118.0), (34.1, -118.1)]) == body
+    assert len(server.requests) == 3
+    assert delays == [0.2, 0.4]
+    assert "key=test-key" in server.requests[0] and "/v1/speedLimits" in server.requests[0]
+
+
+def test_retries_run_out(stub):
+    server, client, delays = stub
+    server.responses.append((503, {}))
+
+    with pytest.raises(maps_client.MapsApiError) as error:
+        client.snapped_speed_limits([(34.0, -118.0)])
+    assert error.value.status == 503
+    assert len(server.requests) == 4
+    assert delays == [0.2, 0.4, 0.8]
+
+
+def test_error_is_not_retried(stub):
+    server, client, delays = stub
+    server.responses.append((400, {"error": {"status": "INVALID_ARGUMENT", "message": "bad path"}}))
+
+    with pytest.raises(maps_client.MapsApiError) as error:
+        client.snapped_speed_limits([(34.0, -118.0)])
+    assert (error.value.status, error.value.message) == ("INVALID_ARGUMENT", "bad path")
+    assert len(server.requests) == 1
+    assert delays == []
+
+
+def test_directions_retry_over_query_limit(stub):
+    server, client, delays = stub
+    route = {"legs": [{"distance": {"text": "1.2 km", "value": 1200}}]}
+    server.responses += [(200, {"status": "OVER_QUERY_LIMIT"}), (200, {"status": "OK", "routes": [route]})]
+
+    assert client.directions((34.0, -118.0), (34.1, -118.1)) == [route]
+    assert len(server.requests) == 2
+    assert delays == [0.2]
@@ -0,0 +1,277 @@
+import numpy as np
+import pytest
+
+import location_cache
+import Query as Q
+from location_cache import LocationCache
+from Query import Query
+from tripfile import open_columnar, read_index
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """The shared pymongo client is a mongomock client, every database of it is in memory"""
+    mongomock = pytest.importorskip("mongomock")
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(Q.pymongo, "MongoClient", lambda *args, **kwargs: client)
+    yield client
+    Q.close_shared_clients()
+
+
+class FakeMongoClient:
+    """A pymongo.MongoClient that keeps its options & whether it is closed, nothing is connected"""
+
+    def __init__(self, uri, **options):
+        self.uri = uri
+        self.options = options
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_shared_client_of_the_same_options(monkeypatch):
+    monkeypatch.setattr(Q.pymongo, "MongoClient", FakeMongoClient)
+    client = Q.get_shared_client("mongodb://a", max_pool_size=10)
+    assert Q.get_shared_client("mongodb://a", max_pool_size=10) is client
+    assert Q.get_shared_client("mongodb://a", 10, 20000, 30000, None, "secondary") is client
+    assert client.options == {"maxPoolSize": 10, "connectTimeoutMS": 20000, "serverSelectionTimeoutMS": 30000,
+                              "socketTimeoutMS": None, "readPreference": "secondary", "connect": False}
+    Q.close_shared_clients()
+
+
+def test_shared_client_of_other_options(monkeypatch):
+    monkeypatch.setattr(Q.pymongo, "MongoClient", FakeMongoClient)
+    clients = [Q.get_shared_client("mongodb://a"),
+               Q.get_shared_client("mongodb://b"),
+               Q.get_shared_client("mongodb://a", max_pool_size=10),
+               Q.get_shared_client("mongodb://a", connect_timeout_ms=1000),
+               Q.get_shared_client("mongodb://a", server_selection_timeout_ms=1000),
+               Q.get_shared_client("mongodb://a", socket_timeout_ms=1000),
+               Q.get_shared_client("mongodb://a", read_preference="primary")]
+    assert len(set(map(id, clients))) == len(clients)
+    assert clients[6].options["readPreference"] == "primary" and clients[1].uri == "mongodb://b"
+    Q.close_shared_clients()
+
+
+def test_close_shared_clients_of_this_process_only(monkeypatch):
+    monkeypatch.setattr(Q.pymongo, "MongoClient", FakeMongoClient)
+    pid = Q.os.getpid()
+    client = Q.get_shared_client("mongodb://a")
+    monkeypatch.setattr(Q.os, "getpid", lambda: pid + 1)              # a forked process of the same clients
+    child = Q.get_shared_client("mongodb://a")
+    assert child is not client
+    monkeypatch.setattr(Q.os, "getpid", lambda: pid)
+
+    Q.close_shared_clients()
+    assert client.closed and not child.closed                           # the client of the other pid is kept
+    assert Q.get_shared_client("mongodb://a") is not client             # a closed client is generated again
+    Q.close_shared_clients()
+
+    monkeypatch.setattr(Q.os, "getpid", lambda: pid + 1)
+    Q.close_shared_clients()
+    assert child.closed and Q._shared_clients == {}
+
+
+def test_decode_points_ragged_rows():
+    location_dict = {1: [[1600000000000, 34.0, -118.0, 5.0, 90.0, "extra", 7],
+                         [1600000001000, 34.1, -118.1, None, 91.0],
+                         [1600000002000, 34.2, -118.2, 6.0],
+                         [1600000003000, 34.3, -118.3]]}
+    lat, long, speed, heading, time_stamp = Query(None).decode_points(location_dict, 1)
+
+    assert lat.tolist() == [34.0, 34.1, 34.2, 34.3]
+    assert long.tolist() == [-118.0, -118.1, -118.2, -118.3]
+    assert np.array_equal(speed, [5.0, np.nan, 6.0, np.nan], equal_nan=True)
+    assert np.array_equal(heading, [90.0, 91.0, np.nan, np.nan], equal_nan=True)
+    assert time_stamp.tolist() == [1600000000, 1600000001, 1600000002, 1600000003]
+    assert time_stamp.dtype == np.int64
+
+
+def test_decode_points_drops_points_without_position():
+    location_dict = {1: [[1600000000000, 34.0, -118.0, 5.0, 90.0],
+                         [1600000001000, None, -118.1, 5.0, 90.0],
+                         [1600000002000, 34.2, None, 5.0, 90.0],
+                         [None, 34.3, -118.3, 5.0, 90.0],
+                         [1600000004000, 34.4, -118.4, 5.0, 90.0]]}
+    lat, long, speed, heading, time_stamp = Query(None).decode_points(location_dict, 1)
+
+    assert lat.tolist() == [34.0, 34.4]
+    assert time_stamp.tolist() == [1600000000, 1600000004]
+
+
+def test_decode_points_empty_task():
+    lat, long, speed, heading, time_stamp = Query(None).decode_points({1: []}, 1)
+
+    assert len(lat) == len(time_stamp) == 0
+
+
+def test_cache_keeps_ragged_rows(tmp_path):
+    cache = LocationCache(str(tmp_path / "cache.sqlite"))
+    cache.put_many({1: [[1600000000000, 34.0, -118.0, 5.0, 90.0, "extra"],
+                        [1600000001000, 34.1, -118.1],
+                        [1600000002000]],
+                    2: []})
+    found, missing = cache.get_many([1, 2, 3])
+
+    assert found == {1: [[1600000000000, 34.0, -118.0, 5.0, 90.0],
+                         [1600000001000, 34.1, -118.1, None, None],
+                         [1600000002000, None, None, None, None]],
+                     2: []}
+    assert missing == [3]
+    cache.close()
+
+
+def test_cache_get_many_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(location_cache, "SQL_VARIABLES", 3)
+    now = [1000.0]
+    monkeypatch.setattr(location_cache.time, "time", lambda: now[0])
+    cache = LocationCache(str(tmp_path / "cache.sqlite"))
+    cache.put_many({id: [[1600000000000 + id, 34.0, -118.0, 5.0, 90.0]] for id in range(0, 10, 2)})
+    now[0] = 2000.0
+    found, missing = cache.get_many(list(range(10)))
+
+    assert sorted(found) == [0, 2, 4, 6, 8] and missing == [1, 3, 5, 7, 9]
+    assert found[4] == [[1600000000004, 34.0, -118.0, 5.0, 90.0]]
+    assert cache._db.execute("SELECT DISTINCT used FROM points").fetchall() == [(2000.0,)]    # every hit is touched
+    assert cache.stats()["hits"] == 5 and cache.stats()["misses"] == 5
+    cache.close()
+
+
+def test_cache_keeps_rows_without_timestamp(tmp_path):
+    cache = LocationCache(str(tmp_path / "cache.sqlite"))
+    cache.put_many({1: [[None, 34.0, -118.0, 5.0, 90.0],
+                        [float("nan"), 34.1, -118.1, 5.0, 90.0],
+                        [1600000002000, 34.2, -118.2, 5.0, 90.0]]})
+    found, missing = cache.get_many([1])
+
+    assert found[1] == [[None, 34.0, -118.0, 5.0, 90.0],
+                        [None, 34.1, -118.1, 5.0, 90.0],
+                        [1600000002000, 34.2, -118.2, 5.0, 90.0]]
+    lat, long, speed, heading, time_stamp = Query(None).decode_points(found, 1)
+    assert lat.tolist() == [34.2]
+    assert time_stamp.tolist() == [1600000002]
+    cache.close()
+
+
+def test_fetch_locationpoints_with_the_cache(mongo, tmp_path):
+    query = Q.generate_query("stats", LocationCache(str(tmp_path / "cache.sqlite")))
+    location = [[1600000000000, 34.0, -118.0, 5.0], [None, 34.1, -118.1, 5.0, 90.0]]
+    query.client["stats.tasks_full"].insert_one({"_id": 1, "location_shared": True, "ticket": {"location": location}})
+
+    query.client["stats.tasks_full"].insert_one({"_id": 2, "location_shared": True, "ticket": {"location": [
+        [1600000000000, 34.0, -118.0, 5, 90.0, "extra", 7]]}})
+    normalized = {1: [[1600000000000, 34.0, -118.0, 5.0, None], [None, 34.1, -118.1, 5.0, 90.0]],
+                  2: [[1600000000000, 34.0, -118.0, 5.0, 90.0]]}
+
+    assert Q.fetch_locationpoints(query, [1, 2]) == normalized        # a miss gives the rows of a hit
+    assert Q.fetch_locationpoints(query, [1, 2]) == normalized
+    assert query.cache.stats()["hits"] == 2
+    query.cache.close()
+
+
+def lookup_pipeline_aggregate(aggregate):
+    """mongomock has no pipeline form of $lookup, the stages around it run on mongomock & the joined documents
+       are found by the $match (an $eq of a let variable in $expr) & $project of the $lookup pipeline
+    """
+    def run(collection, pipeline, **kwargs):
+        stage = next((i for i, stage in enumerate(pipeline) if "pipeline" in stage.get("$lookup", {})), None)
+        if stage is None:
+            return aggregate(collection, pipeline, **kwargs)
+        lookup = pipeline[stage]["$lookup"]
+        (match,), (project,) = [[inner[name] for inner in lookup["pipeline"] if name in inner]
+                                for name in ("$match", "$project")]
+        field, variable = match["$expr"]["$eq"]
+        joined = []
+        for doc in aggregate(collection, pipeline[:stage], **kwargs):
+            let = {"$$" + name: doc[value[1:]] for name, value in lookup["let"].items()}
+            query = dict({key: value for key, value in match.items() if key != "$expr"}, **{field[1:]: let[variable]})
+            doc[lookup["as"]] = list(collection.database[lookup["from"]].find(query, project))
+            joined.append(doc)
+        temp = collection.database["lookup_result"]
+        temp.drop()
+        if joined:
+            temp.insert_many(joined)
+        return aggregate(temp, pipeline[stage + 1:], **kwargs)
+    return run
+
+
+def test_query_hierarchy(mongo, monkeypatch):
+    collection = type(mongo["tracking"]["tracking.agents"])
+    monkeypatch.setattr(collection, "aggregate", lookup_pipeline_aggregate(collection.aggregate))
+    query = Q.generate_query("tracking")
+    query.client["tracking.agents"].insert_many([
+        {"_id": 1, "org_id": 10, "hierarchy": 5},
+        {"_id": 2, "org_id": 10, "hierarchy": 5},
+        {"_id": 3, "org_id": 11, "hierarchy": 5},
+        {"_id": 4, "org_id": 11, "hierarchy": 5, "removed": True},
+        {"_id": 5, "org_id": 12, "hierarchy": 5, "removed": True},
+        {"_id": 6, "org_id": 13, "hierarchy": 6}])
+
+    org_ids, agent_ids = query.query_hierarchy(5)
+    assert sorted(org_ids) == [10, 11]
+    assert sorted(agent_ids) == [1, 2, 3]
+    assert query.query_hierarchy(7) == ([], [])
+
+
+def test_query_tasks_streams_the_task_ids(mongo):
+    query = Q.generate_query("tracking")
+    query.client["tracking.tasks"].insert_many(
+        [{"_id": id, "agent_id": id % 3, "completed": 100 + id} for id in range(20)]
+        + [{"_id": 20, "agent_id": 1}, {"_id": 21, "agent_id": 9, "completed": 500}])
+
+    task_dict = query.query_tasks([0, 1, 2], batch_size=4)
+    assert {agent: sorted(tasks) for agent, tasks in task_dict.items()} == \
+        {agent: list(range(agent, 20, 3)) for agent in range(3)}
+    assert query.query_tasks([7]) is None
+
+    task_dict, high_water = query.query_new_tasks([0, 1], since=110, batch_size=4)
+    assert {agent: sorted(tasks) for agent, tasks in task_dict.items()} == {0: [12, 15, 18], 1: [10, 13, 16, 19]}
+    assert high_water == 119
+    assert query.query_new_tasks([0, 1], since=200) == ({}, 200)
+
+
+def test_fetch_locationpoints(mongo):
+    query = Q.generate_query("stats")
+    tasks = []
+    for id in range(25):
+        task = {"_id": id, "ticket": {"location": [[1600000000000 + i, 34.0 + i, -118.0, 5.0, 90.0]
+                                                   for i in range(id % 4)]}}
+        if id % 5 != 4:
+            task["location_shared"] = True
+        tasks.append(task)
+    query.client["stats.tasks_full"].insert_many(tasks)
+
+    location_dict = Q.fetch_locationpoints(query, list(range(30)), chunk_size=4, max_workers=3)
+    assert sorted(location_dict) == [id for id in range(25) if id % 5 != 4]
+    for id, location_point in location_dict.items():
+        assert location_point == tasks[id]["ticket"]["location"]
+
+
+def test_incremental_export_twice_adds_nothing(mongo, tmp_path):
+    filename = str(tmp_path / "export")
+    tasks = Q.generate_query("tracking").client["tracking.tasks"]
+    stats = Q.generate_query("stats").client["stats.tasks_full"]
+
+    def add_task(id, agent_id, completed):
+        tasks.insert_one({"_id": id, "agent_id": agent_id, "completed": completed})
+        stats.insert_one({"_id": id, "location_shared": True,
+                          "ticket": {"location": [[1600000000000 + id * 1000 + i, 34.0, -118.0, 5.0, 90.0]
+                                                  for i in range(3)]}})
+
+    add_task(1, 10, 100)
+    add_task(2, 10, 200)
+    add_task(3, 11, 200)                                        # completed at the same time as task 2
+    tasks.insert_one({"_id": 4, "agent_id": 12, "completed": 300})     # another agent
+
+    assert Q.incremental_export([10, 11], filename, "tracking", "stats", chunk_size=2) == 3
+    assert Q.load_checkpoint(filename) == {"completed": 200, "target": 200, "pending": []}
+    assert Q.incremental_export([10, 11], filename, "tracking", "stats") == 0   # tasks 2 & 3 are found again
+    assert len(read_index(filename)["tasks"]) == 3
+
+    add_task(5, 11, 200)                                        # a late task at the high-water mark
+    add_task(6, 10, 250)
+    assert Q.incremental_export([10, 11], filename, "tracking", "stats") == 2
+    assert sorted(read_index(filename)["tasks"]) == ["1", "2", "3", "5", "6"]
+    assert Q.load_checkpoint(filename)["completed"] == 250
+    assert open_columnar(filename)["6"][4] == [1600000006] * 3
@@ -0,0 +1,129 @@
+import numpy as np
+
+from mapmatch import MapMatcher, match_data, matched_speed_limits
+from roadnet import RoadDistanceEngine, RoadNetwork
+
+DEGREE = 111195.0       # meters of a degree of latitude
+
+
+def _u_turn_network():
+    # two parallel roads 100 m apart, only joined 5 km away
+    return RoadNetwork([{"coords": [(0.0, 0.0), (5000 / DEGREE, 0.0)]},
+                        {"coords": [(5000 / DEGREE, 0.0), (5000 / DEGREE, 100 / DEGREE)]},
+                        {"coords": [(5000 / DEGREE, 100 / DEGREE), (0.0, 100 / DEGREE)]}])
+
+
+def test_empty_network():
+    network = RoadNetwork([])
+    segment, distance = network.nearest_segments([0.0, 1.0], [0.0, 1.0])
+    assert segment.tolist() == [-1, -1]
+    assert np.isinf(distance).all()
+    segment, distance = network.candidate_segments([0.0], [0.0], beam=3)
+    assert segment.tolist() == [[-1, -1, -1]]
+    assert np.isinf(distance).all()
+    assert np.isnan(network.speed_limits([0.0], [0.0])).all()
+    assert np.isnan(RoadDistanceEngine(network).distance(0.0, 0.0, 0.001, 0.001))
+
+
+def _random_network(rng, number):
+    # short & long roads in a 400 m square, half of them through one crowded intersection at (200 m, 200 m)
+    roads = []
+    for r in range(number):
+        start = np.full(2, 200.0) if r % 2 == 0 else rng.uniform(0, 400, 2)
+        points = [start]
+        for i in range(rng.integers(1, 4)):
+            points.append(points[-1] + rng.uniform(-1, 1, 2) * rng.choice([5.0, 40.0, 300.0]))
+        roads.append({"coords": [(y / DEGREE, x / DEGREE) for x, y in points], "speed_limit": float(r)})
+    return RoadNetwork(roads)
+
+
+def test_nearest_segments_is_exact():
+    rng = np.random.default_rng(0)
+    for _ in range(10):
+        network = _random_network(rng, 40)
+        lat, long = rng.uniform(-50, 450, (2, 500)) / DEGREE
+        xy = network.project(lat, long)
+        every = network.segment_distance(xy[:, None, :], np.arange(len(network.length))[None, :])
+        for max_distance in (5.0, 30.0, 200.0):
+            segment, distance = network.nearest_segments(lat, long, max_distance)
+            exact = every.min(axis=1)
+            near = exact <= max_distance
+            assert np.allclose(distance[near], exact[near])        # a tie may take either segment
+            assert np.allclose(every[np.flatnonzero(near), segment[near]], exact[near])
+            assert (segment[~near] == -1).all() and np.isinf(distance[~near]).all()
+
+
+def test_empty_network_matches_nothing():
+    network = RoadNetwork([])
+    matcher = MapMatcher(network)
+    assert matcher.match_segments([0.0, 0.001], [0.0, 0.001]).tolist() == [-1, -1]
+    assert matcher.match([0.0, 0.001], [0.0, 0.001]).tolist() == [-1, -1]
+    assert matcher.match([], []).tolist() == []
+    matched = match_data({"1": [[0.0, 0.001], [0.0, 0.001], [5.0, 5.0], [0.0, 0.0], [0, 1]]}, matcher)
+    assert matched == {"1": [-1, -1]}
+    assert matched_speed_limits(network, matched) == {"1": ([], [0, 1])}
+
+
+def test_distance_along_a_road():
+    engine = RoadDistanceEngine(_u_turn_network())
+    distance = engine.distance(1000 / DEGREE, 0.0, 1500 / DEGREE, 0.0)
+    assert abs(distance - 500) < 1
+
+
+def test_default_bound_of_the_search():
+    network = _u_turn_network()
+    lat, long = [100 / DEGREE, 100 / DEGREE], [0.0, 100 / DEGREE]
+    # 100 m apart in a straight line, 10 km apart on the road
+    assert np.isnan(RoadDistanceEngine(network).distances(lat[:1], long[:1], lat[1:], long[1:])[0])
+    unbounded = RoadDistanceEngine(network, limit=np.inf)
+    assert abs(unbounded.distances(lat[:1], long[:1], lat[1:], long[1:])[0] - 9900) < 5
+
+
+def _parallel_network():
+    # two parallel roads 30 m apart and not joined, a segment break at 300 m
+    return RoadNetwork([{"coords": [(0.0, 0.0), (0.0, 300 / DEGREE), (0.0, 700 / DEGREE)], "speed_limit": 10.0},
+                        {"coords": [(30 / DEGREE, 0.0), (30 / DEGREE, 300 / DEGREE), (30 / DEGREE, 700 / DEGREE)],
+                         "speed_limit": 20.0}])
+
+
+def _trace(y):
+    # a point every 20 m going east, y is the distance (m) north of the first road
+    x = np.arange(len(y)) * 20.0
+    return (np.asarray(y, dtype=float) / DEGREE).tolist(), (x / DEGREE).tolist()
+
+
+def test_viterbi_follows_one_of_two_parallel_roads():
+    network = _parallel_network()
+    y = np.full(31, 5.0)
+    y[[10, 11, 20]] = 16.0                      # closer to the second road, the first road is still the most likely
+    lat, long = _trace(y)
+
+    matcher = MapMatcher(network)
+    assert matcher.match_segments(lat, long).tolist() == [0] * 16 + [1] * 15      # the segment break at 300 m
+    assert matcher.match(lat, long).tolist() == [0] * 31
+    assert matched_speed_limits(network, match_data({"1": [lat, long, [5.0] * 31, [90.0] * 31, list(range(31))]},
+                                                    matcher)) == {"1": ([10.0] * 31, list(range(31)))}
+
+
+def test_beam_cutoff():
+    network = _parallel_network()
+    y = np.full(31, 5.0)
+    y[[10, 11, 20]] = 16.0
+    lat, long = _trace(y)
+    # a single candidate (the nearest segment) per point, the chain is broken at the points near the second road
+    segment = MapMatcher(network, beam=1).match_segments(lat, long)
+    assert segment[[10, 11]].tolist() == [2, 2] and segment[20] == 3
+    assert (np.delete(segment, [10, 11, 20]) < 2).all()
+
+    # the points more than radius away from every road are not matched
+    assert MapMatcher(network, radius=10.0).match(lat, long).tolist() == [0] * 10 + [-1, -1] + [0] * 8 + [-1] + \
+        [0] * 10
+
+
+def test_restart_after_a_gap():
+    network = _parallel_network()
+    y = np.concatenate((np.full(14, 5.0), np.full(3, 200.0), np.full(14, 27.0)))   # off the roads, then road 2
+    lat, long = _trace(y)
+    matcher = MapMatcher(network)
+    assert matcher.match(lat, long).tolist() == [0] * 14 + [-1] * 3 + [1] * 14
+    assert matcher.match_segments(lat, long)[17:].tolist() == [3] * 14
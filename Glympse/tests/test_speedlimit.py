@@ -0,0 +1,156 @@
+import pickle
+
+import numpy as np
+import pytest
+
+import speedlimit
+
+DEGREE = 111195.0       # meters of a degree of latitude
+
+
+@pytest.fixture
+def default_sampling(monkeypatch):
+    monkeypatch.setattr(speedlimit, "sampling", dict(speedlimit.sampling))
+    return speedlimit.sampling
+
+
+def straight_trip(n, step=10.0):
+    return (np.arange(n) * step / DEGREE).tolist(), [0.0] * n
+
+
+def test_points_take_the_nearest_query_point(default_sampling):
+    lat, long = straight_trip(10)
+    call_api = speedlimit.QueryPoints([0, 5, 9], assign="nearest")
+    limits = speedlimit.point_speed_limits([10.0, 20.0, 30.0], call_api, lat, long)
+    assert limits.tolist() == [10.0, 10.0, 10.0, 20.0, 20.0, 20.0, 20.0, 20.0, 30.0]
+
+
+def test_nearest_follows_the_travelled_distance(default_sampling):
+    lat, long = straight_trip(10)
+    lat[1:4] = [lat[0]] * 3                     # a stop, the points 0 to 3 are at the same place
+    limits = speedlimit.point_speed_limits([10.0, 20.0], [3, 6], lat, long, assign="nearest")
+    assert limits.tolist() == [10.0] * 4 + [20.0] * 5
+
+
+def test_plain_list_takes_the_query_point_ahead(default_sampling):
+    lat, long = straight_trip(10)
+    speedlimit.set_sampling("douglas_peucker")          # the global sampling does not change the mapping
+    limits = speedlimit.point_speed_limits([10.0, 20.0, 30.0], [0, 5, 9], lat, long)
+    assert limits.tolist() == [10.0, 20.0, 20.0, 20.0, 20.0, 20.0, 30.0, 30.0, 30.0]
+
+
+def test_default_sampling_is_the_speed_change(default_sampling):
+    assert default_sampling["method"] == "speed"
+    call_api = speedlimit.query_points([0.0, 10.0, 10.0, 20.0, 20.0, 5.0])
+    assert call_api == [1, 3] and call_api.assign == "ahead"
+
+
+def test_query_points_keep_their_assign(default_sampling):
+    # 1500 m north then 500 m east, a point every 10 m
+    lat = (np.concatenate((np.arange(151) * 10, np.full(50, 1500))) / DEGREE).tolist()
+    long = (np.concatenate((np.zeros(151), np.arange(1, 51) * 10)) / DEGREE).tolist()
+    speed = [10.0] * len(lat)
+    speedlimit.set_sampling("douglas_peucker", tolerance=20, max_distance=1000)
+    call_api = speedlimit.query_points(speed, lat, long)
+    assert call_api[0] == 0 and call_api[2:] == [150, len(lat) - 2]     # the start, the corner & the end
+    assert call_api[1] in (100, 101)                                    # a point every 1000 m
+    assert call_api.assign == "nearest"
+
+    limits = [10.0, 20.0, 30.0, 40.0]
+    nearest = speedlimit.point_speed_limits(limits, call_api, lat, long)
+    speedlimit.set_sampling("speed")                                    # the mapping is kept with the points
+    assert speedlimit.point_speed_limits(limits, call_api, lat, long).tolist() == nearest.tolist()
+    assert pickle.loads(pickle.dumps(call_api)).assign == "nearest"     # sent back by the pool workers
+    assert speedlimit.query_points(speed, lat, long, method="distance", assign="ahead").assign == "ahead"
+
+
+class FakeRoads:
+    """The MapsClient of the Roads API, answers the given result & counts the points queried"""
+
+    def __init__(self, result):
+        self.result = result
+        self.points = 0
+
+    def snapped_speed_limits_many(self, paths):
+        self.points += sum(len(path) for path in paths)
+        return [self.result(path) for path in paths]
+
+
+def test_cache_ttl_and_stats(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(speedlimit.time, "time", lambda: now[0])
+    cache = speedlimit.SpeedLimitCache(str(tmp_path / "cache.sqlite"), ttl=60)
+    cache.put_many([(34.0, -118.0), (34.001, -118.0), (34.002, -118.0)], [20.0, speedlimit.NO_ROAD, None])
+
+    assert cache.get_many([(34.00001, -118.00001), (34.001, -118.0), (34.002, -118.0)]) == \
+        [20.0, speedlimit.NO_ROAD, None]                        # the same cell, NO_ROAD is kept, None is not stored
+    now[0] += 61
+    assert cache.get_many([(34.0, -118.0), (34.001, -118.0)]) == [None, None]       # expired
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 3)
+    assert stats["hit_rate"] == pytest.approx(0.4)
+    other = speedlimit.SpeedLimitCache(str(tmp_path / "cache.sqlite"), ttl=60)      # another process of the file
+    other.get_many([(34.0, -118.0)])
+    assert other.stats()["hits"] == 0 and other.stats()["total_misses"] == 4
+    assert other.stats()["total_hit_rate"] == pytest.approx(2 / 6)
+
+
+def test_cache_metrics_are_flushed_in_batches(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = speedlimit.SpeedLimitCache(path, flush_every=3)
+    cache.put_many([(34.0, -118.0)], [20.0])
+    other = speedlimit.SpeedLimitCache(path)
+
+    def total():
+        with other._lock:
+            return dict(other._connection().execute("SELECT name, value FROM metrics").fetchall())
+
+    cache.get_many([(34.0, -118.0), (35.0, -118.0)])
+    cache.get_many([(34.0, -118.0)])
+    assert total() == {"hits": 0, "misses": 0}                 # nothing is written by a lookup
+    assert (cache.hits, cache.misses) == (2, 1)
+    cache.get_many([(35.0, -118.0)])
+    assert total() == {"hits": 2, "misses": 2}                 # written every flush_every calls
+    cache.get_many([(34.0, -118.0)])
+    cache.flush()
+    assert total() == {"hits": 3, "misses": 2}
+    cache.get_many([(35.0, -118.0)])
+    cache.close()
+    assert total() == {"hits": 3, "misses": 3}
+    assert cache.stats()["total_misses"] == 3                  # a closed cache opens the file again
+
+
+def test_offline_provider_past_max_distance():
+    from roadnet import RoadNetwork
+    network = RoadNetwork([{"coords": [(0.0, 0.0), (0.0, 500 / DEGREE)], "speed_limit": 10.0},
+                           {"coords": [(1000 / DEGREE, 0.0), (1000 / DEGREE, 500 / DEGREE)]}])   # no speed limit
+    points = [(20 / DEGREE, 100 / DEGREE), (40 / DEGREE, 100 / DEGREE), (0.0, 540 / DEGREE),
+              (1000 / DEGREE, 100 / DEGREE), (500 / DEGREE, 100 / DEGREE)]
+    provider = speedlimit.OfflineSpeedLimitProvider(network)
+    assert provider.speed_limits(points) == [10.0, None, None, None, None]       # no road past 30 m
+    provider = speedlimit.OfflineSpeedLimitProvider(network, max_distance=50.0)
+    assert provider.speed_limits_many([points[:2], [], points[2:]]) == [[10.0, 10.0], [], [10.0, None, None]]
+
+
+def test_provider_caches_no_road_of_snapped_points_only(tmp_path):
+    cache = speedlimit.SpeedLimitCache(str(tmp_path / "cache.sqlite"))
+    points = [(34.0, -118.0), (34.001, -118.0), (34.002, -118.0)]
+
+    # the key has no speed limit access, nothing is cached
+    roads = FakeRoads(lambda path: {"snappedPoints": [{"originalIndex": i, "placeId": "a"} for i in range(len(path))]})
+    provider = speedlimit.RoadsApiProvider(cache=cache, client=roads)
+    assert provider.speed_limits(points) == [None, None, None]
+    assert cache.get_many(points) == [None, None, None]
+
+    # point 0 has a limit, point 1 is on a road without limit, point 2 is not snapped
+    place = {points[0]: "a", points[1]: "b"}
+    roads = FakeRoads(lambda path: {"snappedPoints": [{"originalIndex": i, "placeId": place[point]}
+                                                      for i, point in enumerate(path) if point in place],
+                                    "speedLimits": [{"placeId": "a", "speedLimit": 72}]})
+    provider = speedlimit.RoadsApiProvider(cache=cache, client=roads)
+    assert provider.speed_limits(points) == [pytest.approx(20.0), None, None]
+    assert cache.get_many(points) == [pytest.approx(20.0), speedlimit.NO_ROAD, None]
+
+    assert provider.speed_limits(points) == [pytest.approx(20.0), None, None]
+    assert roads.points == 3 + 1                                # only the unsnapped point is queried again
@@ -0,0 +1,114 @@
+import copy
+
+import numpy as np
+import pytest
+
+import Maneuver_detect as M
+from streaming import StreamingDetector, stream_data
+
+
+def switch_trip():
+    # an acceleration & a turning before the missing speed point 20, two hardbrakes after it
+    n = 40
+    speed = [10.0] * 5 + [14.0, 18.0, 22.0, 26.0] + [26.0] * 16 + [14.0, 2.0] + [2.0] * 13
+    speed[20] = None
+    heading = [0.0] * 8 + [30.0, 60.0, 90.0] + [90.0] * (n - 11)
+    heading[3] = None
+    return [(np.arange(n) * 1e-4).tolist(), [0.0] * n, speed, heading, list(range(0, 2 * n, 2))]
+
+
+def random_trip(rng, n):
+    speed = rng.uniform(0, 30, n).round(1).tolist()
+    heading = rng.uniform(0, 360, n).round(0).tolist()
+    for i in rng.choice(n, n // 10, replace=False):
+        heading[i] = None
+    if rng.random() < 0.5:
+        speed[int(rng.integers(0, n - 1))] = None
+    lat = np.cumsum(rng.uniform(0, 3e-4, n)).tolist()
+    long = np.cumsum(rng.uniform(0, 3e-4, n)).tolist()
+    time = np.cumsum(rng.integers(1, 4, n)).tolist()
+    return [lat, long, speed, heading, time]
+
+
+def replay(events):
+    """The events a consumer ends with, a switch drops the ACC & HB events before it & takes the raw ones"""
+    kept, raw = [], []
+    for event in events:
+        if event[0] == "switch":
+            kept = [kept_event for kept_event in kept if kept_event[0] == "turning"] + raw
+        elif event[0].startswith("raw "):
+            raw.append((event[0][4:],) + event[1:])
+        else:
+            kept.append(event)
+    return kept
+
+
+def test_event_stream_around_the_switch():
+    detector = StreamingDetector("task")
+    stream = []
+    for i, point in enumerate(zip(*switch_trip())):
+        events = detector.push(*point)
+        if events:
+            stream.append((i, events))
+    assert stream == [(10, [("raw ACC", 4, 8)]),
+                      (11, [("ACC", 5, 8)]),                    # smoothed speed
+                      (12, [("turning", 5, 12)]),
+                      (21, [("switch",)]),                      # point 20 has no speed, the raw speed is used
+                      (26, [("HB", 24)]),
+                      (27, [("HB", 25)])]
+    result = detector.finish()
+    assert result == {"turning": [[5, 12], 1], "ACC": [[4, 8], 1], "HB": [[24, 25], 2], "events": []}
+
+    data = M.organize_data({"task": switch_trip()})
+    assert M.find_dic_ACC(data)[0]["task"] == result["ACC"]
+    assert M.find_dic_HB(data)[0]["task"] == result["HB"]
+    assert M.find_dic_turning(data)[0]["task"] == result["turning"]
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_replayed_events_match_the_batch_results(seed):
+    rng = np.random.default_rng(seed)
+    data = {str(i): random_trip(rng, int(rng.integers(30, 200))) for i in range(50)}
+    dict_turning, dict_acc, dict_hb = stream_data(copy.deepcopy(data), chunk_size=7)
+    organized = M.organize_data(copy.deepcopy(data))
+    assert dict_turning == M.find_dic_turning(organized)[0]
+    assert dict_acc == M.find_dic_ACC(organized)[0]
+    assert dict_hb == M.find_dic_HB(organized)[0]
+
+    for key, value in data.items():
+        detector = StreamingDetector(key)
+        events = detector.extend(*value)
+        result = detector.finish()
+        events = replay(events + result["events"])
+        acc = [bp for event in events if event[0] == "ACC" for bp in event[1:]]
+        assert sorted(acc) == sorted(result["ACC"][0])
+        assert sorted(event[1] for event in events if event[0] == "HB") == sorted(result["HB"][0])
+        assert [bp for event in events if event[0] == "turning" for bp in event[1:]] == result["turning"][0]
+
+
+def test_keep_false_keeps_the_counts_only():
+    detector = StreamingDetector("task", keep=False)
+    trip = switch_trip()
+    detector.extend(*[column[:22] for column in trip])
+    assert detector.smoothed is None
+    assert detector.raw.acc is None and detector.raw.hb is None
+    assert detector.turning is None
+    detector.extend(*[column[22:] for column in trip])
+    result = detector.finish()
+    assert result == {"turning": [None, 1], "ACC": [None, 1], "HB": [None, 2], "events": []}
+
+
+def test_keep_false_does_not_buffer_a_clean_task():
+    rng = np.random.default_rng(3)
+    trip = random_trip(rng, 5000)
+    trip[2] = [10.0 if speed is None else speed for speed in trip[2]]      # no switch
+    detector = StreamingDetector("task", keep=False)
+    events = detector.extend(*trip)
+    assert any(event[0].startswith("raw ") for event in events)
+    assert not detector.missing
+    assert detector.raw.acc is None and detector.smoothed.acc is None
+    assert len(detector.smooth.window) <= 3 and len(detector.headings) <= 5
+    result = detector.finish()
+    organized = M.organize_data({"task": trip})
+    assert result["ACC"][1] == M.find_dic_ACC(organized)[0]["task"][1]
+    assert result["HB"][1] == M.find_dic_HB(organized)[0]["task"][1]
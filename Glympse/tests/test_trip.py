@@ -0,0 +1,140 @@
+import copy
+import pickle
+
+import numpy as np
+import pytest
+
+import Maneuver_detect as M
+import trip as T
+from Query import _columnar_chunk
+from trip import Trip
+from tripfile import write_trip
+
+
+def random_trip(rng, n, missing=True):
+    lat = (34.0 + np.cumsum(rng.uniform(0, 3e-4, n))).tolist()
+    long = (-118.0 + np.cumsum(rng.uniform(0, 3e-4, n))).tolist()
+    speed = rng.uniform(0, 30, n).round(1).tolist()
+    heading = rng.uniform(0, 360, n).round(0).tolist()
+    time = (1600000000 + np.cumsum(rng.integers(0, 4, n))).tolist()
+    if missing:
+        for i in rng.choice(n, n // 10, replace=False):
+            heading[i] = None
+        for i in rng.choice(n, n // 20, replace=False):
+            speed[i] = None
+    return [lat, long, speed, heading, time]
+
+
+def random_data(seed, number=40, missing=True):
+    rng = np.random.default_rng(seed)
+    data = {str(i): random_trip(rng, int(rng.integers(2, 150)), missing) for i in range(number)}
+    data["empty"] = [[], [], [], [], []]
+    data["single"] = random_trip(rng, 1, missing=False)
+    return data
+
+
+def test_trip_columns():
+    trip = Trip([34.0, 34.1], [-118.0, -118.1], [5.0, None], [None, 90.0], [1600000000, 1600000001])
+    assert [column.dtype for column in trip] == list(T.DTYPES)
+    assert trip.points == 2 and len(trip) == 5
+    assert trip.nbytes == 2 * 40
+    assert trip[2] is trip.speed and np.isnan(trip.speed[1])
+    assert trip[3:] == [trip.heading, trip.time]
+    trip[2] = [1, 2]
+    assert trip.speed.dtype == np.float64
+    with pytest.raises(AttributeError):
+        trip.extra = 1                                          # __slots__, no __dict__
+    copied = pickle.loads(pickle.dumps(trip))
+    assert copied.to_list() == trip.to_list()
+
+
+def test_from_data_to_data_round_trip():
+    data = random_data(0)
+    trips = T.from_data(data)
+    assert all(isinstance(trip, Trip) for trip in trips.values())
+    assert trips["empty"].points == 0 and trips["single"].points == 1
+    assert T.to_data(trips) == data
+
+
+def test_open_trips_of_a_trip_file(tmp_path):
+    data = random_data(1)
+    filename = str(tmp_path / "trips")
+    write_trip(filename, *_columnar_chunk(data))
+    trips = T.open_trips(filename)
+
+    assert list(trips) == list(data)
+    assert not trips["0"].lat.flags.owndata                     # a view of the memory-mapped file, no copy
+    assert not trips["0"].lat.flags.writeable
+    assert T.to_data(trips) == data
+
+
+@pytest.mark.parametrize("seed", [2, 3])
+def test_detectors_on_trip_match_the_list_form(seed):
+    data = random_data(seed)
+    trips = T.from_data(copy.deepcopy(data))
+
+    organized = M.organize_data(copy.deepcopy(data))
+    organized_trips = M.organize_data(trips)
+    assert list(organized_trips) == list(organized)
+    for key, value in organized.items():
+        assert np.array_equal(organized_trips[key][2], value[2])
+        assert np.array_equal(organized_trips[key][3], value[3])
+
+    for find in (M.find_dic_turning, M.find_dic_ACC, M.find_dic_HB):
+        assert find(organized_trips) == find(organized)
+    assert M.total_time(organized_trips) == M.total_time(organized)
+    for key, value in organized.items():
+        assert M.find_maneuver(*organized_trips[key][2:]) == M.find_maneuver(*value[2:])
+
+    raw = {key: value for key, value in data.items() if None not in value[2] and None not in value[3]}
+    raw_trips = T.from_data(raw)
+    for find in (M.find_dic_turning, M.find_dic_ACC, M.find_dic_HB):
+        assert find(raw_trips) == find(raw)
+
+
+def assert_batch_matches(data):
+    batch = T.TripBatch.from_data(data)
+    assert batch.points == sum(len(value[4]) for value in data.values())
+    assert T.find_batch_HB(batch) == M.find_dic_HB(data)
+    assert T.find_batch_ACC(batch) == M.find_dic_ACC(data)
+    dict_turning, turning_number = M.find_dic_turning(data)
+    assert T.find_batch_turning(batch) == (dict_turning, turning_number)
+    assert T.batch_total_time(batch) == M.total_time(data)
+
+    turning_speed = T.batch_turning_speed(batch)
+    assert sorted(turning_speed) == sorted(dict_turning)
+    for key, (breakpoint, number) in dict_turning.items():
+        assert turning_speed[key][0] == pytest.approx(M.calculate_average_speed(data, key, breakpoint, number))
+        assert turning_speed[key][1] == M.count_fast_turn(data, key, breakpoint)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_batch_detectors_match_the_per_trip_functions(seed):
+    data = random_data(seed, number=60, missing=False)
+    rng = np.random.default_rng(seed)
+    for n in (0, 1, 2, 3):                                      # short trips between the others
+        data["short{}".format(n)] = random_trip(rng, n, missing=False)
+    data["empty first"] = [[], [], [], [], []]
+    data = {key: data[key] for key in sorted(data, key=lambda key: rng.random())}
+    assert_batch_matches(data)
+
+    organized = M.organize_data(random_data(seed, number=60))
+    assert_batch_matches(organized)
+
+
+def test_batch_of_empty_and_single_point_trips():
+    assert_batch_matches({})
+    assert_batch_matches({"empty": [[], [], [], [], []]})
+    assert_batch_matches({"single": [[34.0], [-118.0], [20.0], [90.0], [1600000000]],
+                          "empty": [[], [], [], [], []]})
+
+
+def test_batch_of_a_trip_file(tmp_path):
+    data = random_data(5, missing=False)
+    filename = str(tmp_path / "trips")
+    write_trip(filename, *_columnar_chunk(data))
+    batch = T.TripBatch.open(filename)
+
+    assert batch.keys == list(data)
+    assert T.to_data(batch.to_trips()) == data
+    assert T.find_batch_ACC(batch) == M.find_dic_ACC(data)
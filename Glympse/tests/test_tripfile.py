@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+import pytest
+
+from Query import _columnar_chunk
+from tripfile import TRIP_MAGIC, TripFile, append_trip, open_columnar, read_index, write_trip
+
+
+def random_data(seed, number=10, prefix=""):
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i in range(number):
+        n = int(rng.integers(0, 50)) if i > 0 else 0            # the first task is empty
+        speed = rng.uniform(0, 30, n).round(1).tolist()
+        heading = rng.uniform(0, 360, n).round(0).tolist()
+        for k in rng.choice(n, n // 5, replace=False):
+            speed[k] = None
+            heading[k] = None
+        data[prefix + str(i)] = [(34.0 + rng.uniform(0, 1, n)).tolist(), (-118.0 + rng.uniform(0, 1, n)).tolist(),
+                                 speed, heading, (1600000000 + np.cumsum(rng.integers(0, 4, n))).tolist()]
+    return data
+
+
+def assert_same_file(filename, data):
+    assert open_columnar(filename) == data
+    trip_file = TripFile(filename)
+    assert list(trip_file) == list(data) and len(trip_file) == len(data)
+    for key, value in data.items():
+        columns = trip_file[key]
+        assert [column.dtype for column in columns] == [np.float64] * 4 + [np.int64]
+        assert columns[4].tolist() == value[4]
+    for i, column in enumerate(trip_file.columns):
+        expected = [v for value in data.values() for v in value[i]]
+        assert [None if v != v else v for v in column.tolist()] == expected
+
+
+def test_single_block_round_trip(tmp_path):
+    filename = str(tmp_path / "trips")
+    data = random_data(0)
+    write_trip(filename, *_columnar_chunk(data))
+
+    with open(filename + '.trip', 'rb') as fp:
+        assert fp.read(len(TRIP_MAGIC)) == TRIP_MAGIC
+    index = read_index(filename)
+    assert len(index["blocks"]) == 1 and index["tasks"] == list(data)
+    assert TripFile(filename)["0"][0].tolist() == []                # the empty task
+    assert_same_file(filename, data)
+
+
+def test_multi_block_round_trip(tmp_path):
+    filename = str(tmp_path / "trips")
+    data = {}
+    for chunk in range(3):
+        chunk_data = random_data(chunk, prefix="{}-".format(chunk))
+        append_trip(filename, *_columnar_chunk(chunk_data))
+        data.update(chunk_data)
+    append_trip(filename, *_columnar_chunk({"empty": [[], [], [], [], []]}))   # an empty block
+    data["empty"] = [[], [], [], [], []]
+
+    assert len(read_index(filename)["blocks"]) == 4
+    assert_same_file(filename, data)
+
+
+def test_empty_file(tmp_path):
+    filename = str(tmp_path / "trips")
+    write_trip(filename, *_columnar_chunk({}))
+    assert open_columnar(filename) == {}
+    assert [len(column) for column in TripFile(filename).columns] == [0] * 5
+
+    write_trip(filename, *_columnar_chunk({"1": [[], [], [], [], []]}))
+    assert open_columnar(filename) == {"1": [[], [], [], [], []]}
+
+
+def test_not_a_trip_file(tmp_path):
+    filename = str(tmp_path / "trips")
+    write_trip(filename, *_columnar_chunk(random_data(0)))
+    with open(filename + '.trip', 'r+b') as fp:
+        fp.write(b"NOTATRIP")
+    with pytest.raises(ValueError):
+        TripFile(filename)
+
+
+def test_append_chunks_and_reopen(tmp_path):
+    filename = str(tmp_path / "trips")
+    data = {}
+    for chunk in range(4):
+        chunk_data = random_data(chunk, number=5, prefix="{}-".format(chunk))
+        append_trip(filename, *_columnar_chunk(chunk_data))
+        data.update(chunk_data)
+        assert_same_file(filename, data)                        # reopened after every append
+
+    index = read_index(filename)
+    assert [block[0] for block in index["blocks"]] == [index["offsets"][list(data).index("{}-0".format(chunk))]
+                                                       for chunk in range(4)]
+    assert index["size"] == len(TRIP_MAGIC) + 40 * index["offsets"][-1]
+
+
+def test_append_drops_the_rows_after_the_index(tmp_path):
+    filename = str(tmp_path / "trips")
+    data = random_data(0)
+    write_trip(filename, *_columnar_chunk(data))
+    size = read_index(filename)["size"]
+    with open(filename + '.trip', 'ab') as fp:                 # an append interrupted before the index is written
+        fp.write(b"\x01" * 123)
+    assert_same_file(filename, data)                            # the index does not see the trailing rows
+
+    more = random_data(1, prefix="more-")
+    append_trip(filename, *_columnar_chunk(more))
+    data.update(more)
+    assert read_index(filename)["blocks"][-1][2] == size       # written where the indexed file ended
+    assert read_index(filename)["size"] == size + 40 * sum(len(value[4]) for value in more.values())
+    assert os.path.getsize(filename + '.trip') == read_index(filename)["size"]     # the trailing rows are cut off
+    assert_same_file(filename, data)